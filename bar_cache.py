@@ -0,0 +1,215 @@
+
+'''
+Caché de Barras Históricas
+
+Guarda en disco las barras históricas que se piden a TWS para no volver a pedirlas en cada
+lectura de la hoja ni después de reiniciar el bot.
+
+ - Hay un fichero por contrato (conId), tamaño de barra, tipo de dato (whatToShow) y modo de
+   datos (en tiempo real, o retrasados y gratuitos con "marquet_data_delayed_but_free"). Los datos
+   retrasados van a su propio fichero para no mezclarse con los de tiempo real.
+ - Cada fichero es un arreglo de registros de tamaño fijo (BAR_DTYPE) que se lee con np.memmap
+   sin cargarlo completo y al que se agregan las barras nuevas al final.
+ - Solo se piden a TWS las barras posteriores a la última guardada. La última barra se vuelve a
+   pedir y se sustituye, porque mientras no se cierra puede cambiar.
+ - Mientras no pasa el tiempo de una barra desde la última consulta, el precio se sirve de
+   memoria sin consultar a TWS.
+ - bars() devuelve las columnas open, high, low y close en el formato de GridBacktester y
+   GridSweep, así que los backtests pueden usar las mismas barras que el bot.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from datetime import datetime, date, timezone
+from ib_insync import BarData
+from clock import RealClock
+import numpy as np
+import logging
+import math
+import os
+import time
+import metrics
+
+BAR_DTYPE = np.dtype([
+    ('time', '<f8'),            # Inicio de la barra (epoch UTC).
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('average', '<f8'),
+    ('barCount', '<i8'),
+])
+BAR_SECONDS = {
+    '1 secs': 1, '5 secs': 5, '10 secs': 10, '15 secs': 15, '30 secs': 30,
+    '1 min': 60, '2 mins': 120, '3 mins': 180, '5 mins': 300, '10 mins': 600, '15 mins': 900, '20 mins': 1200, '30 mins': 1800,
+    '1 hour': 3600, '2 hours': 7200, '3 hours': 10800, '4 hours': 14400, '8 hours': 28800,
+    '1 day': 86400,
+}
+MARKET_DATA_LIVE = 1
+MARKET_DATA_DELAYED = 3
+
+
+class BarCache:
+
+    def __init__(self, folder='./bars', barSize='1 min', whatToShow='TRADES', initialDays=2, useRTH=False, clock=None):
+        '''
+        folder: Folder of the bar files.
+        barSize: Bar size of TWS, one of BAR_SECONDS.
+        whatToShow: Type of data of TWS: TRADES, MIDPOINT, BID, ASK...
+        initialDays: Days requested for a contract without cached bars. It is also the longest request.
+        useRTH: True to request only the bars of the regular trading hours.
+        clock: Clock of the refresh time and of the requested window. By default the clock of the system.
+        '''
+        if barSize not in BAR_SECONDS:
+            raise ValueError(f'Unknown bar size: {barSize}')
+        self.folder = folder
+        self.barSize = barSize
+        self.whatToShow = whatToShow
+        self.initialDays = initialDays
+        self.useRTH = useRTH
+        self.clock = clock if clock is not None else RealClock()
+        self.lastRequest = {}       # Fichero -> hora de la ultima consulta a TWS.
+        self.lastBar = {}           # Fichero -> ultima barra, para servirla sin leer el disco.
+        self.log = logging.getLogger('grid')
+        os.makedirs(folder, exist_ok=True)
+
+
+
+    def file_name(self, conId, free=False, barSize=None, whatToShow=None):
+        '''Returns the path of the file of the contract.'''
+        barSize = (barSize or self.barSize).replace(' ', '')
+        mode = '_delayed' if free else ''
+        return os.path.join(self.folder, f'{conId}_{barSize}_{whatToShow or self.whatToShow}{mode}.bars')
+
+
+
+    def market(self, ib, contract, free=True):
+        '''
+        Returns the last bar of the contract as BarData, like request_historical().
+        The bars are requested to TWS only if the time of a bar has passed since the last request.
+        free: True to use the delayed and free market data.
+        '''
+        fileName = self.file_name(contract.conId, free)
+        if self.clock.time() - self.lastRequest.get(fileName, 0) >= BAR_SECONDS[self.barSize] or fileName not in self.lastBar:
+            self.update(ib, contract, free)
+        record = self.lastBar.get(fileName)
+        if record is None:
+            return None
+        return BarData(
+            date=datetime.fromtimestamp(record['time'], timezone.utc),
+            open=float(record['open']), high=float(record['high']), low=float(record['low']), close=float(record['close']),
+            volume=float(record['volume']), average=float(record['average']), barCount=int(record['barCount'])
+        )
+
+
+
+    def update(self, ib, contract, free=True):
+        '''
+        Requests to TWS the bars after the last cached one and adds them to the file.
+        return: Number of bars received, or None if the request failed.
+        '''
+        fileName = self.file_name(contract.conId, free)
+        stored = self.read_file(fileName)
+        lastTime = float(stored['time'][-1]) if len(stored) > 0 else None
+        self.lastRequest[fileName] = self.clock.time()
+        try:
+            if hasattr(ib, 'wait_data_slot'):
+                ib.wait_data_slot()
+            timeBegin = time.time()
+            ib.reqMarketDataType(MARKET_DATA_DELAYED if free else MARKET_DATA_LIVE)
+            bars = ib.reqHistoricalData(
+                contract, endDateTime='', durationStr=self._duration(lastTime), barSizeSetting=self.barSize,
+                whatToShow=self.whatToShow, useRTH=self.useRTH, formatDate=2
+            )
+            metrics.TWS_REQUEST_SECONDS.observe(time.time() - timeBegin, request='historical')
+        except Exception as e:
+            self.log.exception(f'Error requesting the bars of {contract.symbol}({contract.conId}): {str(e)}')
+            return None
+        records = self._records(bars or [])
+        if lastTime is not None:
+            records = records[records['time'] >= lastTime]
+        if len(records) == 0:
+            if len(stored) > 0:
+                self.lastBar[fileName] = stored[-1].copy()
+            return 0
+        keep = int(np.searchsorted(stored['time'], records['time'][0], side='left'))
+        del stored      # Libera el mapeo antes de truncar el fichero.
+        self._write(fileName, keep, records)
+        self.lastBar[fileName] = records[-1].copy()
+        return len(records)
+
+
+
+    def bars(self, conId, free=False, begin=None, end=None, barSize=None, whatToShow=None):
+        '''
+        Returns the cached bars of a contract as a dictionary of arrays: time, open, high, low, close, volume.
+        It is the format that GridBacktester.run() and GridSweep use.
+        begin, end: Optional limits as epoch seconds or datetimes.
+        '''
+        return self.columns(self.read_file(self.file_name(conId, free, barSize, whatToShow)), begin, end)
+
+
+
+    @staticmethod
+    def read_file(fileName):
+        '''Returns the records of a bar file as a read only memory mapped array. Empty if it does not exist.'''
+        if not os.path.exists(fileName) or os.path.getsize(fileName) < BAR_DTYPE.itemsize:
+            return np.zeros(0, dtype=BAR_DTYPE)
+        count = os.path.getsize(fileName) // BAR_DTYPE.itemsize     # Un registro a medio escribir se ignora.
+        return np.memmap(fileName, dtype=BAR_DTYPE, mode='r', shape=(count,))
+
+
+
+    @staticmethod
+    def columns(records, begin=None, end=None):
+        '''Selects the records between begin and end and returns their columns as arrays.'''
+        if begin is not None or end is not None:
+            times = records['time']
+            first = 0 if begin is None else int(np.searchsorted(times, _epoch(begin), side='left'))
+            last = len(records) if end is None else int(np.searchsorted(times, _epoch(end), side='right'))
+            records = records[first:last]
+        return {name: np.array(records[name]) for name in ('time', 'open', 'high', 'low', 'close', 'volume')}
+
+
+
+    def _write(self, fileName, keep, records):
+        '''Writes the records after the first keep records of the file, replacing the rest.'''
+        with open(fileName, 'r+b' if os.path.exists(fileName) else 'wb') as file:
+            file.truncate(keep * BAR_DTYPE.itemsize)
+            file.seek(keep * BAR_DTYPE.itemsize)
+            file.write(records.tobytes())
+
+
+
+    def _duration(self, lastTime):
+        '''Returns the durationStr that covers from the last cached bar until now.'''
+        if lastTime is None:
+            return f'{self.initialDays} D'
+        seconds = self.clock.time() - lastTime + BAR_SECONDS[self.barSize]
+        if seconds <= 86400:
+            return f'{max(int(math.ceil(seconds)), 30)} S'
+        return f'{min(int(math.ceil(seconds / 86400)), self.initialDays)} D'
+
+
+
+    def _records(self, bars):
+        '''Converts the BarData of ib_insync to records sorted by time.'''
+        records = np.zeros(len(bars), dtype=BAR_DTYPE)
+        for index, bar in enumerate(bars):
+            records[index] = (
+                _epoch(bar.date), bar.open, bar.high, bar.low, bar.close,
+                bar.volume or 0, bar.average or 0, bar.barCount or 0
+            )
+        return records[np.argsort(records['time'], kind='stable')]
+
+
+
+def _epoch(value):
+    '''Converts a datetime (naive is local time), a date (UTC midnight) or a number to epoch seconds.'''
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp()
+    return float(value)
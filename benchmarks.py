@@ -0,0 +1,298 @@
+
+'''
+Benchmarks del Bot
+
+Mide el tiempo de las rutas críticas del bot y guarda los resultados en JSON para poder
+compararlos entre commits:
+ - Empaquetado y desempaquetado de identificadores con OrderIdManager.
+ - RiskManager.can_operate con 10, 100, 1000 y 10000 órdenes abiertas.
+ - Reserva y liberación de una orden en el libro de riesgo compartido, a través del socket.
+ - Lectura de una tabla de 300 filas de la hoja de estrategias (GoogleSheetsInterface y MultiParameters).
+ - TradingCalendar.market_open.
+ - Puesta de un grid y latencia de las reacciones en Core contra el broker simulado.
+
+Cada benchmark se repite varias veces y se guarda la mediana y el mejor tiempo por operación.
+Los benchmarks cuyos módulos no se pueden importar se marcan como no disponibles.
+Con --baseline se compara contra un fichero anterior y termina con error si alguno empeora
+más que la tolerancia.
+
+Uso:
+    python benchmarks.py --save-baseline
+    python benchmarks.py --baseline ./benchmarks/baseline.json --tolerance 0.25
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from datetime import datetime, timedelta
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+RESULTS_FILE = './benchmarks/results.json'
+BASELINE_FILE = './benchmarks/baseline.json'
+RISK_ORDER_COUNTS = [10, 100, 1000, 10000]
+SHEET_ROWS = 300
+CONFIGURATION = {'debug_mode': False, 'client_tws': 7, 'google_sheets_credentials': '', 'google_sheets_document_id': ''}
+
+
+def measure(function, number, repeat=5):
+    '''
+    Runs function number times per repetition.
+    return: Dictionary with the median and the best seconds per operation.
+    '''
+    times = []
+    for _ in range(repeat):
+        timeBegin = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - timeBegin) / number)
+    return {"status": 'ok', "secondsPerOperation": statistics.median(times), "bestSecondsPerOperation": min(times), "operations": number, "repeat": repeat}
+
+
+
+def bench_order_id():
+    from order_id_manager import OrderIdManager
+    manager = OrderIdManager(7)
+    orderId = manager.create_id(123456, 12, 'SELL', number=99)
+    return {
+        "order_id_pack": measure(lambda: manager.pack(7, 123456, 12, 'SELL', 99), 10000),
+        "order_id_unpack": measure(lambda: manager.unpack(orderId), 10000)
+    }
+
+
+
+def bench_risk():
+    from risk_manager import RiskManager
+    from order_id_manager import OrderIdManager
+    from simulated_broker import SimulatedIB
+    from ib_insync import Stock, LimitOrder
+    results = {}
+    for count in RISK_ORDER_COUNTS:
+        broker = SimulatedIB()
+        broker.orderIdManager = OrderIdManager(CONFIGURATION['client_tws'])
+        contracts = [Stock(f'SIM{number}', 'SMART', 'USD') for number in range(10)]
+        broker.qualifyContracts(*contracts)
+        for number in range(count):
+            contract = contracts[number % len(contracts)]
+            side = 'BUY' if number % 2 == 0 else 'SELL'
+            order = LimitOrder(side, 1, 10 - 0.01 * number if side == 'BUY' else 10 + 0.01 * number)
+            order.orderRef = broker.orderIdManager.create_id(contract.conId, 1, side, number)
+            broker.placeOrder(contract, order)
+        strategy = {"strategyId": 1, "contractId": contracts[0].conId, "contract": contracts[0], "mode": 'STOCK', "orderQty": 1}
+        order = LimitOrder('BUY', 1, 9)
+        order.orderRef = broker.orderIdManager.create_id(contracts[0].conId, 1, 'BUY', count)
+        riskManager = RiskManager(CONFIGURATION)
+        results[f'risk_can_operate_{count}'] = measure(lambda: riskManager.can_operate(order, strategy, broker), max(1, 2000 // count))
+    return results
+
+
+
+def bench_risk_ledger():
+    from risk_ledger import RiskLedgerServer, RiskLedgerClient
+    from risk_manager import RiskManager
+    import tempfile
+    folder = tempfile.mkdtemp()
+    server = RiskLedgerServer(os.path.join(folder, 'ledger.sock') if os.name != 'nt' else r'\\.\pipe\grid_risk_ledger_bench', authkey=b'bench')
+    server.start()
+    try:
+        client = RiskLedgerClient(server.address, CONFIGURATION['client_tws'], b'bench')
+        limits = RiskManager(CONFIGURATION).max
+        for number in range(1000):
+            client.reserve(number, str(number % 10), 'SIM', 'BUY', 1, 10, limits)
+        def reserveAndRelease():
+            client.reserve('bench', '1', 'SIM', 'BUY', 1, 10, limits)
+            client.release('bench')
+        return {"risk_ledger_reserve_release": measure(reserveAndRelease, 1000)}
+    finally:
+        server.stop()
+
+
+
+def sheet_rows(rows=SHEET_ROWS):
+    '''Returns the rows of a strategies sheet with as many two-column tables as fit in the number of rows.'''
+    table = [
+        ['strategyId', '0'], ['strategyType', 'grid'], ['active', 'SI'], ['mode', 'STOCK'], ['symbol', 'AAPL'],
+        ['exchange', 'SMART'], ['currency', 'USD'], ['initialPrice', '150,25'], ['step', '0,5'], ['orderQty', '1'],
+        ['buyOrders', '10'], ['sellOrders', '10'], ['maxLongRisk', '0'], ['maxShortRisk', '0'], ['outsideRth', 'TRUE'],
+        ['refPrice', ''], ['orderAuxPrice', ''], ['activeBuyOrders', ''], ['activeSellOrders', ''], ['stopStep', ''],
+        ['closeStep', ''], ['displaySize', ''], ['futureLastDate', ''], ['futureLocalSymbol', ''], ['futureMultiplier', ''],
+        []
+    ]
+    result = []
+    strategyId = 1
+    while len(result) + len(table) <= rows:
+        result.extend([[row[0], str(strategyId)] if row and row[0] == 'strategyId' else list(row) for row in table])
+        strategyId += 1
+    return result
+
+
+
+def bench_multi_parameters():
+    from multi_parameters import MultiParameters
+    parameters = MultiParameters(CONFIGURATION, 'Estrategias')
+    rows = sheet_rows()
+    parse = lambda: parameters._process_and_filter_strategy_params(parameters.multiTable.parse_tables(rows))
+    if len(parse()) == 0:
+        raise ValueError('The synthetic sheet did not produce any strategy.')
+    return {f"multi_parameters_parse_{SHEET_ROWS}": measure(parse, 100)}
+
+
+
+def bench_trading_calendar():
+    from trading_calendar import TradingCalendar
+    calendar = TradingCalendar('Europe/Berlin')
+    begin = datetime.now().replace(second=0, microsecond=0)
+    moments = [begin + timedelta(minutes=17 * number) for number in range(1000)]
+    iterator = iter(moments * 1000)
+    return {"trading_calendar_market_open": measure(lambda: calendar.market_open('NYMEX', next(iterator), verbose=False), 10000)}
+
+
+
+def bench_grid():
+    from simulated_broker import create_simulated_core, make_strategies, LOAD_TEST_CONFIGURATION
+    logging.getLogger('grid').setLevel(logging.WARNING)
+    core = create_simulated_core(LOAD_TEST_CONFIGURATION)
+    core.connect(clientId=LOAD_TEST_CONFIGURATION['client_tws'])
+    strategies = make_strategies(core, 20, 20, 10)
+    core.parameters.strategies = strategies
+    posts = []
+    for strategy in strategies:
+        timeBegin = time.perf_counter()
+        core.post_grid_orders(strategy, verbose=False)
+        posts.append(time.perf_counter() - timeBegin)
+    # Se mide el manejador de ejecuciones de Core, que pone la orden contraria.
+    reactions = []
+    def timedReaction(trade, fill):
+        timeBegin = time.perf_counter()
+        core.onExecDetailsEvent(trade, fill)
+        reactions.append(time.perf_counter() - timeBegin)
+    core.execDetailsEvent -= core.onExecDetailsEvent
+    core.execDetailsEvent += timedReaction
+    random.seed(1)
+    for _ in range(200):
+        for strategy in strategies:
+            core.set_price(strategy['contractId'], core.simulatedPrices[strategy['contractId']] + random.gauss(0, 0.1))
+    return {
+        "grid_post": _summary(posts),
+        "grid_reaction": _summary(reactions)
+    }
+
+
+
+BENCHMARKS = {
+    "order_id": bench_order_id,
+    "risk": bench_risk,
+    "risk_ledger": bench_risk_ledger,
+    "multi_parameters": bench_multi_parameters,
+    "trading_calendar": bench_trading_calendar,
+    "grid": bench_grid,
+}
+
+
+
+def _summary(samples):
+    '''Summarizes samples measured one by one with the same keys as measure().'''
+    if len(samples) == 0:
+        return {"status": 'unavailable', "error": 'No samples were measured.'}
+    samples = sorted(samples)
+    return {
+        "status": 'ok', "secondsPerOperation": statistics.median(samples), "bestSecondsPerOperation": samples[0],
+        "p99SecondsPerOperation": samples[int(len(samples) * 0.99)], "operations": len(samples), "repeat": 1
+    }
+
+
+
+def run(names=None):
+    '''
+    Runs the benchmarks and returns the report: commit, environment and the results of each benchmark.
+    names: Names of BENCHMARKS to run. By default, all of them.
+    '''
+    log = logging.getLogger('grid')
+    results = {}
+    for name in names or BENCHMARKS.keys():
+        try:
+            results.update(BENCHMARKS[name]())
+        except ImportError as e:
+            results[name] = {"status": 'unavailable', "error": str(e)}
+            log.warning(f'Benchmark {name} is unavailable: {str(e)}')
+        except Exception as e:
+            results[name] = {"status": 'error', "error": str(e)}
+            log.exception(f'Benchmark {name} failed')
+    return {
+        "commit": _commit(),
+        "date": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results
+    }
+
+
+
+def compare(report, baseline, tolerance=0.25):
+    '''
+    Compares the results of two reports.
+    tolerance: Ratio of slowdown allowed before a result is a regression.
+    return: List of (name, baselineSeconds, currentSeconds, ratio) of the results that got slower than the tolerance.
+    '''
+    regressions = []
+    for name, result in report['results'].items():
+        previous = baseline['results'].get(name)
+        if result.get('status') != 'ok' or previous is None or previous.get('status') != 'ok':
+            continue
+        ratio = result['secondsPerOperation'] / previous['secondsPerOperation']
+        if ratio > 1 + tolerance:
+            regressions.append((name, previous['secondsPerOperation'], result['secondsPerOperation'], ratio))
+    return regressions
+
+
+
+def write_report(report, fileName):
+    folder = os.path.dirname(fileName)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(fileName, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the hot paths of the bot.')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS.keys()), help='Benchmarks to run.')
+    parser.add_argument('--output', default=RESULTS_FILE, help='JSON file where the results are written.')
+    parser.add_argument('--baseline', default=None, help='JSON file of a previous run to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Slowdown ratio allowed before failing.')
+    parser.add_argument('--save-baseline', action='store_true', help=f'Also write the results as the baseline {BASELINE_FILE}.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    report = run(args.only)
+    write_report(report, args.output)
+    if args.save_baseline:
+        write_report(report, BASELINE_FILE)
+    for name, result in report['results'].items():
+        if result['status'] == 'ok':
+            print(f"{name:<32} {result['secondsPerOperation'] * 1e6:>12.2f} us/op  (best {result['bestSecondsPerOperation'] * 1e6:.2f})")
+        else:
+            print(f"{name:<32} {result['status']}: {result['error']}")
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.tolerance)
+        for name, previous, current, ratio in regressions:
+            print(f'REGRESSION {name}: {previous * 1e6:.2f} -> {current * 1e6:.2f} us/op (x{ratio:.2f})')
+        sys.exit(1 if regressions else 0)
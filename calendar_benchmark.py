@@ -0,0 +1,109 @@
+
+'''
+Benchmark del Calendario de Trading
+
+Compara el calendario compilado (is_open con búsqueda binaria) contra la implementación por
+reglas (market_open_by_rules) sobre un año de marcas de tiempo de 1 minuto. Informa el tiempo
+de compilación, las consultas por segundo de cada implementación y las diferencias encontradas.
+El calendario compilado se mide con fechas locales, con segundos epoch y con la consulta
+vectorizada, para separar el costo de la conversión de zona horaria del costo de la búsqueda.
+
+Uso:
+    python calendar_benchmark.py [--market NYMEX] [--days 365] [--begin 2023-01-01]
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from trading_calendar import TradingCalendar
+import argparse
+import datetime
+import pytz
+import time
+
+SERVER_LOCATION = "Europe/Berlin"
+
+
+def local_minutes(localTimeZone, begin, days):
+    '''Returns the naive local datetimes of every minute of the period, without the ambiguous or nonexistent ones.'''
+    timeZone = pytz.timezone(localTimeZone)
+    result = []
+    dateTime = datetime.datetime(begin.year, begin.month, begin.day)
+    end = dateTime + datetime.timedelta(days=days)
+    while dateTime < end:
+        try:
+            timeZone.localize(dateTime, is_dst=None)    # Las reglas no admiten horas ambiguas por el cambio de horario.
+            result.append(dateTime)
+        except (pytz.AmbiguousTimeError, pytz.NonExistentTimeError):
+            pass
+        dateTime += datetime.timedelta(minutes=1)
+    return result
+
+
+
+def run(market, begin, days, localTimeZone=SERVER_LOCATION):
+    '''
+    Runs the benchmark and returns a dictionary with the results.
+    market: Market of TRADING_SESSIONS to query.
+    begin: First date of the period.
+    days: Number of days of the period.
+    '''
+    calendar = TradingCalendar(localTimeZone)
+    timeBegin = time.perf_counter()
+    calendar.compile(begin - datetime.timedelta(days=1), begin + datetime.timedelta(days=days + 1))
+    compileSeconds = time.perf_counter() - timeBegin
+    timestamps = local_minutes(localTimeZone, begin, days)
+
+    timeBegin = time.perf_counter()
+    compiled = [calendar.is_open(market, dateTime) for dateTime in timestamps]
+    compiledSeconds = time.perf_counter() - timeBegin
+
+    epochs = [calendar._timestamp(dateTime) for dateTime in timestamps]
+    timeBegin = time.perf_counter()
+    compiledEpoch = [calendar.is_open(market, timestamp) for timestamp in epochs]
+    compiledEpochSeconds = time.perf_counter() - timeBegin
+
+    timeBegin = time.perf_counter()
+    vectorized = calendar.is_open_array(market, epochs)
+    vectorizedSeconds = time.perf_counter() - timeBegin
+
+    timeBegin = time.perf_counter()
+    rules = [calendar.market_open_by_rules(market, dateTime, verbose=False) for dateTime in timestamps]
+    rulesSeconds = time.perf_counter() - timeBegin
+
+    mismatches = [dateTime for dateTime, a, b, c, d in zip(timestamps, compiled, compiledEpoch, rules, vectorized) if not a == b == c == d]
+    return {
+        "market": market,
+        "queries": len(timestamps),
+        "compileSeconds": compileSeconds,
+        "compiledSeconds": compiledSeconds,
+        "compiledEpochSeconds": compiledEpochSeconds,
+        "vectorizedSeconds": vectorizedSeconds,
+        "rulesSeconds": rulesSeconds,
+        "compiledPerSecond": len(timestamps) / compiledSeconds,
+        "compiledEpochPerSecond": len(timestamps) / compiledEpochSeconds,
+        "vectorizedPerSecond": len(timestamps) / vectorizedSeconds,
+        "rulesPerSecond": len(timestamps) / rulesSeconds,
+        "speedup": rulesSeconds / compiledSeconds,
+        "openMinutes": sum(compiled),
+        "mismatches": len(mismatches),
+        "firstMismatches": [str(dateTime) for dateTime in mismatches[:10]]
+    }
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares the compiled trading calendar with the rules implementation.')
+    parser.add_argument('--market', default='NYMEX')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--begin', default='2023-01-01', help='First date of the period (YYYY-MM-DD).')
+    args = parser.parse_args()
+    result = run(args.market, datetime.datetime.strptime(args.begin, '%Y-%m-%d').date(), args.days)
+    print(f"Market {result['market']}: {result['queries']} queries of 1 minute, {result['openMinutes']} open.")
+    print(f"Compile:  {result['compileSeconds'] * 1000:.1f} ms")
+    print(f"Compiled: {result['compiledSeconds']:.3f} s  ({result['compiledPerSecond']:,.0f} queries/s)")
+    print(f"Compiled (epoch seconds): {result['compiledEpochSeconds']:.3f} s  ({result['compiledEpochPerSecond']:,.0f} queries/s)")
+    print(f"Vectorized: {result['vectorizedSeconds']:.3f} s  ({result['vectorizedPerSecond']:,.0f} queries/s)")
+    print(f"Rules:    {result['rulesSeconds']:.3f} s  ({result['rulesPerSecond']:,.0f} queries/s)")
+    print(f"Speedup:  x{result['speedup']:.1f}")
+    print(f"Mismatches: {result['mismatches']} {result['firstMismatches']}")
@@ -0,0 +1,140 @@
+
+'''
+Reloj del Bot
+
+Abstrae la hora, las esperas y las tareas programadas para que Core, RiskManager,
+OrderIdManager, TradingCalendar y BarCache no lean directamente time.time() ni datetime.now().
+
+ - RealClock usa la hora del sistema y el bucle de eventos de ib_insync. Es el que se usa en producción.
+ - VirtualClock tiene una hora propia que solo avanza con advance() (o con sleep()). Las tareas
+   programadas se ejecutan en orden al avanzar la hora, sin esperar en tiempo real, así que una
+   semana de operación se puede simular en segundos junto con el broker simulado.
+
+La medición de latencias (métricas, perfilado) sigue usando el tiempo real, porque mide lo que
+tarda el código y no la hora del mercado.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from datetime import datetime
+from ib_insync import util
+import heapq
+import itertools
+import time
+
+
+class RealClock:
+    '''Clock of the system. The scheduled callbacks run in the event loop.'''
+
+    def time(self):
+        '''Returns the current time as epoch seconds.'''
+        return time.time()
+
+
+
+    def now(self):
+        '''Returns the current local time as a naive datetime, like datetime.now().'''
+        return datetime.now()
+
+
+
+    def schedule(self, when, callback, *args):
+        '''Runs callback(*args) at the datetime when. Returns a handle with the method cancel().'''
+        return util.schedule(when, callback, *args)
+
+
+
+    def sleep(self, seconds):
+        '''Waits while the event loop keeps processing.'''
+        return util.sleep(seconds)
+
+
+
+    def block(self, seconds):
+        '''Waits without letting any other code run.'''
+        time.sleep(seconds)
+
+
+
+class VirtualHandle:
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+
+class VirtualClock:
+    '''Clock whose time only moves forward when it is advanced. The scheduled callbacks run while advancing.'''
+
+    def __init__(self, start=None):
+        '''
+        start: Initial time as epoch seconds or as a datetime (naive datetimes are local time). By default, now.
+        '''
+        if start is None:
+            start = time.time()
+        elif isinstance(start, datetime):
+            start = start.timestamp()
+        self.current = float(start)
+        self.pending = []       # Monticulo de (epoch, secuencia, handle, callback, args).
+        self.sequence = itertools.count()
+
+
+
+    def time(self):
+        return self.current
+
+
+
+    def now(self):
+        return datetime.fromtimestamp(self.current)
+
+
+
+    def schedule(self, when, callback, *args):
+        timestamp = when.timestamp() if isinstance(when, datetime) else float(when)
+        handle = VirtualHandle()
+        heapq.heappush(self.pending, (max(timestamp, self.current), next(self.sequence), handle, callback, args))
+        return handle
+
+
+
+    def sleep(self, seconds):
+        '''Lets the event loop process the pending events and advances the time.'''
+        util.sleep(0)
+        self.advance(seconds)
+        return True
+
+
+
+    def block(self, seconds):
+        '''Moves the time forward without running the scheduled callbacks.'''
+        self.current += max(seconds, 0)
+
+
+
+    def advance(self, seconds):
+        '''Moves the time forward, running in order the callbacks that become due.'''
+        self.run_until(self.current + max(seconds, 0))
+
+
+
+    def run_until(self, timestamp):
+        '''
+        Runs the callbacks scheduled up to the epoch timestamp, including the ones they schedule,
+        and leaves the clock at that time.
+        return: Number of callbacks executed.
+        '''
+        count = 0
+        while self.pending and self.pending[0][0] <= timestamp:
+            due, _, handle, callback, args = heapq.heappop(self.pending)
+            if handle.cancelled:
+                continue
+            self.current = due
+            callback(*args)
+            count += 1
+        self.current = max(self.current, timestamp)
+        return count
@@ -0,0 +1,125 @@
+
+'''
+Vista de Estado en Consola
+
+Muestra en la consola una tabla compacta con una fila por estrategia: estado, órdenes vivas,
+última ejecución y uso del riesgo. La tabla se redibuja a una frecuencia fija y baja a partir
+del estado que ya está en memoria, de manera que el costo de la consola no depende de la
+cantidad de órdenes. En este modo los eventos individuales solo se guardan en el log;
+la tabla muestra el último aviso o error.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from datetime import datetime
+import asyncio
+import logging
+import os
+import sys
+
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+ROW_FORMAT = '{:>5} {:<12} {:<9} {:>4} {:>4} {:>12} {:>8} {:>7}'
+
+
+class LastMessageHandler(logging.Handler):
+    '''Keeps in memory the last warning or error of the log, without writing anything.'''
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.lastMessage = ''
+
+    def emit(self, record):
+        self.lastMessage = '{} {} {}'.format(datetime.fromtimestamp(record.created).strftime('%H:%M:%S'), record.levelname, record.getMessage())
+
+
+
+class ConsoleStatusView:
+
+    def __init__(self, core, framesPerSecond=1, stream=None):
+        '''
+        core: It is the Core type object whose state is shown.
+        framesPerSecond: Frequency at which the table is redrawn.
+        stream: Output of the table. By default the console.
+        '''
+        self.core = core
+        self.interval = 1 / float(framesPerSecond)
+        self.stream = stream if stream is not None else sys.stdout
+        self.lastMessage = LastMessageHandler()
+        self.running = False
+        self.log = logging.getLogger('grid')
+
+
+
+    def start(self):
+        '''Starts redrawing the table on the event loop.'''
+        if os.name == 'nt':
+            os.system('')   # Activa las secuencias ANSI en la consola de Windows.
+        self.log.addHandler(self.lastMessage)
+        self.running = True
+        asyncio.get_event_loop().call_soon(self._draw)
+
+
+
+    def stop(self):
+        self.running = False
+        self.log.removeHandler(self.lastMessage)
+
+
+
+    def render(self):
+        '''Returns the text of the table with the current state of the bot.'''
+        core = self.core
+        liveOrders = {}
+        for trade in core.openTrades():
+            if not core.orderIdManager.is_order_child_of_client(trade.order.orderRef):
+                continue
+            unpacked = core.orderIdManager.unpack(int(trade.order.orderRef))
+            counts = liveOrders.setdefault(unpacked['strategyId'], {'BUY': 0, 'SELL': 0})
+            counts[unpacked['side']] += 1
+        risk = core.riskManager.get_risks()
+        maxContract = core.riskManager.max['position']['contract']
+        maxGlobal = core.riskManager.max['position']['global']
+        globalUsage = 100 * risk['total']['max']['nominal'] / maxGlobal if maxGlobal else 0
+        queued = sum(data['depth'] for data in core.governor.metrics().values())
+        lines = [
+            'Grid Bot  {}  {}  orders: {}  queued: {}  global risk: {:.1f}%'.format(
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'CONNECTED' if core.isConnected() else 'DISCONNECTED',
+                sum(counts['BUY'] + counts['SELL'] for counts in liveOrders.values()),
+                queued, globalUsage
+            ),
+            '',
+            ROW_FORMAT.format('Id', 'Symbol', 'State', 'Buy', 'Sell', 'Last fill', 'At', 'Risk')
+        ]
+        for strategy in core.parameters.strategies:
+            counts = liveOrders.get(int(strategy['strategyId']), {'BUY': 0, 'SELL': 0})
+            contractRisk = risk['contract'].get(str(strategy.get('contractId')))
+            usage = 100 * contractRisk['virtual']['max']['nominal'] / maxContract if contractRisk is not None and maxContract else 0
+            lastFillTime = strategy.get('lastFillTime')
+            lines.append(ROW_FORMAT.format(
+                strategy['strategyId'],
+                str(strategy.get('symbol'))[:12],
+                str(strategy.get('action', ''))[:9],
+                counts['BUY'],
+                counts['SELL'],
+                '' if strategy.get('lastFillPrice') is None else strategy['lastFillPrice'],
+                '' if lastFillTime is None else lastFillTime.strftime('%H:%M:%S'),
+                '{:.1f}%'.format(usage)
+            ))
+        lines.append('')
+        lines.append(self.lastMessage.lastMessage)
+        return '\n'.join(lines)
+
+
+
+    def _draw(self):
+        if not self.running:
+            return
+        try:
+            self.stream.write(CLEAR_SCREEN + self.render() + '\n')
+            self.stream.flush()
+        except Exception as e:
+            self.log.exception(f'Error drawing the console status: {str(e)}')
+        finally:
+            asyncio.get_event_loop().call_later(self.interval, self._draw)
@@ -6,40 +6,111 @@ Esta clase extiende las propiedades y metodos de la clase IB de ib_insync.
 from ib_insync import *
 from order_id_manager import OrderIdManager
 from datetime import datetime, timedelta
+import copy
 import ctypes
+import os
 from multi_parameters import MultiParameters
 import time
 from risk_manager import RiskManager
+from order_reconciler import OrderReconciler
+from state_snapshot import StateSnapshot
+from rate_governor import RateGovernor
+from profiling_hooks import CallbackProfiler
+from status_segment import StatusSegment
+from event_journal import EventJournal
+from tick_recorder import TickRecorder
+from trade_archive import TradeArchive
+from clock import RealClock
 from trading_calendar import TradingCalendar
 from dashboard import Dashboard
+import grid_ladder
 import telegram
 import logging
+import asyncio
+import metrics
 
 
-ctypes.windll.kernel32.SetConsoleTitleW(__file__)
+if os.name == 'nt':
+    ctypes.windll.kernel32.SetConsoleTitleW(__file__)
 
 
 class Core(IB):
-    def __init__(self, configuration):
+    def __init__(self, configuration, clock=None):
         '''
         Crea un objeto que representa al broker o exchange.
         Esta clase es una abstrapción para evitar que el bot baneje directamente 
         los detalles de interaccion con el broker o exchange.
+        clock: Reloj de la hora y de las tareas programadas. Por defecto el reloj del sistema.
         '''
         IB.__init__(self)
         self.configuration = configuration
-        self.orderIdManager = OrderIdManager(self.configuration['client_tws'])
-        self.parameters = MultiParameters(self.configuration, 'Estrategias')
+        self.clock = clock if clock is not None else RealClock()
+        self.orderIdManager = OrderIdManager(self.configuration['client_tws'], self.clock)
+        self.parameters = MultiParameters(self.configuration, 'Estrategias', clock=self.clock)
         self.dashBoard = Dashboard(self.configuration) 
-        self.riskManager = RiskManager(self.configuration)
-        self.tradingCalendar = TradingCalendar(configuration['botTimeZone'])
+        self.riskManager = RiskManager(self.configuration, self.clock)
+        self.riskManager.attach_ledger(self)
+        self.orderReconciler = OrderReconciler(self.configuration)
+        self.governor = RateGovernor(
+            self.configuration.get('api_messages_per_second', 45),
+            self.configuration.get('api_messages_burst', 10),
+            clock=self.clock
+        )
+        self.stateSnapshot = StateSnapshot(
+            self.configuration.get('snapshot_file', './state/snapshot.pickle'),
+            self.configuration.get('snapshot_max_age_seconds', 86400),
+            clock=self.clock
+        )
+        self.tradingCalendar = TradingCalendar(configuration['botTimeZone'], clock=self.clock)
         self.lastTimeOrder = None
-        self.lastTimeActualize = time.time()
+        self.lastTimeActualize = self.clock.time()
         self.accumulatedTime = 0
         self.log = logging.getLogger('grid')
-        self.lastConnectionTime = time.time()
+        self.lastConnectionTime = self.clock.time()
         self.lastDateTimeConnection = datetime.fromtimestamp(self.lastConnectionTime)
         self.previousConnectedStatus = None
+        self.lastStatusCycleTime = None
+        self.loopProbeExpected = None
+        self.profiler = CallbackProfiler(
+            self.configuration.get('profile_folder', './profiles'),
+            self.configuration.get('profile_trigger_file', 'profile.json')
+        )
+        for name in self.configuration.get('profile_targets', ['set_actualize_bot_status', 'onExecDetailsEvent']):
+            self.profiler.wrap(self, name)
+        self.statusSegment = None
+        if self.configuration.get('status_file'):
+            try:
+                self.statusSegment = StatusSegment(self.configuration['status_file'], self.configuration['client_tws'])
+            except Exception as e:
+                self.log.exception(f'Unable to create the status segment {self.configuration["status_file"]}: {str(e)}')
+        self.journal = None
+        if self.configuration.get('journal_file'):
+            try:
+                self.journal = EventJournal(self.configuration['journal_file'], self.configuration.get('journal_max_megabytes', 512))
+                self.journal.attach(self)      # Se suscribe antes que los demas manejadores para grabar los eventos en orden.
+                self.parameters.journal = self.journal
+            except Exception as e:
+                self.log.exception(f'Unable to create the event journal {self.configuration["journal_file"]}: {str(e)}')
+        self.tickRecorder = None
+        if self.configuration.get('tick_recorder_folder'):
+            self.tickRecorder = TickRecorder(
+                self.configuration['tick_recorder_folder'],
+                self.configuration.get('tick_recorder_buffer_ticks', 4096),
+                self.configuration.get('tick_recorder_flush_seconds', 1),
+                self.configuration.get('marquet_data_delayed_but_free', False)
+            )
+            self.tickRecorder.attach(self)
+        self.tradeArchive = None
+        if self.configuration.get('trade_archive_file'):
+            try:
+                self.tradeArchive = TradeArchive(
+                    self.configuration['trade_archive_file'],
+                    self.configuration.get('trade_retention_seconds', 86400),
+                    self.configuration.get('trade_retention_max_completed', 5000),
+                    self.configuration.get('journal_max_megabytes', 512)
+                )
+            except Exception as e:
+                self.log.exception(f'Unable to create the trade archive {self.configuration["trade_archive_file"]}: {str(e)}')
         
     
 
@@ -49,13 +120,11 @@ class Core(IB):
             if self.isConnected():
                 self.parameters.load(self, verbose=False)
                 msg = 'Strategies have been loaded'
-                print(msg)
                 self.log.info(msg)
                 telegram.send_to_telegram(msg, self.configuration)   
                 return True
             else:
                 msg = 'Disconnected!!! Cannot load strategies.'
-                print(msg)
                 self.log.error(msg)
                 telegram.send_to_telegram(msg, self.configuration)   
         except Exception as e:
@@ -64,23 +133,130 @@ class Core(IB):
 
 
 
+    def load_snapshot(self):
+        '''
+        Load the strategies from the local snapshot without reading Google Sheets or the broker.
+        The next status cycle checks them against the sheet and reset_strategies() against the broker.
+        '''
+        state = self.stateSnapshot.load(self.configuration['client_tws'])
+        if state is None:
+            return False
+        self.parameters.strategies = state['strategies']
+        self.parameters.noFilteredStrategies = state['noFilteredStrategies']
+        msg = 'Strategies have been loaded from the snapshot saved at {} with {} open orders'.format(
+            datetime.fromtimestamp(state['savedAt']).strftime('%Y-%m-%d %H:%M:%S'), len(state['orders'])
+        )
+        self.log.info(msg)
+        self.compare_snapshot_orders(state['orders'])
+        return True
+
+
+
+    def compare_snapshot_orders(self, savedOrders):
+        '''
+        Compares the open orders saved in the snapshot with the open orders of this client in the broker.
+        The saved orders that are not open anymore were filled or canceled while the bot was stopped, so the last
+        fill of their strategies is forgotten and the reconciliation infers the center of the ladder from the live orders.
+        savedOrders: List of the orders saved in the snapshot.
+        return: Dictionary with the lists of orderRef "missing", "changed" and "unknown".
+        '''
+        result = {"missing": [], "changed": [], "unknown": []}
+        live = {
+            str(trade.order.orderRef): trade for trade in self.openTrades()
+            if self.orderIdManager.is_order_child_of_client(trade.order.orderRef)
+        }
+        saved = {str(order['orderRef']): order for order in savedOrders}
+        for orderRef, order in saved.items():
+            trade = live.get(orderRef)
+            if trade is None:
+                result["missing"].append(orderRef)
+                self.log.warning(f'Order {orderRef} {order["action"]} {order["totalQuantity"]} @ {order["lmtPrice"]} of the snapshot is not open anymore.', extra={'orderRef': orderRef})
+            elif trade.order.lmtPrice != order['lmtPrice'] or trade.order.totalQuantity != order['totalQuantity']:
+                result["changed"].append(orderRef)
+                self.log.warning(f'Order {orderRef} changed from {order["totalQuantity"]} @ {order["lmtPrice"]} to {trade.order.totalQuantity} @ {trade.order.lmtPrice} since the snapshot.', extra={'orderRef': orderRef})
+        result["unknown"] = [orderRef for orderRef in live if orderRef not in saved]
+        for orderRef in result["unknown"]:
+            self.log.warning(f'Open order {orderRef} is not in the snapshot.', extra={'orderRef': orderRef})
+        for strategy in self.parameters.strategies:
+            if any(self.orderIdManager.is_order_child_of_strategy(orderRef, strategy['strategyId']) for orderRef in result["missing"]):
+                strategy['lastFillPrice'] = None
+        if len(result["missing"]) > 0 or len(result["changed"]) > 0 or len(result["unknown"]) > 0:
+            msg = 'Open orders since the snapshot: {} not open anymore, {} changed, {} not in the snapshot'.format(
+                len(result["missing"]), len(result["changed"]), len(result["unknown"])
+            )
+            self.log.warning(msg)
+            telegram.send_to_telegram(msg, self.configuration)
+        return result
+
+
+
+    def save_snapshot(self):
+        '''Save the current state of the bot in the local snapshot.'''
+        return self.stateSnapshot.save(self)
+
+
+
+    def set_save_snapshot(self):
+        '''Save the snapshot periodically.'''
+        try:
+            self.save_snapshot()
+        except Exception as e:
+            self.log.exception('Error saving the snapshot: {}'.format(str(e)))            
+        finally:
+            self.clock.schedule(
+                self.get_timestamp_for_seconds(self.configuration.get('snapshot_seconds', 60)),
+                self.set_save_snapshot
+            ) 
+
+
+
+    def set_prune_trades(self):
+        '''Moves periodically the finished orders and fills out of the retention from memory to the archive.'''
+        if self.tradeArchive is None:
+            return
+        try:
+            self.tradeArchive.prune(self, self.clock.time())
+        except Exception as e:
+            self.log.exception('Error archiving the finished orders: {}'.format(str(e)))            
+        finally:
+            self.clock.schedule(
+                self.get_timestamp_for_seconds(self.configuration.get('trade_retention_check_seconds', 300)),
+                self.set_prune_trades
+            ) 
+
+
+
     def set_actualize_bot_status(self):
+        '''Runs the status cycle periodically.'''
+        try:
+            self.actualize_bot_status()
+        finally:
+            self.clock.schedule(
+                self.get_timestamp_for_seconds(self.configuration['actualize_status_seconds']),
+                self.set_actualize_bot_status
+            ) 
+
+
+
+    def actualize_bot_status(self):
         '''
         Verifica la conexion del bot, actualiza el estado de la configuracion multiparametrica 
         y realiza las acciones indicadas en la configuración de cada estrategia.
         '''
         if 'debug_mode' in self.configuration:
-            nowTime = time.time()
+            nowTime = self.clock.time()
             seconds = round(nowTime - self.lastTimeActualize, 2)
             self.lastTimeActualize = nowTime
             labelStatus = 'Connected.' if self.isConnected() else 'Disconnected'
             if not self.configuration['debug_mode'] and seconds <= 30:
                 self.accumulatedTime += seconds
                 if self.accumulatedTime >= (60 * 60):
-                    print(labelStatus, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                    self.log.info(labelStatus)
                     self.accumulatedTime = 0
             else:
-                print(labelStatus, 'Seconds since last callback:', seconds)
+                self.log.debug(f'{labelStatus} Seconds since last callback: {seconds}')
+        cycleBegin = time.time()
+        self.profiler.check_trigger()
         try:
             if self.isConnected():
                 if self.previousConnectedStatus is not None and self.previousConnectedStatus != self.isConnected():
@@ -90,10 +266,18 @@ class Core(IB):
                 self.previousConnectedStatus = self.isConnected()
 
                 self.lastDateTimeConnection = datetime.fromtimestamp(self.lastConnectionTime)  # Guarda la copia antes de que sea actualizada.
-                self.lastConnectionTime = time.time()   # Registra el tiempo de la ultima conexion comprobada.
-                self.parameters.load(self, verbose=False)
+                self.lastConnectionTime = self.clock.time()   # Registra el tiempo de la ultima conexion comprobada.
+                self.riskManager.sync_ledger(self)            # Corrige en el libro de riesgo compartido los eventos perdidos.
+                self.parameters.load(self, verbose=False, dormantIds=self.update_dormancy())
+                if self.tickRecorder is not None:
+                    self.tickRecorder.subscribe([      # Las estrategias dormidas no mantienen datos de mercado abiertos.
+                        strategy['contract'] for strategy in self.parameters.strategies
+                        if strategy.get('active') and strategy['action'] not in ['STOP', 'DELETED'] and strategy.get('dormantUntil') is None
+                    ])
                 for strategy in self.parameters.strategies:
                     #print('contractId:', self.get_contract_id(strategy))  # Esto lo utilice para probar la funcion get_contract_id
+                    if strategy.get('dormantUntil') is not None and strategy['action'] == 'CONTINUE':
+                        continue    # El mercado esta cerrado, no hay nada que actualizar.
                     
                     # Si el precio es cero, solicitamos el precio al mercado
                     if float(strategy['initialPrice']) == float(0):
@@ -105,12 +289,10 @@ class Core(IB):
                                 #self.dashBoard.update_dashboard(self, self.parameters)
                                 self.dashBoard.update_risk(self.riskManager)
                                 msg = 'On contract {}, strategy {} {}'.format(strategy['contractId'], strategy['strategyId'], strategy['action'])
-                                print(msg)
                                 self.log.info(msg)
                                 self.post_grid_orders(strategy)
                         elif strategy['action'] == 'STOP' or strategy['action'] == 'DELETED':
                             msg = 'Estrategia {} {}'.format(strategy['strategyId'], strategy['action'])
-                            print(msg)
                             self.log.info(msg)
                             self.cancel_orders_of_strategy(strategy['strategyId'])
                         elif strategy['action'] == 'CONTINUE':
@@ -131,16 +313,122 @@ class Core(IB):
 
             #self.dashBoard.update_dashboard(self, self.parameters)          
             self.dashBoard.update_risk(self.riskManager)
-            msg_heartbeat = f"{datetime.now()} -- {__file__} -- Heartbeat"  
-            with open("heartbeat.txt", "w") as f: f.write(msg_heartbeat)
+            msg_heartbeat = f"{self.clock.now()} -- {__file__} -- Heartbeat"  
+            with open(self.configuration.get('heartbeat_file', 'heartbeat.txt'), "w") as f: f.write(msg_heartbeat)
+            self.lastStatusCycleTime = self.clock.time()
+            metrics.STATUS_CYCLE_SECONDS.observe(time.time() - cycleBegin)
+            metrics.OPEN_ORDERS.set(len(self.openTrades()))
         except Exception as e:
             self.log.exception('Error: {}'.format(str(e)))            
+
+
+    def set_measure_loop_lag(self):
+        '''Measures periodically the delay of the event loop, updates the metrics gauges and publishes the status segment.'''
+        now = time.monotonic()
+        try:
+            lag = 0.0 if self.loopProbeExpected is None else max(0.0, now - self.loopProbeExpected)
+            metrics.LOOP_LAG_SECONDS.set(lag)
+            self.update_metrics()
+            self.publish_status(lag)
+        except Exception as e:
+            self.log.exception('Error measuring the event loop: {}'.format(str(e)))            
         finally:
-            self.schedule(
-                callback=self.set_actualize_bot_status, 
-                time=self.get_timestamp_for_seconds(self.configuration['actualize_status_seconds'])
-            ) 
-             
+            interval = self.configuration.get('loop_probe_seconds', 1)
+            self.loopProbeExpected = now + interval
+            asyncio.get_event_loop().call_later(interval, self.set_measure_loop_lag)
+
+
+
+    def update_metrics(self):
+        '''Updates the gauges that reflect the current state of the bot.'''
+        metrics.CONNECTED.set(1 if self.isConnected() else 0)
+        trades, permIds, fills = TradeArchive.stores(self)
+        metrics.IN_MEMORY.set(len(trades), kind='trade')
+        metrics.IN_MEMORY.set(len(fills), kind='fill')
+        residentMemory = metrics.resident_memory_bytes()
+        if residentMemory is not None:
+            metrics.RESIDENT_MEMORY.set(residentMemory)
+        for priority, data in self.governor.metrics().items():
+            metrics.QUEUE_SIZE.set(data['depth'], queue=f'governor_{priority}')
+
+
+
+    def publish_status(self, loopLag=0.0):
+        '''Writes the current state of the bot in the shared status segment, if it is enabled.'''
+        if self.statusSegment is None:
+            return
+        buyOrders = sellOrders = 0
+        for trade in self.openTrades():
+            if self.orderIdManager.is_order_child_of_client(trade.order.orderRef):
+                if trade.order.action == 'BUY':
+                    buyOrders += 1
+                else:
+                    sellOrders += 1
+        risk = self.riskManager.get_risks()
+        limits = self.riskManager.max
+        contractNominal = max((abs(item['virtual']['max']['nominal']) for item in risk['contract'].values()), default=0)
+        self.statusSegment.publish(
+            lastStatusCycle=self.lastStatusCycleTime or 0.0,
+            connected=1 if self.isConnected() else 0,
+            strategies=len(self.parameters.strategies),
+            openOrders=buyOrders + sellOrders,
+            openBuyOrders=buyOrders,
+            openSellOrders=sellOrders,
+            queuedMessages=sum(data['depth'] for data in self.governor.metrics().values()),
+            ordersPosted=int(metrics.ORDERS_POSTED.total()),
+            ordersRejected=int(metrics.ORDERS_REJECTED.total()),
+            fills=int(metrics.FILLS.total()),
+            loopLagSeconds=loopLag,
+            riskOrder=self.riskManager.lastOrderNominal / limits['order'] if limits['order'] else 0.0,
+            riskContract=contractNominal / limits['position']['contract'] if limits['position']['contract'] else 0.0,
+            riskGlobal=abs(risk['total']['max']['nominal']) / limits['position']['global'] if limits['position']['global'] else 0.0
+        )
+
+
+
+    def health(self):
+        '''
+        Returns the health of the bot for the /health route of the metrics server.
+        return: Tuple (healthy, data). It is healthy if it is connected and the last status cycle is recent.
+        '''
+        connected = self.isConnected()
+        age = None if self.lastStatusCycleTime is None else round(self.clock.time() - self.lastStatusCycleTime, 3)
+        maxAge = 3 * self.configuration['actualize_status_seconds']
+        healthy = connected and age is not None and age <= maxAge
+        return healthy, {"status": "ok" if healthy else "degraded", "connected": connected, "lastStatusCycleAgeSeconds": age}
+
+
+
+    def update_dormancy(self):
+        '''
+        Puts to sleep the running strategies whose market is closed, and wakes them up 
+        dormancy_wake_seconds before the next opening. Only markets of the trading calendar are considered.
+        return: Set with the ids of the dormant strategies.
+        '''
+        dormantIds = set()
+        if not self.configuration.get('dormancy_enabled', True):
+            return dormantIds
+        now = self.clock.time()
+        wakeSeconds = self.configuration.get('dormancy_wake_seconds', 300)
+        for strategy in self.parameters.strategies:
+            dormantUntil = None
+            if strategy['action'] == 'CONTINUE' and self.tradingCalendar.has_market(strategy['exchange']):
+                if not self.tradingCalendar.is_open(strategy['exchange'], now):
+                    nextOpen = self.tradingCalendar.next_open(strategy['exchange'], now)
+                    if nextOpen is not None and nextOpen.timestamp() - wakeSeconds > now:
+                        dormantUntil = nextOpen.timestamp() - wakeSeconds
+            if dormantUntil is not None and strategy.get('dormantUntil') is None:
+                msg = f'Strategy {strategy["strategyId"]} sleeps until {datetime.fromtimestamp(dormantUntil)}, the market {strategy["exchange"]} is closed.'
+                self.log.info(msg, extra={'strategyId': strategy['strategyId']})
+            elif dormantUntil is None and strategy.get('dormantUntil') is not None:
+                msg = f'Strategy {strategy["strategyId"]} wakes up, the market {strategy["exchange"]} opens soon.'
+                self.log.info(msg, extra={'strategyId': strategy['strategyId']})
+            strategy['dormantUntil'] = dormantUntil
+            if dormantUntil is not None:
+                dormantIds.add(int(strategy['strategyId']))
+        metrics.DORMANT_STRATEGIES.set(len(dormantIds))
+        return dormantIds
+
 
 
     def set_refresh_dashboard(self):
@@ -150,9 +438,9 @@ class Core(IB):
         except Exception as e:
             self.log.exception('Error refreshing the dashboard: {}'.format(str(e)))            
         finally:
-            self.schedule(
-                callback=self.set_refresh_dashboard, 
-                time=self.get_timestamp_for_seconds(self.configuration['dashboard_refresh_freq_seconds'])
+            self.clock.schedule(
+                self.get_timestamp_for_seconds(self.configuration['dashboard_refresh_freq_seconds']),
+                self.set_refresh_dashboard
             ) 
              
 
@@ -165,7 +453,10 @@ class Core(IB):
         '''
         if contract is not None: 
             try:
+                self.wait_data_slot()
+                timeBegin = time.time()
                 self.qualifyContracts(contract)
+                metrics.TWS_REQUEST_SECONDS.observe(time.time() - timeBegin, request='qualifyContracts')
                 return contract.conId
             except Exception as e:
                 self.log.exception('No se pudo obtener el ID de contrato para: {}'.format(contract))
@@ -189,10 +480,12 @@ class Core(IB):
 
 
     def onExecDetailsEvent(self, trade, fill):
+        timeBegin = time.time()
         self.dashBoard.load_fill(fill)   #******* OJO ***** esto deberia ejecutarse despues del if (float(trade.remaining()) == 0):
         self.dashBoard.update_risk(self.riskManager)
         try:
             if (float(trade.remaining()) == 0):
+                metrics.FILLS.increment()
                 self.riskManager.add_executed_operation(trade, self)
                 unpackedOrderId = self.orderIdManager.unpack(int(trade.order.orderRef))
                 if unpackedOrderId is not None:
@@ -209,19 +502,24 @@ class Core(IB):
                         unpackedOrderId['strategyId'],
                         trade.order.lmtPrice
                     )
-                    print('{} - {}'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), msg))
-                    self.log.info(msg)
+                    self.log.info(msg, extra={'strategyId': unpackedOrderId['strategyId'], 'orderRef': trade.order.orderRef, 'side': trade.order.action, 'price': trade.order.lmtPrice})
                     telegram.send_to_telegram(msg, self.configuration)
 
                     if (trade.order.action == "SELL"): 
-                        self.post_order(strategy, 'BUY', trade.order.lmtPrice - strategy['step'], prefix=f'strategy {strategy["strategyId"]} Reaction ')                
+                        self.post_order(strategy, 'BUY', trade.order.lmtPrice - strategy['step'], prefix=f'strategy {strategy["strategyId"]} Reaction ', priority='reaction')                
                     elif (trade.order.action == "BUY"):
-                        self.post_order(strategy, 'SELL', trade.order.lmtPrice + strategy['step'], prefix=f'strategy {strategy["strategyId"]} Reaction ')                
+                        self.post_order(strategy, 'SELL', trade.order.lmtPrice + strategy['step'], prefix=f'strategy {strategy["strategyId"]} Reaction ', priority='reaction')                
                     else:
                         pass
+                    latency = time.time() - timeBegin
+                    metrics.FILL_TO_REACTION_SECONDS.observe(latency)
+                    self.log.debug('Reaction sent', extra={'strategyId': strategy['strategyId'], 'orderRef': trade.order.orderRef, 'latency': latency})
+                    strategy['lastFillPrice'] = trade.order.lmtPrice
+                    strategy['lastFillTime'] = self.clock.now()
+                    if grid_ladder.is_window_mode(strategy):
+                        self.slide_grid_window(strategy, trade.order.lmtPrice, exclude=trade)
                 else:
                     msg = 'Executed unknown order at price {}'.format(trade.order.lmtPrice)
-                    print('{} - {}'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), msg))
                     self.log.info(msg)
                     telegram.send_to_telegram(msg, self.configuration)
         except Exception as e:
@@ -239,22 +537,23 @@ class Core(IB):
         return: True si pudo poner las ordenes y False si ocurre algun error.
         '''
         if self.can_post_grid(strategy):
+            timeBegin = time.time()
             try:
-                print("{} - Insertando ordenes para crear el GRID...".format(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-                print('   Initial price:', strategy['initialPrice'], strategy['currency'])
-                initialPrice = strategy['initialPrice']
+                self.log.info('Insertando ordenes para crear el GRID... Initial price: {} {}'.format(strategy['initialPrice'], strategy['currency']), extra={'strategyId': strategy['strategyId']})
+                # En modo ventana solo se ponen los niveles mas cercanos, el resto se agrega en slide_grid_window().
+                buyPrices, sellPrices = grid_ladder.desired_prices(strategy)
                 # Manuel. 11-10-23. OJO!! en las compras podrían darse precios negativos. Hay que controlarlo.            
-                for ordinal in range(1, strategy['buyOrders'] + 1):
-                    self.post_order(strategy, 'BUY', initialPrice - (strategy['step'] * ordinal), prefix=f'strategy {strategy["strategyId"]} Initial Low {ordinal} ')
+                for ordinal, price in enumerate(buyPrices, start=1):
+                    self.post_order(strategy, 'BUY', price, prefix=f'strategy {strategy["strategyId"]} Initial Low {ordinal} ')
                     self.sleep(0)   # Garantiza el funcionamiento asyncrono
-                for ordinal in range(1, strategy['sellOrders'] + 1):
-                    self.post_order(strategy, 'SELL', initialPrice + (strategy['step'] * ordinal), prefix=f'strategy {strategy["strategyId"]} Initial Up {ordinal} ')
+                for ordinal, price in enumerate(sellPrices, start=1):
+                    self.post_order(strategy, 'SELL', price, prefix=f'strategy {strategy["strategyId"]} Initial Up {ordinal} ')
                     self.sleep(0)   # Garantiza el funcionamiento asyncrono
                 self.log.info('Se han creado las ordenes grid de la estrategia {}'.format(strategy['strategyId']))
+                metrics.GRID_POST_SECONDS.observe(time.time() - timeBegin)
                 return True
             except Exception as e:
                 msg = 'Error creating strategy grid orders {}'.format(strategy['strategyId'])
-                if verbose: print(msg)
                 self.log.exception(msg)
                 telegram.send_to_telegram(msg, self.configuration)   
                 return False
@@ -264,6 +563,152 @@ class Core(IB):
 
 
 
+    def slide_grid_window(self, strategy, centerPrice, verbose=True, exclude=None):
+        '''
+        Keeps live only the nearest "activeBuyOrders" and "activeSellOrders" levels around centerPrice.
+        The orders that are out of the window are moved to the missing levels with move_ladder().
+        strategy: Strategy parameters with the window configured.
+        centerPrice: Price of the last fill of the strategy.
+        exclude: Trade whose fill is being handled. It is never reused, even if its Filled status has not arrived yet.
+        return: True if the window could be updated. False if an error occurs.
+        '''
+        return self.move_ladder(strategy, centerPrice, verbose, prefix=f'strategy {strategy["strategyId"]} Window ', exclude=exclude) is not None
+
+
+
+    def move_ladder(self, strategy, centerPrice, verbose=True, prefix=None, priority='grid', exclude=None):
+        '''
+        Moves the ladder of the strategy to a new central price reusing the live orders.
+        The orders that are already on a desired level are kept, the surplus orders are amended to the
+        missing levels with the same orderId and only what can not be reused is canceled or posted.
+        Nothing is awaited: the status of the orders arrives with the events of the broker.
+        strategy: Strategy parameters.
+        centerPrice: New central price of the ladder.
+        exclude: Trade that must not be reused, like the one whose fill is being handled.
+        return: Dictionary with the count of canceled, amended, posted and discarded orders. None if an error occurs.
+        '''
+        try:
+            if prefix is None:
+                prefix = f'strategy {strategy["strategyId"]} Move '
+            queued = [
+                order for kind, order in self.governor.pending_tags()
+                if kind == 'place' and self.orderIdManager.is_order_child_of_strategy(order.orderRef, strategy['strategyId'])
+            ]
+            # La ejecucion llega antes que el estado Filled: una orden ya ejecutada sigue en openTrades() y no se puede reutilizar.
+            liveTrades = [
+                trade for trade in self.open_trades_of_strategy(strategy['strategyId'])
+                if trade is not exclude and trade.remaining() > 0 and trade.orderStatus.status not in OrderStatus.DoneStates
+            ]
+            plan = self.orderReconciler.plan(strategy, liveTrades, centerPrice, queued, self.queued_amendments())
+            self.orderReconciler.apply(strategy, plan, self, verbose, prefix=prefix, priority=priority)
+            return {key: len(items) for key, items in plan.items()}
+        except Exception as e:
+            self.log.exception('Error moving the ladder of strategy {}'.format(strategy['strategyId']))
+            return None
+
+
+
+    def amend_order(self, trade, strategy, price=None, quantity=None, priority='grid', prefix=''):
+        '''
+        Modifies the price or the quantity of a live order sending placeOrder again with the same orderId.
+        The order keeps its orderRef, and the risk check (and the shared risk ledger) only sees the net change.
+        trade: Live trade of the order.
+        strategy: Strategy parameters of the order.
+        price, quantity: New values. None keeps the current value.
+        return: True if the modification was sent or nothing had to change. False if it was rejected or an error occurs.
+        '''
+        try:
+            order = copy.copy(trade.order)
+            if price is not None:
+                order.lmtPrice = price
+            if quantity is not None:
+                order.totalQuantity = quantity
+            if order.lmtPrice == trade.order.lmtPrice and order.totalQuantity == trade.order.totalQuantity:
+                return True
+            if not self.validate_order(order, strategy):
+                return False
+            msg = f'{prefix}Amend: {order.orderRef} {order.action} {trade.order.totalQuantity} @ {trade.order.lmtPrice} -> {order.totalQuantity} @ {order.lmtPrice}'
+            self.send_amend_order(trade, order, priority)
+            self.riskManager.commit_order(order)
+            metrics.ORDERS_AMENDED.increment(priority=priority)
+            self.log.info(msg, extra={'strategyId': strategy['strategyId'], 'orderRef': order.orderRef, 'side': order.action, 'price': order.lmtPrice})
+            return True
+        except Exception as e:
+            self.log.exception('Error amending order {}'.format(trade.order.orderRef))
+            return False
+
+
+
+    def send_place_order(self, contract, order, priority='grid'):
+        '''
+        Sends placeOrder through the message rate governor.
+        priority: One of "reaction", "cancel", "grid" or "data".
+        return: The trade, or None if the order was queued to be sent later.
+        '''
+        sent, trade = self.governor.submit(priority, self.placeOrder, contract, order, tag=('place', order))
+        return trade
+
+
+
+    def send_amend_order(self, trade, order, priority='grid'):
+        '''
+        Sends the modification of a live order through the message rate governor.
+        order: Copy of trade.order with the same orderId and the new values. trade.order only changes when the
+               modification is sent, so while it is queued the trade keeps the values that are live in the broker.
+        A modification of the same order that is still queued is replaced by this one.
+        '''
+        self.governor.discard(('amend', order.orderRef))
+        self.governor.submit(priority, self._dispatch_amend, trade, order, tag=('amend', order.orderRef))
+
+
+
+    def _dispatch_amend(self, trade, order):
+        '''Applies a queued modification to the live order and sends it, unless the order is already done.'''
+        if trade.isDone() or trade.remaining() <= 0:
+            return trade
+        trade.order.lmtPrice = order.lmtPrice
+        trade.order.totalQuantity = order.totalQuantity
+        return self.placeOrder(trade.contract, trade.order)
+
+
+
+    def queued_amendments(self):
+        '''Returns the modifications that wait in the rate governor, as a dictionary orderRef -> order with the new values.'''
+        return {tag[1]: args[1] for tag, args in self.governor.pending_calls() if tag[0] == 'amend'}
+
+
+
+    def queued_place_trades(self):
+        '''
+        Returns the orders that wait in the rate governor to be placed, as trades that are not sent yet.
+        They are not in openTrades() yet, but the risk check must count them like the open orders.
+        '''
+        return [Trade(*args) for tag, args in self.governor.pending_calls() if tag[0] == 'place']
+
+
+
+    def send_cancel_order(self, order, priority='cancel'):
+        '''Sends cancelOrder through the message rate governor. A queued modification of the order is not sent anymore.'''
+        self.governor.discard(('amend', order.orderRef))
+        self.governor.submit(priority, self.cancelOrder, order, tag=('cancel', order))
+
+
+
+    def wait_data_slot(self):
+        '''Waits until a market data request can be sent without exceeding the message rate.'''
+        self.governor.wait('data', self.clock.sleep)
+
+
+
+    def open_trades_of_strategy(self, strategyId):
+        '''Returns the open trades of this client that belong to the strategy.'''
+        return [
+            trade for trade in self.openTrades() 
+            if self.orderIdManager.is_order_child_of_strategy(trade.order.orderRef, strategyId)
+        ]
+
+
+
     def can_post_grid(self, strategy):
         '''Check if the user has confirmed the execution of the strategy.'''
         try:
@@ -272,16 +717,14 @@ class Core(IB):
             if strategy['market'].close <= rangeMin or strategy['market'].close >= rangeMax:
                 if strategy['confirmed'] is None: 
                     msg = 'Canceled strategy {} because there is no confirmation.'.format(strategy['strategyId'])
-                    print(msg)
                     self.log.error(msg)
                     telegram.send_to_telegram(msg, self.configuration)   
                     return False
                 else:
-                    if time.time() - int(strategy['confirmed']) < self.configuration['strategy_confirmation_max_age_seconds']:
+                    if self.clock.time() - int(strategy['confirmed']) < self.configuration['strategy_confirmation_max_age_seconds']:
                         return True
                     else:
                         msg = 'Canceled strategy {} because the confirmation is expired.'.format(strategy['strategyId'])
-                        print(msg)
                         self.log.error(msg)
                         telegram.send_to_telegram(msg, self.configuration)   
                         return False
@@ -289,20 +732,20 @@ class Core(IB):
                 return True
         except Exception as e:
             msg = 'Canceled strategy {} because an error has occurred.'.format(strategy['strategyId'])
-            print(msg)
             self.log.exception(msg)
             telegram.send_to_telegram(msg, self.configuration)   
             return False
 
 
 
-    def post_order(self, strategy, side, price, verbose=True, prefix=''):
+    def post_order(self, strategy, side, price, verbose=True, prefix='', priority='grid'):
         '''
         Agrega una orden de compra o venta que componen la cuadrícula (grid).
         
         strategy: Esta es la configuración de la estrategia que se va a realizar.
         side: Este es el tipo de operación que se va a realizar BUY o SELL.
         price: Este es el precio en el que se va a poner la orden.
+        priority: Prioridad de la orden en el regulador de mensajes: "reaction" o "grid".
         return: Retorna True si se pudo poner la orden. De lo contrario False.
         '''           
         try:
@@ -334,27 +777,26 @@ class Core(IB):
                     order.hidden = strategy['displaySize'] == 0 
 
             if self.configuration.get("verbose_order_params", False):
-                print('-----------ORDER-PARAMS-----------------')
-                print('action:', side)
-                print('totalQuantity:', strategy['orderQty'])
-                print('outsideRth:', paramOutsideRth if paramOutsideRth != '' else True)
-                print('tif:', paramValidity if paramValidity != '' else 'GTC')
-                print('orderType:', paramOrderType if paramOrderType != '' else 'LMT')
-                print('displaySize:', order.displaySize)
-                print('hidden:', order.hidden)
-                print('auxPrice:', order.auxPrice)
-                print('-----------------------------')
+                self.log.debug('Order params: action: {} totalQuantity: {} outsideRth: {} tif: {} orderType: {} displaySize: {} hidden: {} auxPrice: {}'.format(
+                    side, strategy['orderQty'], 
+                    paramOutsideRth if paramOutsideRth != '' else True, 
+                    paramValidity if paramValidity != '' else 'GTC', 
+                    paramOrderType if paramOrderType != '' else 'LMT', 
+                    order.displaySize, order.hidden, order.auxPrice
+                ))
                 
             if self.validate_order(order, strategy):
-                trade = self.placeOrder(strategy['contract'], order)
-                self.lastTimeOrder = datetime.now()
+                trade = self.send_place_order(strategy['contract'], order, priority)
+                self.riskManager.commit_order(order)
+                metrics.ORDERS_POSTED.increment(priority=priority)
+                self.lastTimeOrder = self.clock.now()
                 self.sleep(0)   # Garantiza el funcionamiento asyncrono
-                msg = f"{prefix}Order: {orderId} {side} {order.totalQuantity} en {trade.contract.symbol} al precio {order.lmtPrice}"
-                if verbose: print(f'   {msg}')
-                self.log.info(msg)
+                queued = '' if trade is not None else ' (queued)'
+                msg = f"{prefix}Order: {orderId} {side} {order.totalQuantity} en {strategy['contract'].symbol} al precio {order.lmtPrice}{queued}"
+                self.log.info(msg, extra={'strategyId': strategy['strategyId'], 'orderRef': orderId, 'side': side, 'price': order.lmtPrice})
                 telegram.send_to_telegram(msg, self.configuration)
             else:
-                if verbose: print('   Riesgo no aceptable. No se insertó la orden {} {} en precio {}'.format(side, strategy['symbol'], price))
+                if verbose: self.log.info('   Riesgo no aceptable. No se insertó la orden {} {} en precio {}'.format(side, strategy['symbol'], price))
         except Exception as e:
             self.log.exception('Error agregando orden {} {} en precio {}'.format(side, strategy['symbol'], price))
             return False
@@ -374,11 +816,12 @@ class Core(IB):
         '''
         timeBegin = time.time()
         operate = self.riskManager.can_operate(order, strategy, self)
+        latency = time.time() - timeBegin
+        metrics.RISK_CHECK_SECONDS.observe(latency)
         if not operate: 
-            text = f'   Order rejected at {round(time.time()-timeBegin, 2)} seconds'
-            self.log.info(text)
-            if verbose and not operate: 
-                print(text)
+            metrics.ORDERS_REJECTED.increment()
+            text = f'   Order rejected at {round(latency, 2)} seconds'
+            self.log.info(text, extra={'strategyId': strategy['strategyId'], 'orderRef': order.orderRef, 'latency': latency})
         return operate
 
 
@@ -395,20 +838,20 @@ class Core(IB):
         try:
             count = 0
             if verbose:
-                print('{} - Searching pending orders for all client strategies...'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                self.log.info('Searching pending orders for all client strategies...')
+            # Primero las que esperan en el regulador de mensajes, para que no se envien durante las cancelaciones.
+            discarded = self.discard_queued_orders(self.orderIdManager.is_order_child_of_client)
             # Manuel.  Cambiar por self.reqAllOpenOrders() por si acaso openORders() no descarga las órdenes que no son de este cliente
             # Manuel.  Crear un parámetro global para indicar si se cancela todo o no, incluidas órdenes de otros clientes
             # Manuel.  El valor por defecto del parámetro global es que si, se cancelaría todo
             for order in self.openOrders():
                 if self.orderIdManager.is_order_child_of_client(order.orderRef):
                     if verbose:
-                        print('   Cancelada orden', order.orderRef)
+                        self.log.info(f'   Cancelada orden {order.orderRef}')
                     self.cancel_order(order)
                     count += 1
                 self.sleep(0)   # Garantiza el funcionamiento asyncrono
-            msg = 'Se han cancelado {} órdenes pendientes de todas las estrategias del cliente'.format(count)
-            if verbose:
-                print(f'   {msg}')
+            msg = 'Se han cancelado {} órdenes pendientes y descartado {} encoladas de todas las estrategias del cliente'.format(count, discarded)
             self.log.info(msg)
             return True
         except Exception as e:
@@ -427,17 +870,16 @@ class Core(IB):
         try:
             count = 0
             if verbose:
-                print('{} - Searching for pending orders of the strategy...'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), strategyId))
+                self.log.info('Searching for pending orders of the strategy {}...'.format(strategyId))
+            discarded = self.discard_queued_orders(lambda orderRef: self.orderIdManager.is_order_child_of_strategy(orderRef, strategyId))
             for order in self.openOrders():
                 if self.orderIdManager.is_order_child_of_strategy(order.orderRef, strategyId):
                     if verbose:
-                        print('   Order canceled', order.orderRef)
+                        self.log.info(f'   Order canceled {order.orderRef}', extra={'strategyId': strategyId, 'orderRef': order.orderRef})
                     self.cancel_order(order)
                     count += 1
                 self.sleep(0)   # Garantiza el funcionamiento asyncrono
-            msg = '{} pending orders of the strategy {} have been canceled'.format(count, strategyId)
-            if verbose:
-                print(f'   {msg}')
+            msg = '{} pending orders of the strategy {} have been canceled and {} queued ones discarded'.format(count, strategyId, discarded)
             self.log.info(msg)
             return True
         except Exception as e:
@@ -446,6 +888,21 @@ class Core(IB):
 
 
 
+    def discard_queued_orders(self, belongs):
+        '''
+        Removes from the rate governor the new orders that wait to be placed and releases them from the risk ledger.
+        belongs: Function that receives the orderRef and returns True if the order must be discarded.
+        return: Number of discarded orders.
+        '''
+        count = 0
+        for tag in self.governor.pending_tags():
+            if tag[0] == 'place' and belongs(tag[1].orderRef):
+                count += self.governor.discard(tag)
+                self.riskManager.release_order(tag[1])
+        return count
+
+
+
     def cancel_order(self, order, awaitSeconds=10):
         '''
         Ordena cancelar una orden y espera un tiempo a que termine.
@@ -454,11 +911,11 @@ class Core(IB):
         return: Retorna True si logra cancelar antes del tiempo de espera.
         '''
         try:
-            self.cancelOrder(order)
+            self.send_cancel_order(order)
             while awaitSeconds > 0:
                 if not self.order_exist(order.orderRef):
                     return True
-                self.sleep(1)   # Garantiza el funcionamiento asyncrono
+                self.clock.sleep(1)   # Garantiza el funcionamiento asyncrono
                 awaitSeconds -= 1              
             return False
         except Exception as e:
@@ -470,7 +927,7 @@ class Core(IB):
     def order_exist(self, orderID):
         '''Devuelve True si la orden especificada existe.'''
         try:
-            return len(list(filter(lambda x: x.orderRef == orderID, self.openOrders()))[0]) > 0
+            return any(order.orderRef == orderID for order in self.openOrders())
         except:
             return False
         
@@ -478,7 +935,7 @@ class Core(IB):
 
     def get_timestamp_for_seconds(self, seconds):
         '''Devuelve el DateTime correspondiente a la fecha actual mas los segundos indicados.'''
-        return datetime.now() + timedelta(seconds=seconds)
+        return self.clock.now() + timedelta(seconds=seconds)
 
 
 
@@ -494,37 +951,53 @@ class Core(IB):
             text = f'The connection has been lost since {lastDateTime}'
         else:
             text = f'The script has not been executed since {lastDateTime}'
-        print(text)
         self.log.info(text)
         telegram.send_to_telegram(text, self.configuration)   
         noRelaunch = []            
+        reconcile = []
         for stratgy in self.parameters.strategies:
-            if not self.can_relaunch_strategy(stratgy['exchange'], datetime.now(), lastDateTime, reconnection):
+            if not self.can_relaunch_strategy(stratgy['exchange'], self.clock.now(), lastDateTime, reconnection):
                 noRelaunch.append(stratgy)
                 text = f"The strategy {stratgy['strategyId']} will not be restarting."
-                print(text)
                 self.log.info(text)
                 telegram.send_to_telegram(text, self.configuration)   
             else:
                 text = f"Restarting strategy {stratgy['strategyId']}"
-                print(text)
                 self.log.info(text)
                 telegram.send_to_telegram(text, self.configuration)   
-                self.cancel_orders_of_strategy(stratgy['strategyId'], verbose=True)
-        self.parameters.strategies = noRelaunch
+                if self.can_reconcile_strategy(stratgy):
+                    reconcile.append(stratgy)
+                else:
+                    self.cancel_orders_of_strategy(stratgy['strategyId'], verbose=True)
+        if len(reconcile) > 0:
+            # Las estrategias reconciliadas se mantienen para que no se vuelvan a poner como NEW.
+            self.orderReconciler.reconcile(reconcile, self)
+        self.parameters.strategies = noRelaunch + reconcile
+
+
+
+    def can_reconcile_strategy(self, strategy):
+        '''
+        Check if the live orders of the strategy can be reconciled instead of being canceled.
+        Only active strategies with a known price and a valid confirmation are reconciled.
+        '''
+        if not self.configuration.get('reconcile_on_restart', False): return False
+        if not strategy.get('active', False): return False
+        if strategy.get('action') in ['STOP', 'DELETED']: return False
+        if not strategy.get('initialPrice'): return False
+        return self.can_post_grid(strategy)
 
 
 
     def read_heart_beat(self, verbose=False):
-        '''Devuelve el dato del fichero heartbeat.txt'''
-        HEARTBEAT = 'heartbeat.txt'
+        '''Devuelve el dato del fichero de latido (heartbeat.txt por defecto)'''
+        HEARTBEAT = self.configuration.get('heartbeat_file', 'heartbeat.txt')
         try:
             with open(HEARTBEAT, 'r') as file:
                 line = file.readline().split('--')[0].rstrip()
                 return datetime.strptime(line, "%Y-%m-%d %H:%M:%S.%f")
         except Exception as e:
             text = f'Error reading {HEARTBEAT}  Exception: {str(e)}'
-            if verbose: print(text)
             self.log.info(text)
             return None
 
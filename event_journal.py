@@ -0,0 +1,385 @@
+
+'''
+Diario de Eventos
+
+Graba en un fichero binario, solo de añadido, todos los eventos que llegan del broker a Core
+(ejecuciones, estados de órdenes, errores, conexiones, desconexiones y cambios del portafolio)
+y cada lectura de la hoja de estrategias. Permite reproducir después un incidente de producción
+(ráfagas de ejecuciones, tormentas de reconexión, chequeos de riesgo lentos) contra el broker
+simulado, para perfilarlo con el tráfico real.
+
+Formato del fichero: la firma MAGIC y después un registro por evento. Cada registro es una
+cabecera fija (longitud del contenido, marca de tiempo epoch y tipo de evento) seguida del
+contenido serializado con pickle. De los objetos de ib_insync (Order, Contract, OrderStatus...)
+solo se guardan los campos que no tienen el valor por defecto, para que el diario sea compacto. Si el bot se detiene a mitad de un registro, el lector
+ignora el registro incompleto del final.
+
+La reproducción se hace en el orden del fichero, un evento tras otro, así que el orden es
+siempre el mismo. Los tiempos entre eventos se dividen por la velocidad indicada (por defecto
+100 veces más rápido). Con velocidad 0 se reproduce sin esperas.
+
+Uso:
+    python event_journal.py ./state/journal.bin --speed 100 [--profile replay.prof]
+    python event_journal.py ./state/journal.bin --summary
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from ib_insync import Trade, util
+import argparse
+import copy
+import dataclasses
+import io
+import logging
+import os
+import pickle
+import struct
+import time
+
+MAGIC = b'GRIDJNL1'
+HEADER = struct.Struct('<IdB')      # Longitud del contenido, marca de tiempo, tipo de evento.
+
+EXEC_DETAILS = 1
+ORDER_STATUS = 2
+ERROR = 3
+CONNECTED = 4
+DISCONNECTED = 5
+PORTFOLIO = 6
+STRATEGIES = 7
+ARCHIVED_TRADE = 8      # Solo en el archivo de operaciones terminadas (trade_archive).
+ARCHIVED_FILL = 9
+KIND_NAMES = {
+    EXEC_DETAILS: 'execDetails', ORDER_STATUS: 'orderStatus', ERROR: 'error', CONNECTED: 'connected',
+    DISCONNECTED: 'disconnected', PORTFOLIO: 'portfolio', STRATEGIES: 'strategies',
+    ARCHIVED_TRADE: 'archivedTrade', ARCHIVED_FILL: 'archivedFill'
+}
+# Parametros que agrega MultiParameters a las tablas de la hoja. Se vuelven a calcular al reproducir.
+DERIVED_FIELDS = ['contract', 'contractId', 'market']
+
+
+class EventJournal:
+
+    def __init__(self, fileName, maxMegabytes=512):
+        '''
+        fileName: Journal file. The records are appended to it.
+        maxMegabytes: When the file is bigger, it is renamed with the suffix ".1" and a new one is started.
+        '''
+        self.fileName = fileName
+        self.maxBytes = maxMegabytes * 1024 * 1024
+        self.log = logging.getLogger('grid')
+        folder = os.path.dirname(fileName)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.file = None
+        self.ib = None
+        self._open()
+
+
+
+    def attach(self, ib):
+        '''Subscribes the journal to the events of the broker. It must be called before the other handlers are added.'''
+        self.ib = ib
+        ib.execDetailsEvent += self._onExecDetails
+        ib.orderStatusEvent += self._onOrderStatus
+        ib.errorEvent += self._onError
+        ib.connectedEvent += self._onConnected
+        ib.disconnectedEvent += self._onDisconnected
+        ib.updatePortfolioEvent += self._onPortfolio
+
+
+
+    def record(self, kind, *args):
+        '''Appends a record. Errors are logged and never reach the caller.'''
+        try:
+            buffer = io.BytesIO()
+            _JournalPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(args)
+            payload = buffer.getvalue()
+            self.file.write(HEADER.pack(len(payload), time.time(), kind))
+            self.file.write(payload)
+            self.file.flush()
+            if self.file.tell() > self.maxBytes:
+                self._rotate()
+        except Exception as e:
+            self.log.exception(f'Unable to record the event {KIND_NAMES.get(kind, kind)} in the journal: {str(e)}')
+
+
+
+    def record_strategies(self, tables):
+        '''Records the tables read from the strategies sheet, with their contracts and prices.'''
+        self.record(STRATEGIES, tables)
+
+
+
+    def close(self):
+        if self.ib is not None:
+            self.ib.execDetailsEvent -= self._onExecDetails
+            self.ib.orderStatusEvent -= self._onOrderStatus
+            self.ib.errorEvent -= self._onError
+            self.ib.connectedEvent -= self._onConnected
+            self.ib.disconnectedEvent -= self._onDisconnected
+            self.ib.updatePortfolioEvent -= self._onPortfolio
+            self.ib = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+
+    def _open(self):
+        self.file = open(self.fileName, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+            self.file.flush()
+
+
+
+    def _rotate(self):
+        self.file.close()
+        os.replace(self.fileName, self.fileName + '.1')
+        self._open()
+
+
+
+    def _onExecDetails(self, trade, fill):
+        self.record(EXEC_DETAILS, trade.contract, trade.order, trade.orderStatus, fill)
+
+    def _onOrderStatus(self, trade):
+        self.record(ORDER_STATUS, trade.contract, trade.order, trade.orderStatus)
+
+    def _onError(self, reqId, errorCode, errorString, contract):
+        self.record(ERROR, reqId, errorCode, errorString, contract)
+
+    def _onConnected(self):
+        self.record(CONNECTED)
+
+    def _onDisconnected(self):
+        self.record(DISCONNECTED)
+
+    def _onPortfolio(self, item):
+        self.record(PORTFOLIO, item)
+
+
+
+class _JournalPickler(pickle.Pickler):
+    '''Pickles the dataclasses of ib_insync with only their non-default fields.'''
+
+    def reducer_override(self, obj):
+        if dataclasses.is_dataclass(obj) and not isinstance(obj, type) and type(obj).__module__.startswith('ib_insync'):
+            return _restore, (type(obj), util.dataclassNonDefaults(obj))
+        return NotImplemented
+
+
+
+def _restore(cls, values):
+    '''Rebuilds a dataclass from its non-default fields, without calling the constructor of the subclasses.'''
+    obj = cls.__new__(cls)
+    for field in dataclasses.fields(cls):
+        if field.default is not dataclasses.MISSING:
+            setattr(obj, field.name, field.default)
+        elif field.default_factory is not dataclasses.MISSING:
+            setattr(obj, field.name, field.default_factory())
+    obj.__dict__.update(values)
+    return obj
+
+
+
+def read_journal(fileName):
+    '''
+    Reads the records of a journal.
+    return: Generator of tuples (timestamp, kind, args).
+    '''
+    with open(fileName, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{fileName} is not an event journal.')
+        while True:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, timestamp, kind = HEADER.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                return      # Registro incompleto: el bot se detuvo mientras lo escribia.
+            yield timestamp, kind, pickle.loads(payload)
+
+
+
+class RecordedSheet:
+    '''Replaces the Google Sheets interface of MultiParameters with the last recorded snapshot.'''
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.tables = None
+
+    def read_tables(self, *args, **kwargs):
+        return copy.deepcopy(self.tables)
+
+    def __getattr__(self, name):
+        return getattr(self.sheet, name)
+
+
+
+class JournalReplay:
+
+    def __init__(self, core, fileName, speed=100.0):
+        '''
+        core: Core with the simulated broker, as created by simulated_broker.create_simulated_core().
+        fileName: Journal to replay.
+        speed: Time acceleration. 0 replays without waiting.
+        '''
+        self.core = core
+        self.fileName = fileName
+        self.speed = speed
+        self.trades = {}        # (clientId, orderId): trade reconstruido a partir de los eventos.
+        self.sheet = RecordedSheet(core.parameters.multiTable)
+        core.parameters.multiTable = self.sheet
+        core.simulatedConnected = True      # El diario puede empezar despues de la conexion.
+        self.handlers = {
+            EXEC_DETAILS: self._replay_exec_details,
+            ORDER_STATUS: self._replay_order_status,
+            ERROR: self._replay_error,
+            CONNECTED: self._replay_connected,
+            DISCONNECTED: self._replay_disconnected,
+            PORTFOLIO: self._replay_portfolio,
+            STRATEGIES: self._replay_strategies,
+        }
+        self.log = logging.getLogger('grid')
+
+
+
+    def run(self):
+        '''
+        Feeds every record of the journal to Core in order.
+        return: Dictionary with the number of records of each kind and the duration of the replay.
+        '''
+        counts = {name: 0 for name in KIND_NAMES.values()}
+        firstTimestamp = None
+        timeBegin = time.perf_counter()
+        for timestamp, kind, args in read_journal(self.fileName):
+            if firstTimestamp is None:
+                firstTimestamp = timestamp
+            delay = 0
+            if self.speed > 0:
+                delay = (timestamp - firstTimestamp) / self.speed - (time.perf_counter() - timeBegin)
+            self.core.sleep(max(delay, 0))  # Deja correr el bucle de eventos, como en produccion.
+            try:
+                self.handlers[kind](*args)
+            except Exception as e:
+                self.log.exception(f'Error replaying the event {KIND_NAMES.get(kind, kind)}: {str(e)}')
+            name = KIND_NAMES.get(kind, str(kind))
+            counts[name] = counts.get(name, 0) + 1
+        return {
+            "records": sum(counts.values()),
+            "recordedSeconds": timestamp - firstTimestamp if firstTimestamp is not None else 0,
+            "replaySeconds": time.perf_counter() - timeBegin,
+            "kinds": counts
+        }
+
+
+
+    def _trade(self, contract, order, orderStatus):
+        '''Returns the reconstructed trade of the order with its last status.'''
+        key = (order.clientId, order.orderId)
+        trade = self.trades.get(key)
+        if trade is None:
+            trade = self.trades[key] = Trade(contract, order, orderStatus)
+        trade.order = order
+        trade.orderStatus = orderStatus
+        return trade
+
+
+
+    def _replay_exec_details(self, contract, order, orderStatus, fill):
+        trade = self._trade(contract, order, orderStatus)
+        trade.fills.append(fill)
+        self.core.execDetailsEvent.emit(trade, fill)
+
+
+
+    def _replay_order_status(self, contract, order, orderStatus):
+        self.core.orderStatusEvent.emit(self._trade(contract, order, orderStatus))
+
+
+
+    def _replay_error(self, reqId, errorCode, errorString, contract):
+        self.core.errorEvent.emit(reqId, errorCode, errorString, contract)
+
+
+
+    def _replay_connected(self):
+        self.core.simulatedConnected = True
+        self.core.connectedEvent.emit()
+
+
+
+    def _replay_disconnected(self):
+        self.core.simulatedConnected = False
+        self.core.disconnectedEvent.emit()
+
+
+
+    def _replay_portfolio(self, item):
+        '''Sets the position in the simulated broker, so that the risk checks see the real portfolio.'''
+        conId = item.contract.conId
+        self.core.simulatedContracts[conId] = item.contract
+        self.core.simulatedPrices[conId] = item.marketPrice
+        multiplier = float(item.contract.multiplier) if item.contract.multiplier else 1.0
+        self.core.simulatedPositions[conId] = {
+            "position": item.position, "averageCost": item.averageCost / multiplier, "realized": item.realizedPNL
+        }
+        self.core.updatePortfolioEvent.emit(item)
+
+
+
+    def _replay_strategies(self, tables):
+        '''Publishes the snapshot of the sheet, with its prices in the simulated broker, and runs one status cycle.'''
+        for table in tables:
+            contract = table.get('contract')
+            market = table.get('market')
+            if contract is not None and market is not None:
+                # Se crea igual que en MultiParameters para que el broker simulado le asigne el mismo conId.
+                contract = self.core.parameters._create_contract_parameters(table)
+                self.core.qualifyContracts(contract)
+                self.core.simulatedPrices[contract.conId] = market.close
+        self.sheet.tables = [{key: value for key, value in table.items() if key not in DERIVED_FIELDS} for table in tables]
+        self.core.actualize_bot_status()
+
+
+
+def summary(fileName):
+    '''Returns the number of records of each kind and the recorded period.'''
+    counts = {}
+    first = last = None
+    for timestamp, kind, args in read_journal(fileName):
+        name = KIND_NAMES.get(kind, str(kind))
+        counts[name] = counts.get(name, 0) + 1
+        first = timestamp if first is None else first
+        last = timestamp
+    return {"records": sum(counts.values()), "recordedSeconds": last - first if first is not None else 0, "kinds": counts}
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays an event journal in Core against the simulated broker.')
+    parser.add_argument('journal', help='Journal file recorded by the bot.')
+    parser.add_argument('--speed', type=float, default=100.0, help='Time acceleration. 0 replays without waiting.')
+    parser.add_argument('--profile', default=None, help='Profiles the replay with cProfile and writes the stats to this file.')
+    parser.add_argument('--summary', action='store_true', help='Only shows the contents of the journal.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.summary:
+        print(summary(args.journal))
+    else:
+        from simulated_broker import create_simulated_core, LOAD_TEST_CONFIGURATION
+        core = create_simulated_core(LOAD_TEST_CONFIGURATION)
+        replay = JournalReplay(core, args.journal, args.speed)
+        if args.profile:
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            result = profiler.runcall(replay.run)
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+        else:
+            result = replay.run()
+        print(result)
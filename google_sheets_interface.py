@@ -11,6 +11,8 @@ from google.auth.transport.requests import Request
 import os
 import pickle
 import logging 
+import time
+import metrics
 
 from ib_insync import *
 
@@ -73,6 +75,7 @@ class GoogleSheetsInterface:
                 que están al inicio o al final.
         '''
         table = self.create_range(page, beginColumn, beginRow, columns, rows)
+        timeBegin = time.time()
         try:
             creds = None
             if os.path.exists(self.token):
@@ -90,39 +93,49 @@ class GoogleSheetsInterface:
             sheet = service.spreadsheets()
             sheetExecuteResult = sheet.values().get(spreadsheetId=self.sheetID, range=table).execute()
             tableData = sheetExecuteResult.get('values', [])        
+            metrics.SHEETS_SECONDS.observe(time.time() - timeBegin, operation='read')
 
-            tables = []   
-            parametersAsDictionary = {}
-            rowIndex = beginRow
-            for param in tableData:
-                if len(param) > 0:
-                    try:
-                        paramName = self.create_param_name(param[0])
-                        if paramName == TABLE_BEGIN:
-                            if len(parametersAsDictionary) > 0:
-                                tables.append(parametersAsDictionary)
-                                parametersAsDictionary = {}
-                            parametersAsDictionary['beginRow'] = rowIndex
-                        if len(param) > 1:
-                            parametersAsDictionary[paramName] = param[1]
-                        else:
-                            parametersAsDictionary[paramName] = None
-                    except Exception as e:
-                        msg = f'Error reading param from Google Sheets row {rowIndex}'
-                        if verbose: print(msg)
-                        self.log.exception(f'{msg} Error: {str(e)}')
-                rowIndex += 1
-            if len(parametersAsDictionary) > 0:
-                tables.append(parametersAsDictionary)
-            return tables    
+            return self.parse_tables(tableData, beginRow)
         except Exception as e:
             msg = f'Error reading strategies from Google Sheets {str(e)}'
-            if verbose: print(msg)
             self.log.exception(msg)
             return None
 
 
 
+    def parse_tables(self, tableData, beginRow=1):
+        '''
+        Converts the rows read from the sheet into the list of parameter tables.
+        tableData: List of rows, each one a list with the name and the value of a parameter.
+        beginRow: Number of the sheet row of the first element of tableData.
+        return: List of dictionaries, one per table. Each table begins with the TABLE_BEGIN parameter.
+        '''
+        tables = []   
+        parametersAsDictionary = {}
+        rowIndex = beginRow
+        for param in tableData:
+            if len(param) > 0:
+                try:
+                    paramName = self.create_param_name(param[0])
+                    if paramName == TABLE_BEGIN:
+                        if len(parametersAsDictionary) > 0:
+                            tables.append(parametersAsDictionary)
+                            parametersAsDictionary = {}
+                        parametersAsDictionary['beginRow'] = rowIndex
+                    if len(param) > 1:
+                        parametersAsDictionary[paramName] = param[1]
+                    else:
+                        parametersAsDictionary[paramName] = None
+                except Exception as e:
+                    msg = f'Error reading param from Google Sheets row {rowIndex}'
+                    self.log.exception(f'{msg} Error: {str(e)}')
+            rowIndex += 1
+        if len(parametersAsDictionary) > 0:
+            tables.append(parametersAsDictionary)
+        return tables
+
+
+
     def create_param_name(self, inputString):
         '''
         Receives a character string of one or more words and 
@@ -269,12 +282,14 @@ class GoogleSheetsInterface:
         table = self.get_R1C1_Notation (sheet_name, start_column, start_row, data)
         
         try:
+            timeBegin = time.time()
             response = service.spreadsheets().values().update(
                 spreadsheetId= self.sheetID,
                 range=table,
                 body={'values': data},
                 valueInputOption='RAW'
             ).execute()
+            metrics.SHEETS_SECONDS.observe(time.time() - timeBegin, operation='write')
             return response
 
         except Exception as e:
@@ -298,6 +313,7 @@ class GoogleSheetsInterface:
         """
         
         try:
+            timeBegin = time.time()
             # core.dashBoard.isUpdating = True
             # Get the sheet ID based on the sheet name
             data = [data]
@@ -345,6 +361,7 @@ class GoogleSheetsInterface:
                 spreadsheetId=self.sheetID,
                 body=request_body
             ).execute()
+            metrics.SHEETS_SECONDS.observe(time.time() - timeBegin, operation='insert')
             return response
         except Exception as e:
             # Capture and display any exceptions that occur
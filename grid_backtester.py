@@ -0,0 +1,212 @@
+
+'''
+Backtester del Grid
+
+Simula fuera de línea la lógica de post_grid_orders() y onExecDetailsEvent() de Core sobre
+barras OHLC o ticks históricos, con las estrategias en el mismo formato que produce MultiParameters.
+
+Mientras el grid no tenga huecos, su estado completo es el nivel de la última ejecución (centro):
+hay compras en todos los niveles por debajo y ventas en todos los niveles por encima, porque cada
+compra ejecutada en el nivel k pone una venta en k + 1 y cada venta en k pone una compra en k - 1.
+Por eso los cruces de nivel de cada barra se calculan vectorizados con NumPy, el centro se
+actualiza con un recorrido escalar muy simple sobre los puntos de cada barra y la contabilidad (ejecuciones, P&L, inventario y
+exposición) se vuelve a calcular vectorizada a partir de la trayectoria del centro.
+Dentro de cada barra se supone el recorrido open-low-high-close si la barra sube y
+open-high-low-close si baja, y entre barras se ejecutan los niveles del hueco hasta el open.
+El inventario máximo y la exposición máxima se miden sobre ese mismo recorrido y en cada
+ejecución, así que incluyen las excursiones dentro de la barra que se revierten antes del close.
+En modo ventana (activeBuyOrders, activeSellOrders) las ejecuciones son las mismas: las órdenes que
+slide_grid_window() pone dentro del rango ya recorrido por el precio se ejecutan enseguida.
+
+Los límites de RiskManager se aplican al poner la escalera, en el mismo orden que post_grid_orders():
+desde el nivel más cercano al más lejano, el primer nivel rechazado termina ese lado de la escalera.
+Mientras no hay huecos, la cantidad virtual (posición más órdenes abiertas) de cada lado es constante,
+así que los niveles aceptados al inicio siguen siendo aceptables durante la simulación.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+import numpy as np
+import grid_ladder
+
+EPSILON = 1e-9      # Tolerancia para que un precio igual al del nivel cuente como cruce.
+
+
+def risk_limits():
+    '''Returns the limits of RiskManager: {"order": ..., "position": {"contract": ..., "global": ...}}.'''
+    # RiskManager importa ib_insync y telegram, por eso solo se carga si no se indican los limites.
+    from risk_manager import RiskManager
+    return RiskManager({}).max
+
+
+
+def multiplier_of(strategy):
+    '''Returns the contract multiplier of the strategy, like RiskManager does.'''
+    if strategy.get('mode') == 'FUTURE':
+        return int(strategy.get('futureMultiplier') or 1)
+    return 1
+
+
+
+class GridBacktester:
+
+    def __init__(self, limits=None, commission=0.0):
+        '''
+        limits: Risk limits with the structure of RiskManager.max. If None, the limits of RiskManager are used.
+        commission: Commission paid on each fill, in the currency of the contract.
+        '''
+        self.limits = limits if limits is not None else risk_limits()
+        self.commission = commission
+
+
+
+    def ladder_bounds(self, strategy):
+        '''
+        Calculates the levels of the ladder that pass the risk limits.
+        return: Tuple (lowest, highest, rejected). lowest and highest are the indexes of the farthest
+                accepted buy and sell levels and rejected is the number of levels that were not posted.
+        '''
+        quantity = float(strategy['orderQty']) * multiplier_of(strategy)
+        maxPosition = min(self.limits['position']['contract'], self.limits['position']['global'])
+        # En modo ventana la posicion acumulada ocupa el lugar de los niveles ya ejecutados, asi que se revisa la escalera completa.
+        buyIndexes = range(-1, -int(strategy['buyOrders']) - 1, -1)
+        sellIndexes = range(1, int(strategy['sellOrders']) + 1)
+        bounds = []
+        rejected = 0
+        for indexes in (buyIndexes, sellIndexes):
+            accepted = 0
+            virtual = 0.0
+            for position, index in enumerate(indexes):
+                nominal = abs(quantity * grid_ladder.level_price(strategy, index))
+                virtual += nominal
+                if nominal > self.limits['order'] or virtual > maxPosition:
+                    rejected += len(indexes) - position
+                    break
+                accepted = index
+            bounds.append(accepted)
+        return bounds[0], bounds[1], rejected
+
+
+
+    def run(self, strategy, bars):
+        '''
+        Runs the backtest of one strategy.
+        strategy: Strategy parameters, as produced by MultiParameters.
+        bars: Dictionary (or DataFrame) with the arrays "open", "high", "low" and "close",
+              or a single array of tick prices.
+        return: Dictionary with the totals and the series "centerSeries", "inventorySeries" and "equitySeries" per bar.
+        '''
+        opens, highs, lows, closes = _ohlc(bars)
+        initialPrice = float(strategy['initialPrice'])
+        step = float(strategy['step'])
+        quantity = float(strategy['orderQty'])
+        value = quantity * multiplier_of(strategy)     # Valor de una orden por unidad de precio.
+        lowest, highest, rejected = self.ladder_bounds(strategy)
+
+        # Recorrido de precios: cuatro puntos por barra (open, primer extremo, segundo extremo, close).
+        upBar = closes >= opens
+        path = np.column_stack((opens, np.where(upBar, lows, highs), np.where(upBar, highs, lows), closes)).ravel()
+        # Cruces de nivel de cada punto: el nivel mas bajo alcanzado bajando y el mas alto subiendo.
+        lowLevels = np.clip(np.ceil((path - initialPrice) / step - EPSILON), lowest, highest).astype(np.int64)
+        highLevels = np.clip(np.floor((path - initialPrice) / step + EPSILON), lowest, highest).astype(np.int64)
+
+        # Trayectoria del centro: es el unico estado que depende del punto anterior.
+        # Los puntos que repiten los cruces del punto anterior no mueven el centro, por eso solo se recorren los cambios.
+        changes = np.ones(len(path), dtype=bool)
+        changes[1:] = (lowLevels[1:] != lowLevels[:-1]) | (highLevels[1:] != highLevels[:-1])
+        changed = np.flatnonzero(changes)
+        centers = [0] * len(changed)
+        center = 0
+        for point, (low, high) in enumerate(zip(lowLevels[changed].tolist(), highLevels[changed].tolist())):
+            if low < center:
+                center = low
+            elif high > center:
+                center = high
+            centers[point] = center
+        centers = np.array(centers, dtype=np.int64)[np.cumsum(changes) - 1]
+
+        # Contabilidad vectorizada a partir de la trayectoria.
+        previous = np.concatenate(([0], centers[:-1]))
+        moves = centers - previous
+        buyCount = np.where(moves < 0, -moves, 0).reshape(-1, 4).sum(axis=1)
+        sellCount = np.where(moves > 0, moves, 0).reshape(-1, 4).sum(axis=1)
+        # Cada paso del centro es una ejecucion en un nivel: bajar de c a c - 1 compra en c - 1 y subir de c - 1 a c vende en c.
+        cash = value * _levels_sum(previous, centers, initialPrice, step).reshape(-1, 4).sum(axis=1)
+        cash -= self.commission * (buyCount + sellCount)
+        cashAccumulated = np.cumsum(cash)
+        # Los maximos de inventario y exposicion se miden sobre todo el recorrido, no solo en el close,
+        # para no perder las excursiones que ejecutan niveles y se revierten antes del cierre.
+        # La exposicion se toma en cada punto y en cada ejecucion (con el inventario de antes y de despues),
+        # que es donde cambia el inventario o el precio deja de moverse en un sentido.
+        pathLevels = np.abs(centers)
+        maxLevels = int(pathLevels.max()) if len(path) > 0 else 0
+        peakValue = max(float((pathLevels * path).max()), _fills_peak(previous, centers, initialPrice, step)) if len(path) > 0 else 0.0
+        centers = centers[3::4]
+        inventory = -centers * quantity
+        equity = cashAccumulated + inventory * multiplier_of(strategy) * closes
+        # El P&L realizado descuenta de la caja el costo de entrada del inventario abierto (niveles entre 0 y el centro).
+        finalCenter = int(centers[-1]) if len(centers) > 0 else 0
+        openCost = value * _levels_sum(np.array([0]), np.array([finalCenter]), initialPrice, step)[0]
+        return {
+            "strategyId": strategy.get('strategyId'),
+            "bars": len(closes),
+            "lowestLevel": lowest,
+            "highestLevel": highest,
+            "rejectedLevels": rejected,
+            "fills": int(buyCount.sum() + sellCount.sum()),
+            "buys": int(buyCount.sum()),
+            "sells": int(sellCount.sum()),
+            "realizedPnl": float(cashAccumulated[-1] - openCost) if len(closes) > 0 else 0.0,
+            "equity": float(equity[-1]) if len(closes) > 0 else 0.0,
+            "finalInventory": float(inventory[-1]) if len(closes) > 0 else 0.0,
+            "maxInventory": float(maxLevels * quantity),
+            "peakExposure": float(peakValue * value),
+            "centerSeries": centers,
+            "inventorySeries": inventory,
+            "equitySeries": equity
+        }
+
+
+
+def _ohlc(bars):
+    '''Returns the arrays open, high, low and close. A single array of ticks is used for the four of them.'''
+    if isinstance(bars, dict) or hasattr(bars, 'columns'):
+        return tuple(np.asarray(bars[name], dtype=np.float64) for name in ('open', 'high', 'low', 'close'))
+    prices = np.asarray(bars, dtype=np.float64)
+    return prices, prices, prices, prices
+
+
+
+def _fills_peak(begin, end, initialPrice, step):
+    '''
+    Returns the largest value of levels held times fill price over every fill of the path, per unit of order value.
+    At each fill both the inventory before and after it are counted, because the price reaches the level with the
+    previous inventory. Moving from c to c - 1 buys at the level c - 1 and moving from c - 1 to c sells at the level c.
+    '''
+    moves = end - begin
+    points = np.flatnonzero(moves)
+    if len(points) == 0:
+        return 0.0
+    counts = np.abs(moves[points])
+    directions = np.repeat(np.sign(moves[points]), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    levels = np.repeat(begin[points], counts) + directions * (offsets + 1)
+    held = np.maximum(np.abs(levels), np.abs(levels - directions))
+    return float((held * (initialPrice + step * levels)).max())
+
+
+
+def _levels_sum(begin, end, initialPrice, step):
+    '''
+    Returns the signed cash of moving the center from begin to end for each bar, per unit of order value.
+    Going down buys the levels end..begin-1 (negative cash), going up sells the levels begin+1..end (positive cash).
+    '''
+    low = np.minimum(begin, end)
+    high = np.maximum(begin, end)
+    count = high - low
+    # Suma de los indices de los niveles ejecutados: bajando son low..high-1 y subiendo low+1..high.
+    downIndexes = (low + high - 1) * count / 2
+    upIndexes = (low + 1 + high) * count / 2
+    down = end < begin
+    return np.where(down, -(initialPrice * count + step * downIndexes), initialPrice * count + step * upIndexes)
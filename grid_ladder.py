@@ -0,0 +1,74 @@
+
+'''
+Escalera del Grid
+
+Funciones para calcular los niveles de precio que componen la cuadrícula (grid) de una estrategia.
+Todos los niveles se calculan sobre la misma red de precios: initialPrice + k * step, con k entre
+-buyOrders y sellOrders. Por debajo del precio central se ponen compras y por encima ventas.
+Si la estrategia tiene los parámetros "activeBuyOrders" o "activeSellOrders", solo se mantienen
+vivos los N niveles más cercanos al precio central (modo ventana deslizante).
+No dependen del broker, por lo que se pueden reutilizar fuera de Core.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+PRICE_DECIMALS = 8      # Decimales con los que se redondean los precios de los niveles.
+
+
+def window_size(strategy, side):
+    '''
+    Returns the number of live levels configured for the side, or None if the side has no window.
+    side: "BUY" uses "activeBuyOrders" and "SELL" uses "activeSellOrders".
+    '''
+    value = strategy.get('activeBuyOrders' if side == 'BUY' else 'activeSellOrders')
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    return None
+
+
+
+def is_window_mode(strategy):
+    '''Returns True if the strategy keeps only the nearest levels live.'''
+    return window_size(strategy, 'BUY') is not None or window_size(strategy, 'SELL') is not None
+
+
+
+def level_index(strategy, price):
+    '''Returns the number of steps between the price and initialPrice, rounded to the nearest level.'''
+    return int(round((float(price) - float(strategy['initialPrice'])) / float(strategy['step'])))
+
+
+
+def level_price(strategy, index):
+    '''Returns the price of the level that is index steps away from initialPrice.'''
+    return round(float(strategy['initialPrice']) + float(strategy['step']) * index, PRICE_DECIMALS)
+
+
+
+def desired_levels(strategy, centerPrice=None):
+    '''
+    Calculates the level indexes that must have a live order around the central price.
+    strategy: Strategy parameters, as produced by MultiParameters.
+    centerPrice: Price of the last fill. If None, initialPrice is used.
+    return: Tuple (buyIndexes, sellIndexes), each one sorted from the nearest to the farthest level.
+    '''
+    lowest, highest = -int(strategy['buyOrders']), int(strategy['sellOrders'])
+    center = 0 if centerPrice is None else level_index(strategy, centerPrice)
+    center = min(max(center, lowest), highest)
+    buyIndexes = list(range(center - 1, lowest - 1, -1))
+    sellIndexes = list(range(center + 1, highest + 1))
+    buyWindow = window_size(strategy, 'BUY')
+    sellWindow = window_size(strategy, 'SELL')
+    if buyWindow is not None:
+        buyIndexes = buyIndexes[:buyWindow]
+    if sellWindow is not None:
+        sellIndexes = sellIndexes[:sellWindow]
+    return buyIndexes, sellIndexes
+
+
+
+def desired_prices(strategy, centerPrice=None):
+    '''Same as desired_levels() but returns the prices of the levels.'''
+    buyIndexes, sellIndexes = desired_levels(strategy, centerPrice)
+    return [level_price(strategy, i) for i in buyIndexes], [level_price(strategy, i) for i in sellIndexes]
@@ -0,0 +1,96 @@
+
+'''
+Logging del Bot
+
+Prepara el logger "grid" para que no bloquee el bucle de eventos: los mensajes se ponen en una
+cola con QueueHandler y un QueueListener, en su propio hilo, los escribe en el fichero rotativo
+y en la consola. La consola es la única salida por pantalla del bot y muestra los mensajes a
+partir del nivel de verbosidad configurado.
+Opcionalmente el fichero se escribe en formato JSON lines, con los campos adicionales que se
+pasan en "extra" como strategyId, orderRef o latency.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+import copy
+import json
+import logging
+import queue
+import regex
+import sys
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(module)s:%(funcName)s:%(lineno)04d - %(message)s'
+CONSOLE_FORMAT = '%(asctime)s %(message)s'
+CONSOLE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+EXTRA_FIELDS = ['strategyId', 'orderRef', 'contractId', 'side', 'price', 'latency']
+
+
+class JsonLinesFormatter(logging.Formatter):
+    '''Formats each record as one JSON object per line.'''
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + '.{:03d}'.format(int(record.msecs)),
+            "level": record.levelname,
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+            "message": record.getMessage()
+        }
+        for field in EXTRA_FIELDS:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+
+class GridQueueHandler(QueueHandler):
+    '''
+    QueueHandler that keeps the traceback apart from the message,
+    so that each formatter of the listener can place it as it needs.
+    '''
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+
+def create_logger(name, fileName, filesCount, debugMode, jsonLines=False, consoleLevel='INFO'):
+    '''
+    Prepares the logger to write in file and console from a background thread.
+    name: Name of the logger.
+    fileName: Path of the log file. It is rotated at midnight.
+    filesCount: Number of rotated files that are kept.
+    debugMode: True to write DEBUG messages in the file.
+    jsonLines: True to write the file in JSON lines format.
+    consoleLevel: Minimum level of the messages shown in console. None to disable the console.
+    return: Tuple (log, listener). The listener must be stopped when the bot ends.
+    '''
+    fileHandler = TimedRotatingFileHandler(fileName, when="midnight", backupCount=filesCount)
+    fileHandler.setLevel(logging.DEBUG if debugMode else logging.INFO)
+    fileHandler.setFormatter(JsonLinesFormatter() if jsonLines else logging.Formatter(LOG_FORMAT))
+    fileHandler.suffix = "%Y%m%d"       # Este es el sufijo del nombre de ficehro.
+    fileHandler.extMatch = regex.compile(r"^\d{8}$")
+    handlers = [fileHandler]
+    if consoleLevel is not None:
+        consoleHandler = logging.StreamHandler(sys.stdout)
+        consoleHandler.setLevel(consoleLevel)
+        consoleHandler.setFormatter(logging.Formatter(CONSOLE_FORMAT, CONSOLE_DATE_FORMAT))
+        handlers.append(consoleHandler)
+    messages = queue.SimpleQueue()
+    listener = QueueListener(messages, *handlers, respect_handler_level=True)
+    listener.start()
+    log = logging.getLogger(name)
+    logging.root.setLevel(logging.NOTSET)
+    log.addHandler(GridQueueHandler(messages))
+    return log, listener
@@ -0,0 +1,201 @@
+
+'''
+Barrido de Parámetros del Grid
+
+Evalúa con el backtester todas las combinaciones de step, buyOrders, sellOrders y orderQty
+(u otros parámetros de la estrategia) usando todos los núcleos con ProcessPoolExecutor.
+Las barras de precios se copian una sola vez a un bloque de memoria compartida y cada proceso
+las lee desde ahí, en lugar de enviarlas serializadas con cada tarea.
+
+Los resultados se ordenan por la métrica elegida y se escriben en dos ficheros:
+ - Una tabla CSV con una fila por combinación: posición, parámetros y métricas.
+ - Un fichero TSV con las mejores combinaciones como tablas de dos columnas (nombre, valor),
+   empezando por strategyId, que se pueden pegar directamente en la hoja de estrategias
+   que lee MultiParameters.
+
+Uso:
+    python grid_sweep.py bars.csv strategy.json --step 0.25 0.5 1 --buyOrders 10 20 --sellOrders 10 20 --orderQty 1 2
+
+El CSV de barras debe tener las columnas open, high, low y close (o solo price para ticks) y
+strategy.json los parámetros base de la estrategia, con los mismos nombres que en la hoja.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from grid_backtester import GridBacktester, risk_limits
+import argparse
+import csv
+import itertools
+import json
+import logging
+import numpy as np
+import os
+
+SUMMARY_FIELDS = ['fills', 'buys', 'sells', 'realizedPnl', 'equity', 'finalInventory', 'maxInventory', 'peakExposure', 'rejectedLevels']
+# Parametros de la hoja que no se escriben porque los calcula el bot.
+DERIVED_FIELDS = ['beginRow', 'contract', 'contractId', 'market', 'action', 'lastFillPrice', 'lastFillTime', 'dormantUntil']
+
+_worker = {}        # Estado de cada proceso del pool: barras compartidas, estrategia base y backtester.
+
+
+def _init_worker(memoryName, shape, baseStrategy, limits, commission):
+    memory = shared_memory.SharedMemory(name=memoryName)
+    _worker['memory'] = memory      # Se mantiene la referencia para que el bloque siga mapeado.
+    _worker['bars'] = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+    _worker['strategy'] = baseStrategy
+    _worker['backtester'] = GridBacktester(limits, commission)
+
+
+
+def _evaluate(parameters):
+    strategy = dict(_worker['strategy'])
+    strategy.update(parameters)
+    bars = _worker['bars']
+    result = _worker['backtester'].run(strategy, {'open': bars[0], 'high': bars[1], 'low': bars[2], 'close': bars[3]})
+    return parameters, {name: result[name] for name in SUMMARY_FIELDS}
+
+
+
+class GridSweep:
+
+    def __init__(self, bars, baseStrategy, limits=None, commission=0.0, workers=None):
+        '''
+        bars: Dictionary with the arrays "open", "high", "low" and "close", or an array of tick prices.
+        baseStrategy: Strategy parameters, as produced by MultiParameters. The swept parameters replace its values.
+        limits: Risk limits with the structure of RiskManager.max. If None, the limits of RiskManager are used.
+        commission: Commission paid on each fill.
+        workers: Number of processes. If None, one per CPU core.
+        '''
+        if isinstance(bars, dict) or hasattr(bars, 'columns'):
+            self.bars = np.vstack([np.asarray(bars[name], dtype=np.float64) for name in ('open', 'high', 'low', 'close')])
+        else:
+            prices = np.asarray(bars, dtype=np.float64)
+            self.bars = np.vstack([prices, prices, prices, prices])
+        self.baseStrategy = {key: value for key, value in baseStrategy.items() if key not in DERIVED_FIELDS}
+        self.limits = limits if limits is not None else risk_limits()
+        self.commission = commission
+        self.workers = workers or os.cpu_count()
+        self.log = logging.getLogger('grid')
+
+
+
+    def run(self, grid, rankBy='realizedPnl'):
+        '''
+        Evaluates all the combinations of the grid of parameters.
+        grid: Dictionary parameter: list of values, e.g. {"step": [0.5, 1], "buyOrders": [10, 20]}.
+        rankBy: Metric used to sort the results, from the highest to the lowest.
+        return: List of rows {"rank", "parameters", "metrics"} sorted by rankBy.
+        '''
+        names = list(grid.keys())
+        combinations = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+        memory = shared_memory.SharedMemory(create=True, size=self.bars.nbytes)
+        try:
+            np.ndarray(self.bars.shape, dtype=np.float64, buffer=memory.buf)[:] = self.bars
+            with ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker,
+                initargs=(memory.name, self.bars.shape, self.baseStrategy, self.limits, self.commission)
+            ) as executor:
+                chunkSize = max(1, len(combinations) // (self.workers * 4))
+                results = list(executor.map(_evaluate, combinations, chunksize=chunkSize))
+        finally:
+            memory.close()
+            memory.unlink()
+        results.sort(key=lambda item: item[1][rankBy], reverse=True)
+        self.log.info(f'Sweep of {len(combinations)} combinations finished with {self.workers} processes.')
+        return [{"rank": rank, "parameters": parameters, "metrics": metrics} for rank, (parameters, metrics) in enumerate(results, start=1)]
+
+
+
+    def write_results(self, rows, fileName):
+        '''Writes the ranked table: one row per combination with its parameters and metrics.'''
+        if len(rows) == 0:
+            return
+        names = list(rows[0]['parameters'].keys())
+        with open(fileName, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['rank'] + names + SUMMARY_FIELDS)
+            for row in rows:
+                writer.writerow([row['rank']] + [row['parameters'][name] for name in names] + [row['metrics'][name] for name in SUMMARY_FIELDS])
+
+
+
+    def write_sheet_tables(self, rows, fileName, top=10, firstStrategyId=None):
+        '''
+        Writes the best combinations as two-column tables (name, value) separated by tabs,
+        ready to be pasted in the strategies sheet. Each table starts with strategyId.
+        top: Number of combinations written.
+        firstStrategyId: Identifier of the first table. The next ones are consecutive. By default the base strategyId.
+        '''
+        from google_sheets_interface import GoogleSheetsInterface     # Solo se necesita para dar formato a los numeros.
+        strategyId = int(firstStrategyId if firstStrategyId is not None else self.baseStrategy['strategyId'])
+        with open(fileName, 'w', newline='') as file:
+            writer = csv.writer(file, delimiter='\t')
+            for row in rows[:top]:
+                strategy = dict(self.baseStrategy)
+                strategy.update(row['parameters'])
+                strategy['strategyId'] = strategyId
+                writer.writerow(['strategyId', strategyId])
+                for name, value in strategy.items():
+                    if name != 'strategyId':
+                        writer.writerow([name, _sheet_value(name, value, GoogleSheetsInterface.float_to_string)])
+                writer.writerow([])
+                strategyId += 1
+
+
+
+def _sheet_value(name, value, floatToString):
+    '''
+    Formats a value as the strategies sheet writes it: decimal comma in the floats, SI/NO in active and
+    TRUE/FALSE in the other booleans.
+    '''
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        if name == 'active':
+            return 'SI' if value else 'NO'
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (float, np.floating)):
+        return str(int(value)) if float(value).is_integer() else floatToString(float(value))
+    return value
+
+
+
+def load_bars(fileName):
+    '''Reads a CSV with the columns open, high, low and close, or a single column price, or a file of BarCache.'''
+    if fileName.endswith('.bars'):
+        from bar_cache import BarCache      # Importa ib_insync, por eso solo se carga para estos ficheros.
+        return BarCache.columns(BarCache.read_file(fileName))
+    data = np.genfromtxt(fileName, delimiter=',', names=True)
+    if 'price' in data.dtype.names:
+        return data['price']
+    return {name: data[name] for name in ('open', 'high', 'low', 'close')}
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweeps the grid parameters of a strategy over historical bars.')
+    parser.add_argument('bars', help='CSV with the columns open, high, low, close (or price), or a .bars file of the bar cache.')
+    parser.add_argument('strategy', help='JSON with the base parameters of the strategy.')
+    parser.add_argument('--step', type=float, nargs='+')
+    parser.add_argument('--buyOrders', type=int, nargs='+')
+    parser.add_argument('--sellOrders', type=int, nargs='+')
+    parser.add_argument('--orderQty', type=int, nargs='+')
+    parser.add_argument('--rankBy', default='realizedPnl', choices=SUMMARY_FIELDS)
+    parser.add_argument('--commission', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--output', default='sweep', help='Prefix of the output files.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    with open(args.strategy, 'r') as file:
+        baseStrategy = json.load(file)
+    grid = {name: getattr(args, name) for name in ('step', 'buyOrders', 'sellOrders', 'orderQty') if getattr(args, name)}
+    sweep = GridSweep(load_bars(args.bars), baseStrategy, commission=args.commission, workers=args.workers)
+    rows = sweep.run(grid, args.rankBy)
+    sweep.write_results(rows, f'{args.output}_results.csv')
+    sweep.write_sheet_tables(rows, f'{args.output}_sheet.tsv', args.top)
+    for row in rows[:args.top]:
+        print(row['rank'], row['parameters'], {name: round(row['metrics'][name], 2) for name in ('realizedPnl', 'fills', 'peakExposure')})
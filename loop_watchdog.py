@@ -0,0 +1,163 @@
+
+'''
+Vigilante del Bucle de Eventos
+
+Core ejecuta todo sobre el único bucle asyncio de ib_insync, por lo que cualquier llamada
+bloqueante (time.sleep, lecturas de Google Sheets, Telegram, ficheros) lo congela sin dejar rastro.
+Esta clase mide continuamente el retraso del bucle con un latido y, desde un hilo auxiliar,
+captura la pila del hilo del bucle cuando el retraso supera un umbral. Guarda en el log la pila
+y el nombre de la tarea que se estaba ejecutando, y mantiene un ranking de los sitios que
+más congelan el bucle.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import metrics
+
+PROJECT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopWatchdog:
+
+    def __init__(self, thresholdSeconds=0.5, intervalSeconds=0.1, topSize=10, reportSeconds=3600):
+        '''
+        thresholdSeconds: Delay of the loop from which a stall is reported.
+        intervalSeconds: Period of the loop heartbeat and of the helper thread checks.
+        topSize: Number of stall sites that are reported in the ranking.
+        reportSeconds: Period to write the ranking of stall sites in the log.
+        '''
+        self.thresholdSeconds = thresholdSeconds
+        self.intervalSeconds = intervalSeconds
+        self.topSize = topSize
+        self.reportSeconds = reportSeconds
+        self.loop = None
+        self.loopThreadId = None
+        self.lastBeat = time.monotonic()
+        self.currentStall = None
+        self.sites = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.log = logging.getLogger('grid')
+
+
+
+    def start(self, loop=None):
+        '''Starts the heartbeat on the loop and the helper thread. It must be called from the loop thread.'''
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.loopThreadId = threading.get_ident()
+        self.running = True
+        self.lastBeat = time.monotonic()
+        self.loop.call_soon(self._beat)
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+
+
+
+    def stop(self):
+        self.running = False
+
+
+
+    def top_sites(self):
+        '''Returns the stall sites sorted by accumulated stall time.'''
+        with self.lock:
+            items = [dict(site=site, **data) for site, data in self.sites.items()]
+        items.sort(key=lambda x: x['totalSeconds'], reverse=True)
+        return items[:self.topSize]
+
+
+
+    def report(self):
+        '''Writes in the log the ranking of stall sites.'''
+        lines = [
+            '   {} stalls, total {}s, max {}s, task {}: {}'.format(
+                item['count'], round(item['totalSeconds'], 2), round(item['maxSeconds'], 2), item['task'], item['site']
+            )
+            for item in self.top_sites()
+        ]
+        if len(lines) > 0:
+            self.log.warning('Event loop stall sites:\n' + '\n'.join(lines))
+
+
+
+    def _beat(self):
+        self.lastBeat = time.monotonic()
+        if self.running:
+            self.loop.call_later(self.intervalSeconds, self._beat)
+
+
+
+    def _watch(self):
+        lastReport = time.monotonic()
+        while self.running:
+            time.sleep(self.intervalSeconds)
+            try:
+                lag = time.monotonic() - self.lastBeat - self.intervalSeconds
+                if lag > self.thresholdSeconds:
+                    if self.currentStall is None:
+                        self.currentStall = self._sample()
+                        self.log.warning('Event loop stalled for more than {}s at {} (task {}). Stack:\n{}'.format(
+                            self.thresholdSeconds, self.currentStall['site'], self.currentStall['task'], self.currentStall['stack']
+                        ))
+                    self.currentStall['seconds'] = lag
+                elif self.currentStall is not None:
+                    self._record(self.currentStall)
+                    self.currentStall = None
+                if time.monotonic() - lastReport > self.reportSeconds:
+                    lastReport = time.monotonic()
+                    self.report()
+            except Exception as e:
+                self.log.exception(f'Error in the event loop watchdog: {str(e)}')
+
+
+
+    def _sample(self):
+        '''Captures the stack of the loop thread and finds the site that is blocking it.'''
+        frame = sys._current_frames().get(self.loopThreadId)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+        site = None
+        innermost = None
+        entryPoint = None     # Función del proyecto más externa, es la que fue programada en el bucle.
+        while frame is not None:
+            location = '{}:{} {}'.format(os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name)
+            if innermost is None:
+                innermost = location
+            if os.path.abspath(frame.f_code.co_filename).startswith(PROJECT_FOLDER) and frame.f_code.co_filename != __file__:
+                if site is None:
+                    site = location
+                entryPoint = frame.f_code.co_name
+            frame = frame.f_back
+        if site is None:
+            site = innermost if innermost is not None else '<unknown>'
+        return {"site": site, "task": self._current_task_name(entryPoint), "stack": stack, "seconds": 0}
+
+
+
+    def _current_task_name(self, entryPoint):
+        '''Returns the name of the asyncio task running on the loop, or the name of the scheduled callback.'''
+        try:
+            task = asyncio.tasks._current_tasks.get(self.loop)
+            if task is not None:
+                return task.get_name()
+        except Exception:
+            pass
+        return entryPoint if entryPoint is not None else 'callback'
+
+
+
+    def _record(self, stall):
+        with self.lock:
+            data = self.sites.setdefault(stall['site'], {"task": stall['task'], "count": 0, "totalSeconds": 0.0, "maxSeconds": 0.0})
+            data['count'] += 1
+            data['totalSeconds'] += stall['seconds']
+            data['maxSeconds'] = max(data['maxSeconds'], stall['seconds'])
+        metrics.LOOP_STALLS.increment()
+        metrics.LOOP_STALL_SECONDS.observe(stall['seconds'])
+        self.log.warning('Event loop stall of {}s at {} (task {})'.format(round(stall['seconds'], 3), stall['site'], stall['task']))
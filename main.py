@@ -3,9 +3,13 @@ from ib_insync import *
 from datetime import datetime
 
 from core import Core
+from metrics import MetricsServer
+from loop_watchdog import LoopWatchdog
+from grid_logging import create_logger
+from console_view import ConsoleStatusView
+from shard_supervisor import ShardSupervisor, worker_index, worker_configuration
 import logging
-from logging.handlers import TimedRotatingFileHandler
-import regex 
+import sys
 import time
 import json
 
@@ -14,6 +18,8 @@ CONFIGURATION = {
     'client_tws': 19,
     'tws_ip':"127.0.0.1",
     'tws_port': 7498,
+    'api_messages_per_second': 45,      # Limite de mensajes por segundo hacia el API de esta conexion.
+    'api_messages_burst': 10,           # Cantidad maxima de mensajes que se pueden enviar de golpe.
     'reconnection_seconds': 100,        # Tiempo para reintentar reconectar con el API.
     'actualize_status_seconds': 5,      # Actualizacion de la configuracion del google sheets.
     'max_conection_loss_seconds': 15,   # Tiempo maximo que se puede estar sin coneccion para no reiniciar la estrategia.
@@ -31,8 +37,57 @@ CONFIGURATION = {
     'botTimeZone': 'Europe/Berlin',
     'strategy_confirmation_max_age_seconds': 60,
     'relaunch_if_market_closed': False,
+    'dormancy_enabled': True,           # Las estrategias de mercados cerrados no actualizan contrato ni precio.
+    'dormancy_wake_seconds': 300,       # Segundos antes de la apertura en que se despiertan las estrategias.
+    'reconcile_on_restart': True,       # Al reiniciar solo se cancela, modifica o pone la diferencia con el grid deseado.
 
     'marquet_data_delayed_but_free': True,  #To obtain free market data, although delayed in time
+    'bar_cache_folder': './bars',           # Barras historicas guardadas en disco. Vacio para pedirlas siempre a TWS.
+    'bar_cache_bar_size': '1 min',
+    'bar_cache_what_to_show': 'TRADES',
+    'bar_cache_initial_days': 2,            # Dias que se piden de un contrato sin barras guardadas.
+
+    'snapshot_file': './state/snapshot.pickle',   # Estado local para arrancar en caliente.
+    'snapshot_seconds': 60,                       # Cada cuanto tiempo se guarda el estado.
+    'snapshot_max_age_seconds': 86400,            # Las instantaneas mas viejas se ignoran.
+
+    'stall_threshold_seconds': 0.5,     # Retraso del bucle de eventos a partir del cual se guarda la pila en el log.
+    'stall_report_seconds': 3600,       # Cada cuanto tiempo se guarda en el log el ranking de bloqueos.
+
+    'profile_targets': ['set_actualize_bot_status', 'onExecDetailsEvent', 'set_refresh_dashboard'],  # Callbacks que se pueden perfilar.
+    'profile_trigger_file': 'profile.json',   # Al crear este fichero se perfilan los proximos ciclos.
+    'profile_folder': './profiles',
+    'profile_on_start_cycles': 0,             # Cantidad de ciclos a perfilar desde el arranque.
+
+    'journal_file': './state/journal.bin',     # Diario de eventos del broker para reproducir incidentes. Vacio para desactivarlo.
+    'journal_max_megabytes': 512,              # Al superar este tamaño el diario se renombra a ".1" y se empieza otro.
+    'trade_archive_file': './state/trades_archive.bin',  # Ordenes terminadas y ejecuciones que se quitan de la memoria. Vacio para guardarlas siempre en memoria.
+    'trade_retention_seconds': 86400,          # Las ordenes terminadas y ejecuciones mas viejas se archivan.
+    'trade_retention_max_completed': 5000,     # Maximo de ordenes terminadas en memoria. Se archivan primero las mas viejas.
+    'trade_retention_check_seconds': 300,      # Cada cuanto tiempo se archivan.
+
+    'tick_recorder_folder': '',             # Carpeta donde se graban los ticks de los contratos operados, p.ej. './ticks'. Vacio para desactivarlo.
+    'tick_recorder_flush_seconds': 1,       # Tiempo maximo que los ticks esperan en memoria antes de escribirse.
+
+    'status_file': './state/status.bin',   # Bloque de estado en memoria compartida para supervisores externos. Vacio para desactivarlo.
+    'heartbeat_file': 'heartbeat.txt',     # Fichero con la hora del ultimo ciclo de estado.
+    'log_file': './logs/grid_multiple.log',
+
+    'workers': 1,                       # Procesos que se reparten las estrategias. Con mas de 1 este proceso solo los supervisa.
+    'shard_column': '',                 # Parametro de la hoja con el worker de cada estrategia. Vacio para repartir por strategyId.
+    'worker_restart_seconds': 10,       # Espera antes de volver a arrancar un worker que termino.
+    'supervisor_status_file': './state/status_combined.json',   # Estado combinado de todos los workers.
+    'risk_ledger_address': '',          # Socket del libro de riesgo compartido entre instancias, p.ej. './state/risk_ledger.sock'. Vacio para desactivarlo (con workers > 1 se usa el de por defecto).
+    'risk_ledger_authkey': '',          # Clave compartida del libro de riesgo. Vacio: la variable GRID_RISK_LEDGER_AUTHKEY o, con workers > 1, una al azar.
+    'risk_ledger_reservation_seconds': 60,  # Las reservas de riesgo que no se confirman caducan en este tiempo.
+
+    'metrics_host': '127.0.0.1',       # Direccion del servidor de metricas (Prometheus y /health).
+    'metrics_port': 9108,               # Puerto del servidor de metricas. Poner 0 para desactivarlo.
+
+    'console_mode': 'log',              # 'log' muestra los mensajes en consola, 'table' una tabla de estado y los mensajes solo van al log.
+    'console_level': 'INFO',            # Nivel minimo de los mensajes que se muestran en consola (DEBUG, INFO, WARNING...).
+    'console_frames_per_second': 1,     # Frecuencia de redibujado de la tabla de estado.
+    'log_json_lines': False,            # Poner en True para guardar el log en formato JSON lines.
 
     "verbose_order_params": False,
     "verbose_risk_data": False,
@@ -40,21 +95,6 @@ CONFIGURATION = {
 
     
 
-def create_logger(name, fileName, filesCount, debugMode):
-    '''Prepara la configuracion del logging para guardar mensajes en fichero.'''
-    LOG_FORMAT = '%(asctime)s %(levelname)s %(module)s:%(funcName)s:%(lineno)04d - %(message)s'
-    handler = TimedRotatingFileHandler(fileName, when="midnight", backupCount=filesCount) 
-    handler.setLevel(logging.DEBUG if debugMode else logging.INFO)
-    formatter = logging.Formatter(LOG_FORMAT)
-    handler.setFormatter(formatter)
-    handler.suffix = "%Y%m%d"       # Este es el sufijo del nombre de ficehro.
-    handler.extMatch = regex.compile(r"^\d{8}$")   
-    log = logging.getLogger(name)
-    logging.root.setLevel(logging.NOTSET)
-    log.addHandler(handler)
-    return log
-
-
 def _connect_to_broker():
     ''' Intenta conectarse al broker y solo sale de la funcion cuando se logra. '''
     global log
@@ -63,9 +103,8 @@ def _connect_to_broker():
     core.disconnect()
     currentReconnect = 1
     while True:
-        print('Trying to connect...')
         log.info('Trying to connect...')
-        conection_loss_seconds = time.time() - core.lastConnectionTime
+        conection_loss_seconds = core.clock.time() - core.lastConnectionTime
         try:
             core.connect(
                 configurationBase['tws_ip'], 
@@ -75,25 +114,22 @@ def _connect_to_broker():
             )
         except Exception as e:
             text = f'Unabled to connect on attempt {currentReconnect}. Next attempt at {configurationBase["reconnection_seconds"]} seconds.'
-            print(text)
             log.exception(f"{text} Exception: {str(e)}")
             currentReconnect += 1
-            core.sleep(configurationBase['reconnection_seconds'])        
+            core.clock.sleep(configurationBase['reconnection_seconds'])        
             continue
         try:
             text = 'CONNECTED! Has been able to connect.'
-            print('{} {}'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), text))
             log.info(text)
-            core.lastConnectionTime = time.time()
+            core.lastConnectionTime = core.clock.time()
             if conection_loss_seconds > configurationBase['max_conection_loss_seconds']:  
                 core.reset_strategies(core.lastDateTimeConnection, True)
             break
         except Exception as e:            
             text = f'Error after connecting on attempt {currentReconnect}. Next attempt at {configurationBase["reconnection_seconds"]} seconds.'
-            print(text)
             log.exception(f"{text} Exception: {str(e)}")
             currentReconnect += 1
-            core.sleep(configurationBase['reconnection_seconds'])        
+            core.clock.sleep(configurationBase['reconnection_seconds'])        
             continue
     
 
@@ -101,9 +137,8 @@ def _onDisconnected():
     global log
     '''Si se desconecta el Grid Bot Multiple, lo informa y vuelve a intentar la conexion.'''
     text = 'DISCONNECTED! Connection has been lost...'
-    print('{} {}'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), text))
     log.critical(text)
-    core.sleep(configurationBase['reconnection_seconds'])
+    core.clock.sleep(configurationBase['reconnection_seconds'])
     _connect_to_broker()       # Intenta reconectar.
 
     
@@ -116,46 +151,101 @@ def _onMessageCode(reqId, errorCode, errorString, contract):
         log.warning('code {}: {}'.format(errorCode, errorString))
     else:
         log.error('code {}: {}'.format(errorCode, errorString))
+        if core.statusSegment is not None:
+            core.statusSegment.set_error(int(errorCode))
 
 
 def update_configuration(configFilePath):
-    ''' Loads a configuration file given in the parameter config_file_path'''
-    global log
+    '''
+    Loads a configuration file given in the parameter config_file_path
+    It is called before creating the logger, so it returns the message that must be logged.
+    '''
     global configurationBase
     try:
         with open(configFilePath, 'r') as file:
             configData = json.load(file)
         configurationBase.update(configData)    # Merge the loaded JSON with the existing global configuration
-        text = f'Global configuration updated successfully from: "{configFilePath}"'
-        print(text)
-        log.error(text)
+        return f'Global configuration updated successfully from: "{configFilePath}"'
     except FileNotFoundError:
-        text = f'The configuration file does not exist: {configFilePath}'
-        print(text)   
-        log.error(text)         
+        return f'The configuration file does not exist: {configFilePath}'
     except Exception as e:
-        text = f'Error updating configuration file: {e}'
-        print(text)   
-        log.error(text) 
+        return f'Error updating configuration file: {e}'
 
 
 # Crea el objeto Grid Bot Multiple que ejecuta multiples estrategias a la vez.
 configurationBase = CONFIGURATION
-log = create_logger('grid', './logs/grid_multiple.log', 7, configurationBase['debug_mode'])
-print('{} INITIATED! Grid Bot Multiple has been created'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+configurationText = update_configuration("config.json") 
+workerIndex = worker_index(sys.argv)
+if workerIndex is not None:
+    configurationBase = worker_configuration(configurationBase, workerIndex)
+log, logListener = create_logger(
+    'grid', configurationBase['log_file'], 7, configurationBase['debug_mode'], 
+    jsonLines=configurationBase['log_json_lines'], 
+    consoleLevel=None if configurationBase['console_mode'] == 'table' else configurationBase['console_level']
+)
 log.info('INITIATED! Grid Bot Multiple has been created')
-update_configuration("config.json") 
+log.error(configurationText)
+if workerIndex is None and configurationBase['workers'] > 1:
+    # Modo supervisor: las estrategias las ejecutan los workers, cada uno con su conexion.
+    ShardSupervisor(configurationBase, __file__).run()
+    logListener.stop()
+    sys.exit(0)
+if workerIndex is not None:
+    log.info(f'Worker {workerIndex} of {configurationBase["shard_count"]} with clientId {configurationBase["client_tws"]}')
 core = Core(configurationBase)        
 util.patchAsyncio()
+core.profiler.install_signal()
+if configurationBase['profile_on_start_cycles'] > 0:
+    core.profiler.arm(cycles=configurationBase['profile_on_start_cycles'])
+if configurationBase.get('metrics_port'):
+    metricsServer = MetricsServer(configurationBase['metrics_host'], configurationBase['metrics_port'], core.health)
+    metricsServer.start()
+startupPhases = []
+timeBegin = time.time()
 _connect_to_broker()
+startupPhases.append(('connect', time.time() - timeBegin))
 lastDateTimeBeat = core.read_heart_beat(True)
-core.load_strategies_list()
+timeBegin = time.time()
+if core.load_snapshot():
+    startupPhases.append(('snapshot', time.time() - timeBegin))
+else:
+    core.load_strategies_list()
+    startupPhases.append(('strategies', time.time() - timeBegin))
+timeBegin = time.time()
 core.reset_strategies(lastDateTimeBeat, False)  
+startupPhases.append(('reset', time.time() - timeBegin))
+text = 'Startup phases: ' + ', '.join(f'{name} {round(seconds, 2)}s' for name, seconds in startupPhases)
+log.info(text)
 core.disconnectedEvent += _onDisconnected
 core.errorEvent += _onMessageCode
 core.execDetailsEvent += core.onExecDetailsEvent
 core.set_refresh_dashboard()
-core.set_actualize_bot_status()
-core.run() 
+core.set_actualize_bot_status()     # El primer ciclo contrasta las estrategias con la hoja de Google Sheets.
+core.set_save_snapshot()
+core.set_prune_trades()
+core.set_measure_loop_lag()
+loopWatchdog = LoopWatchdog(configurationBase['stall_threshold_seconds'], reportSeconds=configurationBase['stall_report_seconds'])
+loopWatchdog.start()
+consoleView = None
+if configurationBase['console_mode'] == 'table':
+    consoleView = ConsoleStatusView(core, configurationBase['console_frames_per_second'])
+    consoleView.start()
+try:
+    core.run() 
+finally:
+    if consoleView is not None:
+        consoleView.stop()
+    loopWatchdog.stop()
+    loopWatchdog.report()
+    core.save_snapshot()
+    if core.statusSegment is not None:
+        core.statusSegment.close()
+    if core.journal is not None:
+        core.journal.close()
+    if core.tickRecorder is not None:
+        core.tickRecorder.close()
+    if core.tradeArchive is not None:
+        core.tradeArchive.close()
+    logListener.stop()
 
 
@@ -0,0 +1,269 @@
+
+'''
+Métricas
+
+Contadores, indicadores (gauges) e histogramas de latencia de los puntos críticos del bot.
+Se publican en formato de texto de Prometheus mediante un pequeño servidor HTTP local que
+corre en su propio hilo, de manera que consultarlos no afecta al bucle de eventos de Core.
+Rutas:
+ - /metrics: Todas las métricas en formato Prometheus.
+ - /health: Estado de la conexión y edad del último ciclo de estado completado.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import ctypes
+import json
+import logging
+import os
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metric:
+
+    def __init__(self, name, description, kind):
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.lock = threading.Lock()
+        self.values = {}
+
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+
+class Counter(Metric):
+
+    def __init__(self, name, description):
+        Metric.__init__(self, name, description, 'counter')
+
+
+    def increment(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+    def total(self):
+        '''Returns the sum of the counter over all its labels.'''
+        with self.lock:
+            return sum(self.values.values())
+
+
+
+class Gauge(Metric):
+
+    def __init__(self, name, description):
+        Metric.__init__(self, name, description, 'gauge')
+
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = value
+
+
+
+class Histogram(Metric):
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, description, 'histogram')
+        self.buckets = tuple(buckets)
+
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            item = self.values.get(key)
+            if item is None:
+                item = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    item["counts"][index] += 1
+                    break
+            item["sum"] += seconds
+            item["count"] += 1
+
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for labels, item in sorted(self.values.items()):
+                accumulated = 0
+                for bound, count in zip(self.buckets, item["counts"]):
+                    accumulated += count
+                    lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", _format_value(bound)),))} {accumulated}')
+                lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {item["count"]}')
+                lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(item["sum"])}')
+                lines.append(f'{self.name}_count{_format_labels(labels)} {item["count"]}')
+        return lines
+
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = []
+
+
+    def counter(self, name, description):
+        return self._register(Counter(name, description))
+
+
+    def gauge(self, name, description):
+        return self._register(Gauge(name, description))
+
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, description, buckets))
+
+
+    def render(self):
+        '''Returns all the metrics in Prometheus text format.'''
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+
+
+REGISTRY = MetricsRegistry()
+
+RISK_CHECK_SECONDS = REGISTRY.histogram('grid_risk_check_seconds', 'Time spent validating an order with RiskManager.can_operate.')
+ORDERS_REJECTED = REGISTRY.counter('grid_orders_rejected_total', 'Orders rejected by the risk manager.')
+ORDERS_POSTED = REGISTRY.counter('grid_orders_posted_total', 'Orders sent or queued to the broker.')
+ORDERS_AMENDED = REGISTRY.counter('grid_orders_amended_total', 'Live orders modified in place with the same orderId.')
+GRID_POST_SECONDS = REGISTRY.histogram('grid_post_seconds', 'Time spent posting the orders of a grid.')
+FILL_TO_REACTION_SECONDS = REGISTRY.histogram('grid_fill_to_reaction_seconds', 'Time from the fill event to the reaction order being sent.')
+FILLS = REGISTRY.counter('grid_fills_total', 'Completely filled orders.')
+SHEETS_SECONDS = REGISTRY.histogram('grid_sheets_seconds', 'Latency of the Google Sheets operations.')
+TWS_REQUEST_SECONDS = REGISTRY.histogram('grid_tws_request_seconds', 'Latency of the blocking requests to TWS.')
+STATUS_CYCLE_SECONDS = REGISTRY.histogram('grid_status_cycle_seconds', 'Duration of the status cycle.')
+LOOP_LAG_SECONDS = REGISTRY.gauge('grid_event_loop_lag_seconds', 'Delay of the last event loop probe.')
+LOOP_STALLS = REGISTRY.counter('grid_event_loop_stalls_total', 'Event loop stalls longer than the watchdog threshold.')
+LOOP_STALL_SECONDS = REGISTRY.histogram('grid_event_loop_stall_seconds', 'Duration of the event loop stalls.')
+OPEN_ORDERS = REGISTRY.gauge('grid_open_orders', 'Open orders of this client.')
+QUEUE_SIZE = REGISTRY.gauge('grid_queue_size', 'Size of the internal queues.')
+DORMANT_STRATEGIES = REGISTRY.gauge('grid_dormant_strategies', 'Strategies sleeping because their market is closed.')
+CONNECTED = REGISTRY.gauge('grid_connected', '1 if the connection with TWS is established.')
+RESIDENT_MEMORY = REGISTRY.gauge('grid_resident_memory_bytes', 'Resident memory (RSS) of the process.')
+IN_MEMORY = REGISTRY.gauge('grid_in_memory', 'Orders and fills kept in memory by ib_insync.')
+ARCHIVED = REGISTRY.counter('grid_archived_total', 'Finished orders and fills moved from memory to the archive.')
+
+
+
+class MetricsServer:
+
+    def __init__(self, host, port, healthFunction=None, registry=REGISTRY):
+        '''
+        Local HTTP server that publishes the metrics.
+        host: Address where the server listens. Use 127.0.0.1 to publish only locally.
+        port: Port where the server listens.
+        healthFunction: Function that returns a tuple (healthy, data) for the /health route.
+        '''
+        self.host = host
+        self.port = port
+        self.healthFunction = healthFunction
+        self.registry = registry
+        self.server = None
+        self.log = logging.getLogger('grid')
+
+
+    def start(self):
+        '''Starts the server in a daemon thread. Returns True if it could be started.'''
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                try:
+                    if self.path.startswith('/metrics'):
+                        self._answer(200, 'text/plain; version=0.0.4', owner.registry.render())
+                    elif self.path.startswith('/health'):
+                        healthy, data = owner.healthFunction() if owner.healthFunction is not None else (True, {})
+                        self._answer(200 if healthy else 503, 'application/json', json.dumps(data))
+                    else:
+                        self._answer(404, 'text/plain', 'Not found\n')
+                except Exception as e:
+                    owner.log.exception(f'Error answering {self.path}: {str(e)}')
+                    self._answer(500, 'text/plain', 'Error\n')
+
+            def _answer(self, code, contentType, text):
+                body = text.encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', contentType)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass    # Las consultas no se guardan en el log.
+
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True).start()
+            self.log.info(f'Metrics server listening on http://{self.host}:{self.port}/metrics')
+            return True
+        except Exception as e:
+            self.log.exception(f'Unable to start the metrics server on port {self.port}: {str(e)}')
+            return False
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+
+
+def resident_memory_bytes():
+    '''Returns the resident memory of the process in bytes, or None if it can not be measured.'''
+    try:
+        if os.name == 'nt':
+            class ProcessMemoryCounters(ctypes.Structure):
+                _fields_ = [
+                    ('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong), ('PeakWorkingSetSize', ctypes.c_size_t),
+                    ('WorkingSetSize', ctypes.c_size_t), ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPagedPoolUsage', ctypes.c_size_t), ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaNonPagedPoolUsage', ctypes.c_size_t), ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)
+                ]
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return None
+            return counters.WorkingSetSize
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return None
+
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(value)
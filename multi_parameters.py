@@ -15,18 +15,24 @@ from google_sheets_interface import GoogleSheetsInterface
 from ib_insync import *
 import logging
 import time
+import metrics
 from real_time_utils import request_historical
+from shard_supervisor import shard_of
+from bar_cache import BarCache
+from clock import RealClock
 
 
 class MultiParameters():
     
-    def __init__(self, configuration, page=None, beginColumn=1, beginRow=1, columns=2, rows=300):
+    def __init__(self, configuration, page=None, beginColumn=1, beginRow=1, columns=2, rows=300, clock=None):
         '''
         Crea un objeto para manejar los parametros de funcionamiento del bot.
         Esta clase es una abstrapción para evitar que el bot maneje directamente 
         el almacanamiento de datos, además que facilita el filtrado de los parámetros.
+        clock: Reloj de la cache de barras. Por defecto el reloj del sistema.
         '''
         self.configuration = configuration
+        self.clock = clock if clock is not None else RealClock()
         self.multiTable = GoogleSheetsInterface(
             self.configuration['google_sheets_credentials'], 
             self.configuration['google_sheets_document_id']
@@ -38,6 +44,17 @@ class MultiParameters():
         self.rows = rows
         self.strategies = []
         self.noFilteredStrategies = []
+        self.journal = None         # Diario de eventos donde se graba cada lectura de la hoja.
+        self.barCache = None        # Barras historicas guardadas en disco. Si no hay, se piden siempre a TWS.
+        self.qualifiedContracts = {}    # Campos del contrato en la hoja -> contrato calificado, para las estrategias dormidas.
+        if self.configuration.get('bar_cache_folder'):
+            self.barCache = BarCache(
+                self.configuration['bar_cache_folder'],
+                self.configuration.get('bar_cache_bar_size', '1 min'),
+                self.configuration.get('bar_cache_what_to_show', 'TRADES'),
+                self.configuration.get('bar_cache_initial_days', 2),
+                clock=self.clock
+            )
         self.log = logging.getLogger('grid')
         
 
@@ -49,19 +66,25 @@ class MultiParameters():
         self.strategies = []
 
 
-    def load(self, ib, verbose=False):
+    def load(self, ib, verbose=False, dormantIds=None):
         '''
         Carga los parámetros desde el almacenamiento y devuelve      
         True: Si se pudieron leer los parámetros desde el almacenamiento.
         False: Si ocurrieron errores durante la lectura de los parámetros. 
+        dormantIds: Identificadores de las estrategias dormidas. Para ellas no se vuelve a 
+                    consultar el contrato ni el precio, se reutilizan los datos anteriores.
         '''
+        dormantIds = dormantIds or set()
         timeBegin = time.time()
         if verbose:
-            print('\nReading strategies from the configuration...')
+            self.log.info('Reading strategies from the configuration...')
         tables = self.multiTable.read_tables(self.page, self.beginColumn, self.beginRow, self.columns, self.rows, verbose=verbose)
         if tables is not None:
-            tables = self._add_contract_parameters(ib, tables)
-            tables = self._add_prices(ib, tables)
+            tables = self._filter_shard(tables)
+            tables = self._add_contract_parameters(ib, tables, dormantIds)
+            tables = self._add_prices(ib, tables, dormantIds)
+            if self.journal is not None:
+                self.journal.record_strategies(tables)
             self.noFilteredStrategies = tables
             tables = self._process_and_filter_strategy_params(tables)
             tables = self._add_action_parameter(tables, self.strategies)
@@ -70,15 +93,28 @@ class MultiParameters():
             self.strategies = tables
             if verbose:
                 for strategy in self.strategies:
-                    print('   Strategy: {} Action: {}'.format(strategy['strategyId'], strategy['action']))
-                print('   Reading time:', round(time.time()-timeBegin, 2), 'seconds')
+                    self.log.info('   Strategy: {} Action: {}'.format(strategy['strategyId'], strategy['action']))
+                self.log.info('   Reading time: {} seconds'.format(round(time.time()-timeBegin, 2)))
         else:
             if verbose: 
-                print('Error reading strategies!')
+                self.log.error('Error reading strategies!')
 
 
-    def _add_prices(self, ib, tables):
-        '''Update instruments prices'''
+    def _filter_shard(self, tables):
+        '''
+        Keeps only the strategies of this worker when the strategies are shared between several workers.
+        The worker of each strategy is given by the column shard_column or, if it is empty, by strategyId.
+        '''
+        workers = self.configuration.get('shard_count', 1)
+        if workers <= 1:
+            return tables
+        index = self.configuration.get('shard_index', 0)
+        column = self.configuration.get('shard_column', '')
+        return [table for table in tables if shard_of(table, workers, column) == index]
+
+
+    def _add_prices(self, ib, tables, dormantIds=None):
+        '''Update instruments prices. The dormant strategies keep their previous price.'''
         if ib is None:
             temporalIb = IB()          
             temporalIb.connect("127.0.0.1", port=7497, clientId=999, timeout=5)
@@ -87,17 +123,25 @@ class MultiParameters():
         for strategy in tables:
             try:
                 strategy['market'] = None
-                if strategy['contract'] is not None:
+                previous = self._dormant_previous(strategy, dormantIds)
+                if previous is not None and previous.get('market') is not None:
+                    strategy['market'] = previous['market']
+                elif strategy['contract'] is not None and self.barCache is not None:
+                    # La cache solo consulta a TWS las barras nuevas y espera ella misma el turno de mensajes.
+                    strategy['market'] = self.barCache.market(ib if ib is not None else temporalIb, strategy['contract'], free=delayedButFree)
+                elif strategy['contract'] is not None:
                     if ib is None:
                         strategy['market'] = request_historical(temporalIb, self.log, strategy['contract'], free=delayedButFree)
                     else:
+                        ib.wait_data_slot()
+                        timeBegin = time.time()
                         strategy['market'] = request_historical(ib, self.log, strategy['contract'], free=delayedButFree) 
+                        metrics.TWS_REQUEST_SECONDS.observe(time.time() - timeBegin, request='historical')
                     if self.configuration['debug_mode']:
-                        print(f'contract: {strategy["symbol"]}({strategy["contractId"]})  price: {strategy["market"].close}')
+                        self.log.debug(f'contract: {strategy["symbol"]}({strategy["contractId"]})  price: {strategy["market"].close}')
             except Exception as e:
                 strategy['market'] = None
                 msg = f'Error obtaining price of contract: {strategy["symbol"]}({strategy["contractId"]}) Error: {str(e)}'
-                print(msg)
                 self.log.exception(msg)
             result.append(strategy)
         if ib is None:
@@ -113,17 +157,55 @@ class MultiParameters():
             return None    
 
 
-    def _add_contract_parameters(self, ib, newStrategiesList):
-        '''Devuelve la lista de estrategias, pero con los parametros contract y contractId establecidos.'''
+    def _add_contract_parameters(self, ib, newStrategiesList, dormantIds=None):
+        '''
+        Devuelve la lista de estrategias, pero con los parametros contract y contractId establecidos.
+        Si la estrategia esta dormida y los campos de su contrato en la hoja no han cambiado, se
+        reutiliza el contrato calificado anteriormente sin consultar a TWS.
+        '''
         result = []
         for strategy in newStrategiesList:
             contract = self._create_contract_parameters(strategy, verbose=True)
-            strategy['contract'] = contract
-            strategy['contractId'] = ib.get_contract_id(contract)
+            key = self._contract_key(contract)
+            qualified = self.qualifiedContracts.get(key) if self._dormant_previous(strategy, dormantIds) is not None else None
+            if qualified is not None:
+                strategy['contract'] = qualified
+                strategy['contractId'] = qualified.conId
+            else:
+                strategy['contract'] = contract
+                strategy['contractId'] = ib.get_contract_id(contract)
+                if key is not None and strategy['contractId']:
+                    self.qualifiedContracts[key] = contract
             result.append(strategy)
         return result
 
 
+    @staticmethod
+    def _contract_key(contract):
+        '''
+        Devuelve los campos que identifican al contrato tal como se crean desde la hoja, antes de calificarlo.
+        No se compara el contrato completo porque qualifyContracts completa sus campos.
+        '''
+        if contract is None:
+            return None
+        return (
+            contract.secType, contract.symbol, contract.exchange, contract.currency,
+            contract.lastTradeDateOrContractMonth, contract.localSymbol, contract.multiplier
+        )
+
+
+    def _dormant_previous(self, strategy, dormantIds):
+        '''Devuelve los parametros anteriores de la estrategia si esta dormida, de lo contrario None.'''
+        if not dormantIds:
+            return None
+        try:
+            if int(strategy['strategyId']) not in dormantIds:
+                return None
+        except:
+            return None
+        return self.get_strategy(strategy['strategyId'])
+
+
     def _add_action_parameter(self, newStrategiesList, previousStrategiesList):
         '''Devuelve la lista de las estrategias con el parámetro action establecido.'''
         result = []
@@ -224,7 +306,6 @@ class MultiParameters():
                 return None
         except Exception as e:
             msg = f'Error creating contract object: {str(e)}'
-            if verbose: print(msg)
             self.log.exception(msg)
             return None
         
@@ -266,8 +347,8 @@ class MultiParameters():
             strategy['step'] = self.multiTable.string_to_float(strategy['step'])
             strategy['buyOrders'] = int(strategy['buyOrders'])
             strategy['sellOrders'] = int(strategy['sellOrders'])
-            strategy['maxLongRisk'] = float(strategy['maxLongRisk'])
-            strategy['maxShortRisk'] = float(strategy['maxShortRisk'])            
+            strategy['maxLongRisk'] = self.multiTable.string_to_float(strategy['maxLongRisk'])
+            strategy['maxShortRisk'] = self.multiTable.string_to_float(strategy['maxShortRisk'])            
             
             #These may not be established
             try:
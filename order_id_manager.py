@@ -22,7 +22,7 @@ Creado: 18-09-2023
 
 __version__ = '1.0'
 
-import time
+from clock import RealClock
 
 # Esta es la definicion de la estructura que compone al identificador de ordenes.
 FIELDS = [
@@ -35,14 +35,17 @@ FIELDS = [
 
 class OrderIdManager():
     
-    def __init__(self, clientId):
+    def __init__(self, clientId, clock=None):
         '''
         Crea un objeto para el manejo de los ID de las ordenes.
         El ID permite relacionar una orden con una instancia del cliente
         y con una ejecucion dentro de la misma instancia del cliente. 
         clientId: Número identificador del cliente que se conecta.
+        clock: Reloj usado para numerar las órdenes. Por defecto el reloj del sistema.
         '''
         self.clientId = clientId
+        self.clock = clock if clock is not None else RealClock()
+        self.lastNumber = 0
         self.fields = []
         self.totalBits = 0
         for field in FIELDS:
@@ -130,11 +133,13 @@ class OrderIdManager():
         contractId: Numero identificador del contrato.
         strategyId: Número identificador de la ejecución del algoritmo.
         side: Tipo de operacion. Puede ser "SELL" o "BUY".
-        number: Número de la orden. Si se pasa None, se utiliza el timestamp en milisegundos.
+        number: Número de la orden. Si se pasa None, se utiliza el timestamp en milisegundos
+                o el siguiente número si ya se usó ese milisegundo.
         return: Devuelve un número identificador para una orden de compra o venta.
         '''
         if number is None:
-            number = round(time.time() * 1000)        
+            number = max(round(self.clock.time() * 1000), self.lastNumber + 1)
+            self.lastNumber = number
         clientId = int(clientId) << int(self.fields[4]['displacement'])
         contractId = int(contractId) << int(self.fields[3]['displacement'])
         strategyId = int(strategyId) << int(self.fields[2]['displacement'])
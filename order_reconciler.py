@@ -0,0 +1,181 @@
+
+'''
+Reconciliador de Ordenes
+
+Compara las órdenes abiertas en el broker con la escalera de niveles que debe tener cada
+estrategia y calcula la diferencia mínima: las órdenes que se deben cancelar, las que se pueden
+modificar (amend) reutilizando su orderId y las que faltan por poner.
+Las modificaciones pasan por Core.amend_order(), con el mismo chequeo de riesgo y el mismo
+regulador de mensajes que las órdenes nuevas. Una modificación rechazada cancela la orden.
+Se emplea al reconectar o reiniciar el bot para no cancelar y volver a poner todo el grid, y
+al mover la escalera de una estrategia a otro precio central (Core.move_ladder).
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+import grid_ladder
+import logging
+import time
+
+
+class OrderReconciler:
+
+    def __init__(self, configuration):
+        self.configuration = configuration
+        self.log = logging.getLogger('grid')
+
+
+
+    def plan(self, strategy, liveTrades, centerPrice=None, queuedOrders=None, queuedAmendments=None):
+        '''
+        Calculates the minimal set of changes that transforms the live orders into the desired ladder.
+        strategy: Strategy parameters, as produced by MultiParameters.
+        liveTrades: Open trades of the strategy.
+        centerPrice: Central price of the ladder. By default it is inferred with infer_center().
+        queuedOrders: Orders of the strategy that are waiting in the message rate governor.
+        queuedAmendments: Dictionary orderRef -> order with the new values of the modifications that are waiting in the
+                          message rate governor, as returned by Core.queued_amendments().
+        return: Dictionary with the lists:
+                "cancel": Trades that must be canceled.
+                "amend": Tuples (trade, price, quantity) of trades that must be modified.
+                "place": Tuples (side, price) of orders that must be posted.
+                "discard": Queued orders that must not be sent.
+                "revert": Trades whose queued modification must not be sent. They stay at their live price.
+        '''
+        result = {"cancel": [], "amend": [], "place": [], "discard": [], "revert": []}
+        if centerPrice is None:
+            centerPrice = self.infer_center(strategy, liveTrades)
+        buyIndexes, sellIndexes = grid_ladder.desired_levels(strategy, centerPrice)
+        quantity = strategy['orderQty']
+        for side, indexes in (('BUY', buyIndexes), ('SELL', sellIndexes)):
+            kept = set()
+            surplus = []
+            # Las órdenes que esperan en el regulador de mensajes ocupan su nivel como si estuvieran vivas.
+            for order in [o for o in queuedOrders or [] if o.action == side]:
+                index = grid_ladder.level_index(strategy, order.lmtPrice)
+                if index in indexes and index not in kept:
+                    kept.add(index)
+                else:
+                    result["discard"].append(order)
+            for trade in [t for t in liveTrades if t.order.action == side]:
+                # Una orden con una modificación encolada ocupa el nivel nuevo. Si ya no sirve, se planifica con su precio vivo.
+                amended = (queuedAmendments or {}).get(trade.order.orderRef)
+                if amended is not None:
+                    index = grid_ladder.level_index(strategy, amended.lmtPrice)
+                    if index in indexes and index not in kept:
+                        kept.add(index)
+                        continue
+                    result["revert"].append(trade)
+                index = grid_ladder.level_index(strategy, trade.order.lmtPrice)
+                if index in indexes and index not in kept:
+                    kept.add(index)
+                    if trade.order.totalQuantity != quantity:
+                        result["amend"].append((trade, trade.order.lmtPrice, quantity))
+                else:
+                    surplus.append(trade)
+            for index in indexes:
+                if index in kept:
+                    continue
+                price = grid_ladder.level_price(strategy, index)
+                # Se reutiliza la orden sobrante más lejana. La modificación pasa por el riesgo en Core.amend_order().
+                if len(surplus) > 0:
+                    reusable = max(surplus, key=lambda t: abs(t.order.lmtPrice - price))
+                    surplus.remove(reusable)
+                    result["amend"].append((reusable, price, quantity))
+                else:
+                    result["place"].append((side, price))
+            result["cancel"].extend(surplus)
+        return result
+
+
+
+    def infer_center(self, strategy, liveTrades):
+        '''
+        Returns the central price of the ladder.
+        It uses the last known fill. If it is not known (after a restart), it is inferred
+        from the gap between the live buys and sells, or from the market price.
+        '''
+        if strategy.get('lastFillPrice') is not None:
+            return strategy['lastFillPrice']
+        buys = [grid_ladder.level_index(strategy, t.order.lmtPrice) for t in liveTrades if t.order.action == 'BUY']
+        sells = [grid_ladder.level_index(strategy, t.order.lmtPrice) for t in liveTrades if t.order.action == 'SELL']
+        if len(buys) > 0:
+            return grid_ladder.level_price(strategy, max(buys) + 1)
+        if len(sells) > 0:
+            return grid_ladder.level_price(strategy, min(sells) - 1)
+        market = strategy.get('market')
+        if market is not None and market.close is not None and market.close > 0:
+            return market.close
+        return None
+
+
+
+    def reconcile(self, strategies, core, awaitSeconds=10, verbose=True):
+        '''
+        Applies the minimal changes of all the strategies in one batch.
+        All the cancels, amends and new orders are sent without waiting between them
+        and then the cancels are awaited once for all the strategies.
+        strategies: List of strategies that must be reconciled.
+        core: It is the Core type object that is started and correctly connected.
+        awaitSeconds: Maximum seconds to wait for the cancels.
+        return: Dictionary with the count of canceled, amended and placed orders.
+        '''
+        timeBegin = time.time()
+        totals = {"cancel": 0, "amend": 0, "place": 0}
+        plans = []
+        for strategy in strategies:
+            try:
+                plan = self.plan(strategy, core.open_trades_of_strategy(strategy['strategyId']), queuedAmendments=core.queued_amendments())
+                plans.append((strategy, plan))
+            except Exception as e:
+                self.log.exception(f'Error planning the reconciliation of strategy {strategy["strategyId"]}')
+        canceled = []
+        for strategy, plan in plans:
+            canceled.extend(self.apply(strategy, plan, core, verbose, prefix=f'strategy {strategy["strategyId"]} Reconcile '))
+            for key in totals.keys():
+                totals[key] += len(plan[key])
+        while len(canceled) > 0 and awaitSeconds > 0:
+            canceled = [orderRef for orderRef in canceled if core.order_exist(orderRef)]
+            if len(canceled) == 0:
+                break
+            core.sleep(1)   # Garantiza el funcionamiento asyncrono
+            awaitSeconds -= 1
+        msg = 'Reconciled {} strategies: {} canceled, {} amended, {} placed in {} seconds'.format(
+            len(plans), totals["cancel"], totals["amend"], totals["place"], round(time.time() - timeBegin, 2)
+        )
+        self.log.info(msg)
+        return totals
+
+
+
+    def apply(self, strategy, plan, core, verbose=True, prefix='', priority='grid'):
+        '''
+        Sends the changes of a plan without waiting for the broker.
+        The amendments go first so that the reused orders keep their place in the queue of the exchange.
+        Every amendment is validated by the risk manager. The rejected ones are moved from plan["amend"]
+        to plan["cancel"], so the plan reports what was really sent.
+        return: orderRef of the canceled orders.
+        '''
+        canceled = []
+        for order in plan.get("discard", []):
+            core.governor.discard(('place', order))
+            core.riskManager.release_order(order)
+            self.log.info(f'{prefix}discard: {order.orderRef} {order.action} at {order.lmtPrice}')
+        for trade in plan.get("revert", []):
+            core.governor.discard(('amend', trade.order.orderRef))
+            core.riskManager.restore_order(trade, core)     # La orden sigue viva con su precio anterior.
+            self.log.info(f'{prefix}revert: {trade.order.orderRef} {trade.order.action} stays at {trade.order.lmtPrice}')
+        for item in list(plan["amend"]):
+            trade, price, quantity = item
+            if not core.amend_order(trade, strategy, price, quantity, priority=priority, prefix=prefix):
+                plan["amend"].remove(item)
+                plan["cancel"].append(trade)     # Si no se puede modificar, no puede quedar en un nivel equivocado.
+        for trade in plan["cancel"]:
+            core.send_cancel_order(trade.order)
+            canceled.append(trade.order.orderRef)
+            self.log.info(f'{prefix}cancel: {trade.order.orderRef} {trade.order.action} at {trade.order.lmtPrice}')
+        for side, price in plan["place"]:
+            core.post_order(strategy, side, price, verbose=verbose, prefix=prefix, priority=priority)
+        core.sleep(0)   # Garantiza el funcionamiento asyncrono
+        return canceled
@@ -0,0 +1,144 @@
+
+'''
+Perfilado bajo Demanda
+
+Permite perfilar con cProfile los callbacks de Core en un bot en producción sin reiniciarlo.
+Los callbacks elegidos se envuelven al crear Core, pero solo se perfilan cuando se activa el
+perfilado para las próximas N llamadas. Se activa de dos maneras:
+
+ - Creando el fichero de activación (por defecto "profile.json") con el contenido
+   {"targets": ["set_actualize_bot_status"], "cycles": 5}. Se lee y se borra en el siguiente ciclo.
+ - Enviando la señal SIGUSR1 (SIGBREAK con Ctrl+Break en Windows), que perfila todos los callbacks.
+
+Al terminar, cada perfil se guarda con fecha y hora en la carpeta de perfiles y se escribe
+en el log (y por tanto en consola) un resumen de las funciones con mayor tiempo acumulado.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from datetime import datetime
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import signal
+
+
+class CallbackProfiler:
+
+    def __init__(self, folder='./profiles', triggerFile='profile.json', defaultCycles=5, topCount=25):
+        '''
+        folder: Folder where the profiles are written.
+        triggerFile: File that activates the profiling when it is created.
+        defaultCycles: Number of calls that are profiled when the amount is not indicated.
+        topCount: Number of functions shown in the summary.
+        '''
+        self.folder = folder
+        self.triggerFile = triggerFile
+        self.defaultCycles = defaultCycles
+        self.topCount = topCount
+        self.targets = {}       # name: {"remaining": calls to profile, "profile": cProfile.Profile}
+        self.active = False     # cProfile no admite perfiles anidados.
+        self.signalReceived = False
+        self.log = logging.getLogger('grid')
+
+
+
+    def wrap(self, owner, name):
+        '''Replaces the method owner.name with a wrapper that profiles it when it is armed.'''
+        function = getattr(owner, name)
+        self.targets[name] = {"remaining": 0, "profile": None}
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            target = self.targets[name]
+            if target["remaining"] <= 0 or self.active:
+                return function(*args, **kwargs)
+            self.active = True
+            try:
+                target["profile"].enable()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    target["profile"].disable()
+            finally:
+                self.active = False
+                target["remaining"] -= 1
+                if target["remaining"] <= 0:
+                    self._finish(name)
+
+        setattr(owner, name, wrapper)
+
+
+
+    def arm(self, targets=None, cycles=None):
+        '''
+        Activates the profiling of the next calls.
+        targets: Names of the wrapped callbacks. If None, all of them are profiled.
+        cycles: Number of calls to profile. If None, defaultCycles is used.
+        '''
+        cycles = self.defaultCycles if cycles is None else int(cycles)
+        for name in (self.targets.keys() if targets is None else targets):
+            if name not in self.targets:
+                self.log.warning(f'The callback {name} cannot be profiled because it is not wrapped.')
+                continue
+            if self.targets[name]["remaining"] <= 0:
+                self.targets[name]["profile"] = cProfile.Profile()
+            self.targets[name]["remaining"] = cycles
+            self.log.info(f'Profiling the next {cycles} calls of {name}')
+
+
+
+    def install_signal(self):
+        '''Activates the profiling of all the callbacks when SIGUSR1 (or SIGBREAK on Windows) is received.'''
+        signalNumber = getattr(signal, 'SIGUSR1', None) or getattr(signal, 'SIGBREAK', None)
+        if signalNumber is None:
+            return False
+        def handler(number, frame):
+            self.signalReceived = True      # Se activa desde check_trigger(), fuera del manejador.
+        signal.signal(signalNumber, handler)
+        return True
+
+
+
+    def check_trigger(self):
+        '''Arms the profiler if the signal was received or the trigger file exists. It is called on each status cycle.'''
+        if self.signalReceived:
+            self.signalReceived = False
+            self.arm()
+        if not os.path.exists(self.triggerFile):
+            return
+        try:
+            with open(self.triggerFile, 'r') as file:
+                text = file.read().strip()
+            request = json.loads(text) if text != '' else {}
+            self.arm(request.get('targets'), request.get('cycles'))
+        except Exception as e:
+            self.log.exception(f'Error reading the profiling trigger {self.triggerFile}: {str(e)}')
+        finally:
+            try:
+                os.remove(self.triggerFile)
+            except OSError:
+                pass
+
+
+
+    def _finish(self, name):
+        '''Writes the profile of the callback and logs the summary of the top cumulative functions.'''
+        profile = self.targets[name]["profile"]
+        self.targets[name]["profile"] = None
+        try:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            fileName = os.path.join(self.folder, '{}_{}.prof'.format(name, datetime.now().strftime('%Y%m%d_%H%M%S')))
+            profile.dump_stats(fileName)
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(self.topCount)
+            msg = f'Profile of {name} saved in {fileName}\n{summary.getvalue()}'
+            self.log.info(msg)
+        except Exception as e:
+            self.log.exception(f'Error saving the profile of {name}: {str(e)}')
@@ -0,0 +1,184 @@
+
+'''
+Regulador de Mensajes
+
+Interactive Brokers limita la cantidad de mensajes por segundo que se pueden enviar por el API.
+Esta clase es un "token bucket" por el que pasan todos los placeOrder, cancelOrder y las
+solicitudes de datos de mercado. Cuando no quedan tokens, las solicitudes se encolan por
+prioridad y se envían en cuanto se recuperan tokens, en este orden:
+
+ - reaction: Ordenes contrarias a una ejecución.
+ - cancel: Cancelación de órdenes.
+ - grid: Niveles iniciales del grid.
+ - data: Solicitudes de datos de mercado.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from clock import RealClock
+from datetime import timedelta
+import collections
+import logging
+
+PRIORITIES = ['reaction', 'cancel', 'grid', 'data']
+
+
+class RateGovernor:
+
+    def __init__(self, messagesPerSecond=45, burst=10, clock=None):
+        '''
+        messagesPerSecond: Sustained rate of messages that can be sent to the API.
+        burst: Maximum number of messages that can be sent at once.
+        clock: Clock used to refill the tokens and to schedule the pump. By default, the clock of the system.
+        '''
+        self.clock = clock if clock is not None else RealClock()
+        self.rate = float(messagesPerSecond)
+        self.capacity = float(burst)
+        self.tokens = self.capacity
+        self.lastRefill = self.clock.time()
+        self.queues = {priority: collections.deque() for priority in PRIORITIES}
+        self.stats = {priority: self._empty_stats() for priority in PRIORITIES}
+        self.pumpHandle = None
+        self.log = logging.getLogger('grid')
+
+
+
+    def submit(self, priority, function, *args, tag=None):
+        '''
+        Calls function(*args) now if there is a token and nothing of the same or higher priority is queued.
+        Otherwise the call is queued and executed later by the pump.
+        tag: Any value that identifies the call while it is queued. See pending_tags().
+        return: Tuple (sent, result). If the call was queued, it returns (False, None).
+        '''
+        self.stats[priority]['submitted'] += 1
+        if not self._queued_before(priority) and self._take_token():
+            self._record(priority, 0)
+            return True, function(*args)
+        self.queues[priority].append((self.clock.time(), function, args, tag))
+        self.stats[priority]['depthMax'] = max(self.stats[priority]['depthMax'], len(self.queues[priority]))
+        self._schedule_pump()
+        return False, None
+
+
+
+    def wait(self, priority, sleep):
+        '''
+        Blocks until a message of the given priority can be sent.
+        It is used for requests that need the answer, like the market data requests.
+        sleep: Function used to wait without blocking the event loop, like Clock.sleep.
+        '''
+        self.stats[priority]['submitted'] += 1
+        timeBegin = self.clock.time()
+        while self._queued_before(priority) or not self._take_token():
+            sleep(self._seconds_to_token())
+        self._record(priority, self.clock.time() - timeBegin)
+
+
+
+    def pending_tags(self):
+        '''Returns the tags of the queued calls.'''
+        return [item[3] for priority in PRIORITIES for item in self.queues[priority] if item[3] is not None]
+
+
+
+    def pending_calls(self):
+        '''Returns the tags and the arguments of the queued calls that have a tag.'''
+        return [(item[3], item[2]) for priority in PRIORITIES for item in self.queues[priority] if item[3] is not None]
+
+
+
+    def discard(self, tag):
+        '''Removes the queued calls with the given tag. Returns the number of removed calls.'''
+        count = 0
+        for priority in PRIORITIES:
+            kept = collections.deque(item for item in self.queues[priority] if item[3] != tag)
+            count += len(self.queues[priority]) - len(kept)
+            self.queues[priority] = kept
+        return count
+
+
+
+    def metrics(self):
+        '''Returns the queue depth and the wait times of each priority class.'''
+        result = {}
+        for priority in PRIORITIES:
+            stats = self.stats[priority]
+            result[priority] = {
+                "depth": len(self.queues[priority]),
+                "depthMax": stats['depthMax'],
+                "submitted": stats['submitted'],
+                "dispatched": stats['dispatched'],
+                "waitAverage": stats['waitTotal'] / stats['dispatched'] if stats['dispatched'] > 0 else 0,
+                "waitMax": stats['waitMax']
+            }
+        return result
+
+
+
+    def _pump(self):
+        '''Sends the queued calls, in priority order, while there are tokens.'''
+        self.pumpHandle = None
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            while len(queue) > 0:
+                if not self._take_token():
+                    self._schedule_pump()
+                    return
+                queuedAt, function, args, tag = queue.popleft()
+                self._record(priority, self.clock.time() - queuedAt)
+                try:
+                    function(*args)
+                except Exception as e:
+                    self.log.exception(f'Error sending a queued {priority} message: {str(e)}')
+
+
+
+    def _schedule_pump(self):
+        if self.pumpHandle is None:
+            when = self.clock.now() + timedelta(seconds=self._seconds_to_token())
+            self.pumpHandle = self.clock.schedule(when, self._pump)
+
+
+
+    def _queued_before(self, priority):
+        '''Returns True if there are queued calls with the same or higher priority.'''
+        for other in PRIORITIES[:PRIORITIES.index(priority) + 1]:
+            if len(self.queues[other]) > 0:
+                return True
+        return False
+
+
+
+    def _refill(self):
+        now = self.clock.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.rate)
+        self.lastRefill = now
+
+
+
+    def _take_token(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+
+    def _seconds_to_token(self):
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+
+    def _record(self, priority, waitSeconds):
+        stats = self.stats[priority]
+        stats['dispatched'] += 1
+        stats['waitTotal'] += waitSeconds
+        stats['waitMax'] = max(stats['waitMax'], waitSeconds)
+
+
+
+    def _empty_stats(self):
+        return {"submitted": 0, "dispatched": 0, "waitTotal": 0.0, "waitMax": 0.0, "depthMax": 0}
@@ -0,0 +1,470 @@
+
+'''
+Libro de Riesgo Compartido
+
+Cuando se ejecutan varias instancias del bot a la vez (varios clientId sobre la misma cuenta),
+cada RiskManager solo ve las órdenes abiertas de su propio cliente, así que los límites
+global y por contrato no se cumplen entre instancias. La alternativa de consultar todas las
+órdenes con reqAllOpenOrders bloquea el bot varios segundos en cada validación.
+
+Este módulo mantiene en un solo proceso el libro de las órdenes abiertas de todas las
+instancias y de las posiciones de la cuenta:
+
+ - RiskLedger: El libro. Mantiene por contrato los acumulados de órdenes de compra, de venta
+   y de posición, y el total global, actualizados de forma incremental en cada cambio.
+ - RiskLedgerServer: Atiende a las instancias por un socket Unix (o una tubería con nombre en
+   Windows). Cada petición se ejecuta completa bajo un mismo lock, así que "reservar" comprueba
+   los límites y anota la orden en un solo paso atómico.
+ - RiskLedgerClient: Lo usa RiskManager. Reserva cada orden antes de enviarla, la confirma al
+   enviarla y reporta las ejecuciones, cancelaciones y posiciones. Si el servicio no responde,
+   devuelve None y RiskManager vuelve al cálculo local.
+
+Las reservas que no se confirman caducan a los reservationSeconds segundos. Cada instancia
+envía periódicamente la lista completa de sus órdenes abiertas (y las que esperan en el
+regulador de mensajes) para corregir cualquier evento perdido.
+
+Las conexiones se autentican con una clave compartida (risk_ledger_authkey, o la variable de
+entorno GRID_RISK_LEDGER_AUTHKEY) antes de recibir ningún mensaje. El servicio lo arranca el
+supervisor de workers, que genera una clave al azar para sus workers si no se configuró
+ninguna, o se ejecuta aparte con:
+
+    python risk_ledger.py --address ./state/risk_ledger.sock --authkey <clave>
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+from clock import RealClock
+import argparse
+import logging
+import os
+import threading
+import time
+
+DEFAULT_ADDRESS = r'\\.\pipe\grid_risk_ledger' if os.name == 'nt' else './state/risk_ledger.sock'
+AUTHKEY_VARIABLE = 'GRID_RISK_LEDGER_AUTHKEY'
+COMMANDS = ['reserve', 'commit', 'release', 'fill', 'position', 'sync', 'exposure']
+CLOSED_STATUSES = ['Cancelled', 'ApiCancelled', 'Inactive', 'Filled']
+
+
+class RiskLedger:
+
+    def __init__(self, reservationSeconds=60, clock=None):
+        '''
+        reservationSeconds: Seconds that a reserved order counts in the risk before it is committed.
+        clock: Clock used for the expiration of the reservations. By default the clock of the system.
+        '''
+        self.reservationSeconds = reservationSeconds
+        self.clock = clock if clock is not None else RealClock()
+        self.orders = {}            # (clientId, orderRef) -> datos de la orden.
+        self.clientOrders = {}      # clientId -> conjunto de claves de sus ordenes.
+        self.reserved = {}          # (clientId, orderRef) -> hora de caducidad de la reserva.
+        self.contracts = {}         # contractId -> acumulados del contrato.
+        self.total = 0.0            # Suma del maximo nominal virtual de todos los contratos.
+
+
+
+    def reserve(self, clientId, orderRef, contractId, symbol, side, quantity, nominal, limits):
+        '''
+        Checks the limits with the order added and, if it is accepted, adds it to the ledger in the same step.
+        If the orderRef is already in the ledger the order is being amended: only the net change is checked
+        and applied, and a rejected amendment leaves the previous order as it was.
+        quantity, nominal: Signed values of the order, positive for BUY and negative for SELL.
+        limits: Dictionary with the limits, like RiskManager.max.
+        return: Dictionary with "accepted", "reason" ("order", "global", "contract" or None),
+                "increases" and the virtual values of the contract and the global total with the order.
+        '''
+        self.expire()
+        key = (clientId, str(orderRef))
+        previous = self.orders.get(key)
+        if previous is not None and (previous['contractId'] != str(contractId) or previous['side'] != side):
+            self.release(clientId, orderRef)
+            previous = None
+        if previous is not None:
+            quantityDelta, nominalDelta = quantity - previous['quantity'], nominal - previous['nominal']
+        else:
+            quantityDelta, nominalDelta = quantity, nominal
+        contract = self._contract(contractId, symbol)
+        buy = side == 'BUY'
+        quantityLong = contract['positionQuantity'] + contract['buyQuantity'] + (quantityDelta if buy else 0)
+        quantityShort = contract['positionQuantity'] + contract['sellQuantity'] + (0 if buy else quantityDelta)
+        nominalLong = contract['positionNominal'] + contract['buyNominal'] + (nominalDelta if buy else 0)
+        nominalShort = contract['positionNominal'] + contract['sellNominal'] + (0 if buy else nominalDelta)
+        contractMax = max(abs(nominalLong), abs(nominalShort))
+        result = {
+            "accepted": True,
+            "reason": None,
+            "increases": self._increases(quantityLong if buy else quantityShort, side),
+            "global": self.total - contract['max'] + contractMax,
+            "contract": abs(nominalLong if buy else nominalShort),
+            "virtual": {
+                "long": {"quantity": quantityLong, "nominal": nominalLong},
+                "short": {"quantity": quantityShort, "nominal": nominalShort},
+                "max": {"nominal": contractMax}
+            }
+        }
+        if result['increases']:
+            if abs(nominal) > limits['order']:
+                result['reason'] = 'order'
+            elif result['global'] > limits['position']['global']:
+                result['reason'] = 'global'
+            elif result['contract'] > limits['position']['contract']:
+                result['reason'] = 'contract'
+        if result['reason'] is not None:
+            result['accepted'] = False
+            return result
+        if previous is not None:
+            previous['quantity'], previous['nominal'] = quantity, nominal
+            self._change(contractId, side, quantityDelta, nominalDelta)
+        else:
+            self._add(key, contractId, side, quantity, nominal)
+        self.reserved[key] = self.clock.time() + self.reservationSeconds
+        return result
+
+
+
+    def commit(self, clientId, orderRef):
+        '''Marks a reserved order as sent, so it does not expire.'''
+        return self.reserved.pop((clientId, str(orderRef)), None) is not None
+
+
+
+    def release(self, clientId, orderRef):
+        '''Removes an order from the ledger because it was cancelled, rejected or filled.'''
+        key = (clientId, str(orderRef))
+        order = self.orders.pop(key, None)
+        self.reserved.pop(key, None)
+        if order is None:
+            return False
+        self.clientOrders[clientId].discard(key)
+        self._change(order['contractId'], order['side'], -order['quantity'], -order['nominal'])
+        return True
+
+
+
+    def fill(self, clientId, orderRef, contractId, side, shares, multiplier, price):
+        '''
+        Applies an execution: moves the filled part of the order to the position of the contract.
+        shares: Unsigned quantity executed.
+        '''
+        quantity = shares if side == 'BUY' else -shares
+        nominal = quantity * multiplier * price
+        contract = self._contract(contractId)
+        self._update_contract(contract, positionQuantity=quantity, positionNominal=nominal)
+        key = (clientId, str(orderRef))
+        order = self.orders.get(key)
+        if order is not None and order['quantity'] != 0:
+            ratio = min(quantity / order['quantity'], 1.0)
+            if ratio >= 1.0 - 1e-9:
+                self.release(clientId, orderRef)
+            else:
+                filledNominal = order['nominal'] * ratio
+                order['quantity'] -= quantity
+                order['nominal'] -= filledNominal
+                self._change(contractId, side, -quantity, -filledNominal)
+        return True
+
+
+
+    def position(self, contractId, symbol, quantity, nominal):
+        '''Sets the position of the contract in the account, as reported by the portfolio of the broker.'''
+        contract = self._contract(contractId, symbol)
+        self._update_contract(
+            contract,
+            positionQuantity=quantity - contract['positionQuantity'],
+            positionNominal=nominal - contract['positionNominal']
+        )
+        return True
+
+
+
+    def sync(self, clientId, orders):
+        '''
+        Replaces the open orders of a client with the given list. The reservations that are not in the list are kept,
+        because they can still be on their way to the broker.
+        orders: List of tuples (orderRef, contractId, symbol, side, quantity, nominal).
+        '''
+        listed = {str(order[0]) for order in orders}
+        for key in list(self.clientOrders.get(clientId, ())):
+            if key not in self.reserved or key[1] in listed:
+                self.release(*key)
+        for orderRef, contractId, symbol, side, quantity, nominal in orders:
+            self._contract(contractId, symbol)
+            self._add((clientId, str(orderRef)), contractId, side, quantity, nominal)
+        return len(orders)
+
+
+
+    def exposure(self, contractId=None):
+        '''Returns the global total and, if contractId is given, the accumulated values of the contract.'''
+        self.expire()
+        result = {"global": self.total, "contracts": len(self.contracts), "orders": len(self.orders), "reserved": len(self.reserved)}
+        if contractId is not None:
+            result['contract'] = dict(self._contract(contractId))
+        return result
+
+
+
+    def expire(self):
+        '''Releases the reservations that were not committed in time.'''
+        if not self.reserved:
+            return 0
+        now = self.clock.time()
+        expired = [key for key, expiration in self.reserved.items() if expiration <= now]
+        for key in expired:
+            self.release(*key)
+        return len(expired)
+
+
+
+    def _increases(self, quantityVirtual, side):
+        '''Same rule as RiskManager.order_increases_position.'''
+        if quantityVirtual == 0:
+            return False
+        return (quantityVirtual > 0) == (side == 'BUY')
+
+
+
+    def _contract(self, contractId, symbol=None):
+        contractId = str(contractId)
+        contract = self.contracts.get(contractId)
+        if contract is None:
+            contract = self.contracts[contractId] = {
+                "symbol": symbol, "positionQuantity": 0.0, "positionNominal": 0.0,
+                "buyQuantity": 0.0, "buyNominal": 0.0, "sellQuantity": 0.0, "sellNominal": 0.0, "max": 0.0
+            }
+        elif symbol is not None:
+            contract['symbol'] = symbol
+        return contract
+
+
+
+    def _add(self, key, contractId, side, quantity, nominal):
+        self.orders[key] = {"contractId": str(contractId), "side": side, "quantity": quantity, "nominal": nominal}
+        self.clientOrders.setdefault(key[0], set()).add(key)
+        self._change(contractId, side, quantity, nominal)
+
+
+
+    def _change(self, contractId, side, quantity, nominal):
+        contract = self._contract(contractId)
+        if side == 'BUY':
+            self._update_contract(contract, buyQuantity=quantity, buyNominal=nominal)
+        else:
+            self._update_contract(contract, sellQuantity=quantity, sellNominal=nominal)
+
+
+
+    def _update_contract(self, contract, **deltas):
+        '''Adds the deltas to the contract and updates its virtual maximum and the global total.'''
+        for name, delta in deltas.items():
+            contract[name] += delta
+        contractMax = max(
+            abs(contract['positionNominal'] + contract['buyNominal']),
+            abs(contract['positionNominal'] + contract['sellNominal'])
+        )
+        self.total += contractMax - contract['max']
+        contract['max'] = contractMax
+
+
+
+class RiskLedgerServer:
+
+    def __init__(self, address=DEFAULT_ADDRESS, ledger=None, authkey=b''):
+        '''
+        address: Path of the Unix socket, or name of the pipe in Windows.
+        ledger: RiskLedger served. By default a new one.
+        authkey: Shared key that the clients must prove before any message is received. It is required.
+        '''
+        self.address = address
+        self.ledger = ledger if ledger is not None else RiskLedger()
+        self.authkey = authkey
+        self.lock = threading.Lock()
+        self.listener = None
+        self.connections = set()
+        self.running = False
+        self.log = logging.getLogger('grid')
+
+
+
+    def start(self):
+        '''Starts serving in a background thread.'''
+        if not self.authkey:
+            raise ValueError('The risk ledger needs an authentication key.')
+        if os.name != 'nt':
+            folder = os.path.dirname(self.address)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            if os.path.exists(self.address):
+                os.remove(self.address)     # Socket de una ejecucion anterior.
+        self.listener = Listener(self.address, authkey=self.authkey)
+        self.running = True
+        threading.Thread(target=self._accept, name='risk-ledger', daemon=True).start()
+        self.log.info(f'Risk ledger serving at {self.address}')
+
+
+
+    def stop(self):
+        self.running = False
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        for connection in list(self.connections):
+            connection.close()
+
+
+
+    def handle(self, command, args):
+        '''Executes one request with the lock held, so every command is atomic.'''
+        if command not in COMMANDS:
+            raise ValueError(f'Unknown risk ledger command: {command}')
+        with self.lock:
+            return getattr(self.ledger, command)(*args)
+
+
+
+    def _accept(self):
+        while self.running:
+            try:
+                connection = self.listener.accept()
+            except AuthenticationError:
+                self.log.error('Risk ledger rejected a connection with a wrong authentication key')
+                continue
+            except Exception:
+                if self.running:
+                    self.log.exception('Risk ledger stopped accepting connections')
+                return
+            threading.Thread(target=self._serve, args=(connection,), name='risk-ledger-client', daemon=True).start()
+
+
+
+    def _serve(self, connection):
+        self.connections.add(connection)
+        try:
+            while self.running:
+                command, args = connection.recv()
+                try:
+                    answer = ('ok', self.handle(command, args))
+                except Exception as e:
+                    answer = ('error', str(e))
+                connection.send(answer)
+        except (EOFError, OSError):
+            pass
+        except Exception:
+            if self.running:
+                self.log.exception('Risk ledger connection failed')
+        finally:
+            self.connections.discard(connection)
+            connection.close()
+
+
+
+class RiskLedgerClient:
+
+    def __init__(self, address, clientId, authkey, timeout=1.0, retrySeconds=5):
+        '''
+        address: Address of the RiskLedgerServer.
+        clientId: clientId of this instance. It separates its orders from the other instances.
+        authkey: Shared key of the RiskLedgerServer.
+        timeout: Seconds to wait for an answer before considering that the service is not available.
+        retrySeconds: Seconds between reconnection attempts while the service is not available.
+        '''
+        self.address = address
+        self.clientId = clientId
+        self.authkey = authkey
+        self.timeout = timeout
+        self.retrySeconds = retrySeconds
+        self.connection = None
+        self.nextAttempt = 0
+        self.available = None
+        self.log = logging.getLogger('grid')
+
+
+
+    def call(self, command, *args):
+        '''
+        Sends a request to the service.
+        return: The answer, or None if the service is not available.
+        '''
+        try:
+            if self.connection is None:
+                if time.monotonic() < self.nextAttempt:
+                    return None
+                self.connection = Client(self.address, authkey=self.authkey)
+            self.connection.send((command, args))
+            if not self.connection.poll(self.timeout):
+                raise TimeoutError(f'No answer in {self.timeout} seconds')
+            status, result = self.connection.recv()
+        except Exception as e:
+            self.close()
+            self.nextAttempt = time.monotonic() + self.retrySeconds
+            if self.available is not False:
+                self.log.error(f'Risk ledger {self.address} is not available, the risk is checked locally. Exception: {str(e)}')
+            self.available = False
+            return None
+        if self.available is not True:
+            self.log.info(f'Risk ledger {self.address} is available.')
+            self.available = True
+        if status != 'ok':
+            self.log.error(f'Risk ledger error in {command}: {result}')
+            return None
+        return result
+
+
+
+    def reserve(self, orderRef, contractId, symbol, side, quantity, nominal, limits):
+        return self.call('reserve', self.clientId, orderRef, contractId, symbol, side, quantity, nominal, limits)
+
+    def commit(self, orderRef):
+        return self.call('commit', self.clientId, orderRef)
+
+    def release(self, orderRef):
+        return self.call('release', self.clientId, orderRef)
+
+    def fill(self, orderRef, contractId, side, shares, multiplier, price):
+        return self.call('fill', self.clientId, orderRef, contractId, side, shares, multiplier, price)
+
+    def position(self, contractId, symbol, quantity, nominal):
+        return self.call('position', contractId, symbol, quantity, nominal)
+
+    def sync(self, orders):
+        return self.call('sync', self.clientId, orders)
+
+    def exposure(self, contractId=None):
+        return self.call('exposure', contractId)
+
+
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+
+def ledger_authkey(configuration):
+    '''Returns the key of the risk ledger: risk_ledger_authkey of the configuration, or the environment variable AUTHKEY_VARIABLE.'''
+    return (configuration.get('risk_ledger_authkey') or os.environ.get(AUTHKEY_VARIABLE, '')).encode()
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shared risk ledger for several instances of the Grid Bot.')
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help='Path of the Unix socket, or name of the pipe in Windows.')
+    parser.add_argument('--authkey', default=os.environ.get(AUTHKEY_VARIABLE, ''), help=f'Shared key of the clients. By default the environment variable {AUTHKEY_VARIABLE}.')
+    parser.add_argument('--reservation-seconds', type=float, default=60, help='Seconds before a reservation that is not committed expires.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    server = RiskLedgerServer(args.address, RiskLedger(args.reservation_seconds), args.authkey.encode())
+    server.start()
+    try:
+        while True:
+            time.sleep(60)
+            logging.getLogger('grid').info(f'Risk ledger: {server.handle("exposure", ())}')
+    except KeyboardInterrupt:
+        server.stop()
@@ -11,7 +11,8 @@ realizar operaciones teniendo en cuenta el nivel de riesgo actual.
 from ib_insync import *
 import telegram
 import logging
-import time
+from clock import RealClock
+from risk_ledger import RiskLedgerClient, CLOSED_STATUSES, ledger_authkey
 import json
 
 
@@ -25,8 +26,9 @@ WARNING_PERCENTAGE = 90    # Establishes the percentage of the limit from which
 
 class RiskManager:
     
-    def __init__(self, configuration):
+    def __init__(self, configuration, clock=None):
         self.configuration = configuration
+        self.clock = clock if clock is not None else RealClock()
         self.warningPercentage = WARNING_PERCENTAGE
         self.warningRatio = self.warningPercentage / 100
         self.max = {
@@ -41,6 +43,11 @@ class RiskManager:
         self.dynamicPortfolio = {}
         self.orders = self._empty_orders_data()
         self.risk = self._empty_risk_data()
+        self.lastOrderNominal = 0        # Nominal de la ultima orden validada.
+        self.ledger = None               # Libro de riesgo compartido con las demas instancias.
+        self.orderIdManager = None
+        if self.configuration.get('risk_ledger_address'):
+            self.ledger = RiskLedgerClient(self.configuration['risk_ledger_address'], self.configuration['client_tws'], ledger_authkey(self.configuration))
         self.log = logging.getLogger('grid')
         
         
@@ -74,7 +81,14 @@ class RiskManager:
         try:
             # Gets the incoming order data.
             contractId, symbol, strategyId, side, quantity, multiplied, nominal = self._common_data_from_order(order, strategy)
+            self.lastOrderNominal = abs(nominal)
             
+            # With the shared ledger the limits include the orders of all the instances.
+            if self.ledger is not None:
+                result = self.ledger.reserve(order.orderRef, contractId, symbol, side, quantity, nominal, self.max)
+                if result is not None:
+                    return self._ledger_decision(order, strategy, contractId, symbol, result)
+
             # Calculates the current risk taking into account active orders.
             if not self._calculate_risks(order, strategy, core):
                 return False
@@ -91,23 +105,19 @@ class RiskManager:
             potencialPositionContract = abs(self.risk['contract'][contractId]["virtual"]['long']["nominal"] if order.action == "BUY" else self.risk['contract'][contractId]["virtual"]['short']["nominal"])
             potencialPositionStrategy = 0   #self.risk['strategy'][strategyId]["virtual"]["max"]["nominal"] 
             if self.configuration.get("verbose_risk_data", False):
-                print('potencialPositionContract:', potencialPositionContract)
+                self.log.debug(f'potencialPositionContract: {potencialPositionContract}')
                                                            
             if self.configuration['debug_mode']:
-                print('   _____________________________________')
-                print('   Risk calculation:')
                 report = {
                     "contract": self.risk['contract'][contractId]["virtual"],
                     "total": self.risk['total']
                 }
-                print(json.dumps(report, indent=3))
+                self.log.debug('Risk calculation: {}'.format(json.dumps(report)))
             
             strPrefix = f"Order to {order.action} {strategy['orderQty']} {symbol} @ {order.lmtPrice} exceeds"
             strRejected = 'ORDER MUST BE REJECTED!!'                        
   
             # Checks maximun thresolds and returns False if any is exceeded.
-            if self.configuration.get("verbose_risk_data", False):
-                print('potencialPositionContract:', potencialPositionContract)
             if nominal > self.max['order']:
                 self.log.critical(self._inform(f"{strPrefix} single order limit of {MAX_ORDER}. {strRejected}"))
                 return False        
@@ -147,6 +157,117 @@ class RiskManager:
         '''Method to get the complete estimated risk.'''
         return self.risk
 
+
+
+    def attach_ledger(self, core):
+        '''Subscribes to the events of the broker that change the shared risk ledger.'''
+        if self.ledger is None:
+            return
+        self.orderIdManager = core.orderIdManager
+        core.orderStatusEvent += self.onLedgerOrderStatus
+        core.execDetailsEvent += self.onLedgerExecDetails
+        core.updatePortfolioEvent += self.onLedgerPortfolio
+
+
+
+    def sync_ledger(self, core):
+        '''
+        Sends to the shared risk ledger all the open orders of this client, including the ones that wait in
+        the rate governor, and the positions of the account.
+        '''
+        if self.ledger is None:
+            return
+        orders = []
+        for trade in self._with_queued_orders(core.openTrades(), core):
+            if core.orderIdManager.is_order_child_of_client(trade.order.orderRef):
+                contractId, symbol, strategyId, side, quantity, multiplied, nominal = self._common_data_from_trade(trade, core)
+                orders.append((trade.order.orderRef, contractId, symbol, side, quantity, nominal))
+        if self.ledger.sync(orders) is not None:
+            for item in core.portfolio():
+                self.onLedgerPortfolio(item)
+
+
+
+    def commit_order(self, order):
+        '''Confirms in the shared risk ledger that a validated order was sent.'''
+        if self.ledger is not None:
+            self.ledger.commit(order.orderRef)
+
+
+
+    def release_order(self, order):
+        '''Removes from the shared risk ledger an order that will not be sent.'''
+        if self.ledger is not None:
+            self.ledger.release(order.orderRef)
+
+
+
+    def restore_order(self, trade, core):
+        '''
+        Puts back in the shared risk ledger the live values of an order whose queued modification will not be sent.
+        '''
+        if self.ledger is not None:
+            contractId, symbol, strategyId, side, quantity, multiplied, nominal = self._common_data_from_trade(trade, core)
+            # La orden ya esta en el broker con esos valores: se anotan sin comprobar los limites.
+            unlimited = {"order": float('inf'), "position": {"global": float('inf'), "contract": float('inf')}}
+            self.ledger.reserve(trade.order.orderRef, contractId, symbol, side, quantity, nominal, unlimited)
+            self.ledger.commit(trade.order.orderRef)
+
+
+
+    def onLedgerOrderStatus(self, trade):
+        if trade.orderStatus.status in CLOSED_STATUSES and self.orderIdManager.is_order_child_of_client(trade.order.orderRef):
+            self.ledger.release(trade.order.orderRef)
+
+
+
+    def onLedgerExecDetails(self, trade, fill):
+        if self.orderIdManager.is_order_child_of_client(trade.order.orderRef):
+            multiplier = int(trade.contract.multiplier) if trade.contract.multiplier else 1
+            self.ledger.fill(trade.order.orderRef, str(trade.contract.conId), trade.order.action, fill.execution.shares, multiplier, fill.execution.price)
+
+
+
+    def onLedgerPortfolio(self, item):
+        symbol = item.contract.localSymbol if item.contract.localSymbol else item.contract.symbol
+        self.ledger.position(str(item.contract.conId), symbol, item.position, item.marketValue)
+
+
+
+    def _ledger_decision(self, order, strategy, contractId, symbol, result):
+        '''
+        Applies the answer of the shared risk ledger with the same rules and messages as the local calculation.
+        The risk of the contract and the global total are copied to self.risk for the dashboard and the status.
+        '''
+        item = self.risk['contract'].setdefault(contractId, self._initial_risk_data_item())
+        item["contractId"] = contractId
+        item["symbol"] = symbol
+        for part in ['long', 'short']:
+            item["virtual"][part]["quantity"] = result['virtual'][part]['quantity']
+            item["virtual"][part]["nominal"] = result['virtual'][part]['nominal']
+        item["virtual"]["max"]["nominal"] = result['virtual']['max']['nominal']
+        self.risk["total"]["max"]["nominal"] = result['global']
+        if not result['increases']:
+            if self.configuration['debug_mode']:
+                self.log.critical(self._inform(f"   Order does not increase position."))
+            return True
+
+        strPrefix = f"Order to {order.action} {strategy['orderQty']} {symbol} @ {order.lmtPrice} exceeds"
+        strRejected = 'ORDER MUST BE REJECTED!!'
+        if not result['accepted']:
+            limits = {
+                "order": f"single order limit of {MAX_ORDER}",
+                "global": "global position limit",
+                "contract": "max position limit for the instrument"
+            }
+            self.log.critical(self._inform(f"{strPrefix} {limits[result['reason']]}. {strRejected}"))
+            return False
+        if result['global'] > self.warningRatio * self.max['position']['global']:
+            self.log.critical(self._inform(f"{strPrefix} {self.warningPercentage}% of global position limit"))
+        if result['contract'] > self.warningRatio * self.max['position']['contract']:
+            self.log.critical(self._inform(f"{strPrefix} {self.warningPercentage}% of max position limit for the instrument"))
+        return True
+
     
     
     def _calculate_risks(self, order, strategy, core):
@@ -168,7 +289,7 @@ class RiskManager:
             # self.risk structure and calculate virtual values.
             for position in core.portfolio():
                 if self.configuration.get("verbose_risk_data", False):
-                    print('contractID:', position.contract.conId, position.contract.symbol, '  position.marketValue:', position.marketValue)
+                    self.log.debug(f'contractID: {position.contract.conId} {position.contract.symbol}  position.marketValue: {position.marketValue}')
                 self._set_risk_data_item("contract", str(position.contract.conId), 
                     position.contract.localSymbol if position.contract.localSymbol else position.contract.symbol, 
                     None, position.position, position.marketValue)
@@ -182,7 +303,7 @@ class RiskManager:
             for key in self.risk['contract'].keys():
                 contract = self.risk['contract'][key]
                 if self.configuration.get("verbose_risk_data", False):
-                    print('INCREMENTO', contract["virtual"]["max"]["nominal"] )
+                    self.log.debug(f'INCREMENTO {contract["virtual"]["max"]["nominal"]}')
                 self.risk["total"]['long']["quantity"] += contract["virtual"]["long"]["quantity"] 
                 self.risk["total"]['long']["multiplied"] += contract["virtual"]["long"]["multiplied"] 
                 self.risk["total"]['long']["nominal"] += contract["virtual"]["long"]["nominal"] 
@@ -218,12 +339,16 @@ class RiskManager:
         try:
             if allClients:
                 openOrders = core.reqAllOpenOrders()    # Call the method to obtain all open orders on all clients.
-                time.sleep(5)                           # It pauses with "time" so that no other code is executed during the pause.
+                self.clock.block(5)                     # It pauses without the event loop so that no other code is executed during the pause.
                 #print('result of reqAllOpenOrders():\n', openOrders)
                 #print('result of openTrades():\n', core.openTrades())
             else:
                 openOrders = core.openTrades()          # Call the method to obtain all open orders on this client.
+            if hasattr(core, 'queued_place_trades'):
+                openOrders = self._with_queued_orders(openOrders, core)
             for trade in openOrders:
+                if order is not None and trade.order.orderRef == order.orderRef:
+                    continue                            # The order is being amended, it is counted with its new values.
                 contractId, symbol, strategyId, side, quantity, multiplied, nominal = self._common_data_from_trade(trade, core)
                 # Updates the open order data structure.
                 self._common_data_change(side, "quantity", contractId, symbol, strategyId, quantity)
@@ -262,6 +387,18 @@ class RiskManager:
 
 
 
+    def _with_queued_orders(self, trades, core):
+        '''
+        Adds to the open trades the orders that wait in the rate governor: the queued new orders, and the queued
+        modifications in place of the live values of their orders. They are not in the broker yet, but they will be.
+        '''
+        amendments = core.queued_amendments()
+        trades = [Trade(trade.contract, amendments[trade.order.orderRef]) if trade.order.orderRef in amendments else trade for trade in trades]
+        sentRefs = {trade.order.orderRef for trade in trades}
+        return trades + [trade for trade in core.queued_place_trades() if trade.order.orderRef not in sentRefs]
+
+
+
     def _common_data_from_trade(self, trade, core):
         contractId = str(trade.contract.conId)
         symbol = trade.contract.localSymbol if trade.contract.localSymbol else trade.contract.symbol
@@ -420,9 +557,8 @@ class RiskManager:
 
 
 
-    def _inform(self, text, cmd=True, chat=True):
-        '''It allows you to put a message in CMD, LOG and send it to CHAT Telegram.'''
-        if cmd: print(str(text))
+    def _inform(self, text, chat=True):
+        '''It allows you to prepare a message for the LOG (and the console) and send it to CHAT Telegram.'''
         text = str(text).lstrip()
         if chat: telegram.send_to_telegram(text, self.configuration)
         return text 
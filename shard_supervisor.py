@@ -0,0 +1,231 @@
+
+'''
+Supervisor de Workers
+
+Reparte las estrategias entre varios procesos Core (workers), cada uno con su propia conexión
+a TWS y su propio clientId, para que la cantidad de estrategias y de ejecuciones por segundo
+crezca con la cantidad de núcleos.
+
+ - El worker i usa el clientId client_tws + i, que queda codificado en los identificadores de
+   sus órdenes, y sus propios ficheros de log, estado, instantánea, diario, archivo y latido.
+ - Cada estrategia pertenece a un solo worker: el indicado en la columna shard_column de la
+   hoja si existe, o si no el resultado de strategyId módulo la cantidad de workers.
+   MultiParameters descarta al leer la hoja las estrategias de los demás workers.
+ - Los límites de riesgo global y por contrato se comparten entre los workers mediante el libro
+   de riesgo (risk_ledger), que el supervisor sirve siempre: en risk_ledger_address o, si está
+   vacío, en la dirección por defecto, y con una clave generada al azar si no se configuró una.
+ - El supervisor arranca los workers con "main.py --worker i", vuelve a arrancar los que
+   terminan y combina periódicamente en el log y en un fichero JSON el estado que cada
+   worker publica en su segmento de estado.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from status_segment import StatusReader
+from risk_ledger import RiskLedger, RiskLedgerServer, DEFAULT_ADDRESS, AUTHKEY_VARIABLE, ledger_authkey
+import json
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import time
+import zlib
+
+MAX_CLIENT_ID = 255         # El clientId ocupa 8 bits en el identificador de las ordenes.
+# Ficheros que no pueden compartir los workers. Cada worker agrega su numero al nombre.
+PER_WORKER_FILES = ['log_file', 'snapshot_file', 'status_file', 'journal_file', 'heartbeat_file', 'bar_cache_folder', 'tick_recorder_folder', 'trade_archive_file']
+TOTAL_FIELDS = ['strategies', 'openOrders', 'openBuyOrders', 'openSellOrders', 'queuedMessages', 'ordersPosted', 'ordersRejected', 'fills']
+
+
+def shard_of(strategy, workers, column=''):
+    '''
+    Returns the index of the worker that runs the strategy.
+    strategy: Table of parameters of the strategy, as read from the sheet.
+    workers: Number of workers.
+    column: Name of the parameter of the sheet with the worker. If it is empty or missing, strategyId is used.
+    '''
+    value = strategy.get(column) if column else None
+    if value is None or str(value).strip() == '':
+        value = strategy.get('strategyId')
+    try:
+        return int(value) % workers
+    except (TypeError, ValueError):
+        return zlib.crc32(str(value).encode()) % workers
+
+
+
+def worker_index(argv):
+    '''Returns the index given with "--worker i" in the command line, or None if it is not a worker.'''
+    if '--worker' in argv:
+        return int(argv[argv.index('--worker') + 1])
+    return None
+
+
+
+def worker_configuration(configuration, index):
+    '''Returns a copy of the configuration for the worker: clientId, shard, files and metrics port of its own.'''
+    result = dict(configuration)
+    result['client_tws'] = int(configuration['client_tws']) + index
+    if result['client_tws'] > MAX_CLIENT_ID:
+        raise ValueError(f'The clientId {result["client_tws"]} of the worker {index} does not fit in the order identifiers.')
+    result['shard_index'] = index
+    result['shard_count'] = int(configuration.get('workers', 1))
+    for key in PER_WORKER_FILES:
+        if configuration.get(key):
+            name, extension = os.path.splitext(configuration[key])
+            result[key] = f'{name}_{index}{extension}'
+    if configuration.get('metrics_port'):
+        result['metrics_port'] = int(configuration['metrics_port']) + 1 + index
+    if not configuration.get('risk_ledger_address'):
+        result['risk_ledger_address'] = DEFAULT_ADDRESS     # Sin el libro cada worker aplicaria los limites por su cuenta.
+    result['console_mode'] = 'log'      # La consola es compartida con el supervisor.
+    return result
+
+
+
+class ShardSupervisor:
+
+    def __init__(self, configuration, script, python=None):
+        '''
+        configuration: Configuration of the bot. "workers" is the number of processes.
+        script: Path of main.py, that is started with "--worker i".
+        python: Python interpreter. By default the current one.
+        '''
+        self.configuration = configuration
+        self.script = script
+        self.python = python or sys.executable
+        self.workers = int(configuration.get('workers', 1))
+        self.restartSeconds = configuration.get('worker_restart_seconds', 10)
+        self.statusSeconds = configuration.get('supervisor_status_seconds', 30)
+        self.statusFile = configuration.get('supervisor_status_file', '')
+        self.processes = [None] * self.workers
+        self.restartAt = [0.0] * self.workers
+        self.restarts = [0] * self.workers
+        self.running = False
+        self.ledgerServer = None
+        self.log = logging.getLogger('grid')
+        worker_configuration(configuration, self.workers - 1)     # Comprueba que los clientId caben antes de arrancar.
+
+
+
+    def run(self):
+        '''Starts the workers and watches them until the supervisor is interrupted.'''
+        self.running = True
+        self.log.info(f'Supervisor started with {self.workers} workers.')
+        if not ledger_authkey(self.configuration):
+            os.environ[AUTHKEY_VARIABLE] = secrets.token_hex(16)    # Los workers la heredan con el entorno.
+        # El libro de riesgo se sirve desde el supervisor para que sobreviva a los workers.
+        self.ledgerServer = RiskLedgerServer(
+            worker_configuration(self.configuration, 0)['risk_ledger_address'],
+            RiskLedger(self.configuration.get('risk_ledger_reservation_seconds', 60)),
+            ledger_authkey(self.configuration)
+        )
+        self.ledgerServer.start()
+        for index in range(self.workers):
+            self.start_worker(index)
+        nextStatus = time.time() + self.statusSeconds
+        try:
+            while self.running:
+                self.check_workers()
+                if time.time() >= nextStatus:
+                    self.report_status()
+                    nextStatus = time.time() + self.statusSeconds
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.log.info('Supervisor interrupted.')
+        finally:
+            self.stop()
+
+
+
+    def start_worker(self, index):
+        self.processes[index] = subprocess.Popen([self.python, self.script, '--worker', str(index)])
+        self.log.info(f'Worker {index} started with pid {self.processes[index].pid} and clientId {int(self.configuration["client_tws"]) + index}.')
+
+
+
+    def check_workers(self):
+        '''Restarts the workers that have finished, restartSeconds after they finished.'''
+        now = time.time()
+        for index, process in enumerate(self.processes):
+            if process is None or process.poll() is None:
+                continue
+            if self.restartAt[index] == 0:
+                self.restartAt[index] = now + self.restartSeconds
+                self.log.error(f'Worker {index} finished with code {process.returncode}. It is restarted in {self.restartSeconds} seconds.')
+            elif now >= self.restartAt[index]:
+                self.restartAt[index] = 0
+                self.restarts[index] += 1
+                self.start_worker(index)
+
+
+
+    def combined_status(self):
+        '''
+        Reads the status segment of every worker.
+        return: Dictionary with the rows of the workers and the totals of all of them.
+        '''
+        rows = []
+        for index in range(self.workers):
+            process = self.processes[index]
+            row = {"worker": index, "alive": process is not None and process.poll() is None, "restarts": self.restarts[index]}
+            fileName = worker_configuration(self.configuration, index).get('status_file')
+            if fileName and os.path.exists(fileName):
+                try:
+                    reader = StatusReader(fileName)
+                    try:
+                        row.update(reader.read() or {})
+                    finally:
+                        reader.close()
+                except Exception as e:
+                    self.log.debug(f'Unable to read the status of the worker {index}: {str(e)}')
+            rows.append(row)
+        totals = {name: sum(row.get(name, 0) for row in rows) for name in TOTAL_FIELDS}
+        totals['workersAlive'] = sum(1 for row in rows if row['alive'])
+        totals['workersConnected'] = sum(1 for row in rows if row.get('connected'))
+        totals['riskGlobal'] = max((row.get('riskGlobal', 0) for row in rows), default=0)
+        status = {"time": time.time(), "workers": rows, "totals": totals}
+        if self.ledgerServer is not None:
+            status['riskLedger'] = self.ledgerServer.handle('exposure', ())
+        return status
+
+
+
+    def report_status(self):
+        '''Writes the combined status in the log and in the status file of the supervisor.'''
+        status = self.combined_status()
+        totals = status['totals']
+        self.log.info(
+            f"Workers alive {totals['workersAlive']}/{self.workers}, connected {totals['workersConnected']}, "
+            f"strategies {totals['strategies']}, open orders {totals['openOrders']}, fills {totals['fills']}"
+        )
+        if self.statusFile:
+            try:
+                temporal = self.statusFile + '.tmp'
+                with open(temporal, 'w') as file:
+                    json.dump(status, file, indent=2)
+                os.replace(temporal, self.statusFile)
+            except Exception as e:
+                self.log.exception(f'Unable to write the supervisor status {self.statusFile}: {str(e)}')
+        return status
+
+
+
+    def stop(self):
+        '''Stops the workers and waits for them to finish.'''
+        self.running = False
+        for process in self.processes:
+            if process is not None and process.poll() is None:
+                process.terminate()
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.log.error(f'Worker {index} did not stop. It is killed.')
+                process.kill()
+        if self.ledgerServer is not None:
+            self.ledgerServer.stop()
@@ -0,0 +1,449 @@
+
+'''
+Broker Simulado
+
+Sustituye dentro del mismo proceso las llamadas a TWS que usa Core (placeOrder, cancelOrder,
+openTrades, openOrders, portfolio, qualifyContracts, reqHistoricalData...) por un motor de
+casamiento simple guiado por precios. Emite los mismos eventos de ib_insync (execDetailsEvent,
+orderStatusEvent, disconnectedEvent) con objetos Trade, Fill y Execution reales, de manera que
+las rutas de órdenes, riesgo y reacciones de Core se pueden probar sin red. Como en TWS, la
+ejecución (execDetails) llega con la orden todavía abierta y el estado Filled llega después.
+
+Las órdenes límite se guardan en dos montículos por contrato (compras y ventas). Cada vez que
+cambia el precio de un contrato se ejecutan, al precio límite, todas las compras con precio
+mayor o igual y todas las ventas con precio menor o igual. Las órdenes que se ponen dentro de
+un evento de ejecución (las reacciones) también se casan en la misma pasada.
+
+Uso para pruebas de carga:
+    python simulated_broker.py --strategies 200 --contracts 20 --levels 10 --ticks 2000
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from datetime import datetime, timezone
+from ib_insync import IB, Stock, Trade, OrderStatus, Fill, Execution, CommissionReport, PortfolioItem, Position, BarData, TradeLogEntry
+import argparse
+import heapq
+import itertools
+import logging
+import random
+import time
+
+ACCOUNT = 'SIMULATED'
+
+
+class SimulatedBroker:
+    '''
+    Mixin that replaces the TWS requests of ib_insync.IB with an in-process matching engine.
+    It must be placed before IB (or Core) in the bases of the class.
+    '''
+
+    def init_simulation(self, prices=None):
+        '''
+        Prepares the state of the simulated broker.
+        prices: Optional dictionary conId: initial price.
+        '''
+        self.simulatedConnected = False
+        self.simulatedClientId = 0
+        self.simulatedPrices = dict(prices or {})
+        self.simulatedContracts = {}        # conId: contract
+        self.simulatedConIds = {}           # Clave del contrato: conId
+        self.simulatedTrades = {}           # orderId: trade, todas las ordenes.
+        self.simulatedOpen = {}             # orderId: trade, solo las ordenes vivas.
+        self.simulatedBooks = {}            # conId: {"BUY": heap, "SELL": heap}
+        self.simulatedVersions = {}         # orderId: version de la entrada valida en el monticulo.
+        self.simulatedPositions = {}        # conId: {"position", "averageCost", "realized"}
+        self.simulatedFills = {}            # execId: fill
+        self.simulatedSequence = itertools.count(1)
+        self.simulatedOrderIds = itertools.count(1)
+        self.simulatedMatching = False
+        self.simulatedPending = set()       # Contratos que falta casar.
+
+
+
+    def connect(self, host='127.0.0.1', port=7497, clientId=1, timeout=4, readonly=False, account=''):
+        self.simulatedConnected = True
+        self.simulatedClientId = clientId
+        self.connectedEvent.emit()
+        return self
+
+
+
+    def disconnect(self):
+        if self.simulatedConnected:
+            self.simulatedConnected = False
+            self.disconnectedEvent.emit()
+
+
+
+    def isConnected(self):
+        return self.simulatedConnected
+
+
+
+    def qualifyContracts(self, *contracts):
+        for contract in contracts:
+            key = (contract.secType, contract.symbol, contract.lastTradeDateOrContractMonth, contract.localSymbol, contract.exchange, contract.currency)
+            if key not in self.simulatedConIds:
+                self.simulatedConIds[key] = 1000 + len(self.simulatedConIds)
+            contract.conId = self.simulatedConIds[key]
+            if not contract.localSymbol:
+                contract.localSymbol = contract.symbol
+            self.simulatedContracts[contract.conId] = contract
+        return list(contracts)
+
+
+
+    def reqHistoricalData(self, contract, endDateTime='', durationStr='1 D', barSizeSetting='1 day', whatToShow='TRADES', useRTH=False, *args, **kwargs):
+        '''Returns a single bar with the current simulated price of the contract.'''
+        price = self.simulatedPrices.get(contract.conId)
+        if price is None:
+            return []
+        return [BarData(date=self._simulated_now(), open=price, high=price, low=price, close=price)]
+
+
+
+    def reqMarketDataType(self, marketDataType):
+        pass
+
+
+
+    def placeOrder(self, contract, order):
+        '''Places or modifies a limit order. Marketable orders are filled at once.'''
+        if order.orderId and order.orderId in self.simulatedOpen:
+            trade = self.simulatedOpen[order.orderId]       # Modificacion de una orden viva.
+            if trade.remaining() <= 0:
+                # Como TWS, rechaza modificar una orden ya ejecutada aunque su estado Filled no haya llegado.
+                self.errorEvent.emit(order.orderId, 104, 'Cannot modify a filled order.', contract)
+                return trade
+            trade.order.lmtPrice = order.lmtPrice
+            trade.order.totalQuantity = order.totalQuantity
+            trade.orderStatus.remaining = order.totalQuantity - trade.orderStatus.filled
+        else:
+            if not order.orderId:
+                order.orderId = next(self.simulatedOrderIds)
+            order.permId = order.orderId
+            order.clientId = self.simulatedClientId
+            trade = Trade(contract, order, OrderStatus(orderId=order.orderId, status='Submitted', remaining=order.totalQuantity))
+            self.simulatedTrades[order.orderId] = trade
+            self.simulatedOpen[order.orderId] = trade
+        trade.log.append(TradeLogEntry(self._simulated_now(), trade.orderStatus.status, ''))
+        version = next(self.simulatedSequence)
+        self.simulatedVersions[order.orderId] = version
+        book = self.simulatedBooks.setdefault(contract.conId, {"BUY": [], "SELL": []})
+        key = -order.lmtPrice if order.action == 'BUY' else order.lmtPrice
+        heapq.heappush(book[order.action], (key, version, order.orderId))
+        self.orderStatusEvent.emit(trade)
+        self._match(contract.conId)
+        return trade
+
+
+
+    def cancelOrder(self, order, manualCancelOrderTime=''):
+        trade = self.simulatedOpen.pop(order.orderId, None)
+        if trade is None:
+            return None
+        self.simulatedVersions.pop(order.orderId, None)     # Su entrada en el monticulo queda invalidada.
+        trade.orderStatus.status = 'Cancelled'
+        trade.log.append(TradeLogEntry(self._simulated_now(), 'Cancelled', ''))
+        self.orderStatusEvent.emit(trade)
+        trade.cancelledEvent.emit(trade)
+        return trade
+
+
+
+    def openTrades(self):
+        return list(self.simulatedOpen.values())
+
+
+
+    def openOrders(self):
+        return [trade.order for trade in self.simulatedOpen.values()]
+
+
+
+    def reqAllOpenOrders(self):
+        return self.openOrders()
+
+
+
+    def trades(self):
+        return list(self.simulatedTrades.values())
+
+
+
+    def fills(self):
+        return list(self.simulatedFills.values())
+
+
+
+    def positions(self, account=''):
+        return [
+            Position(ACCOUNT, self.simulatedContracts[conId], data['position'], data['averageCost'])
+            for conId, data in self.simulatedPositions.items() if data['position'] != 0
+        ]
+
+
+
+    def portfolio(self, account=''):
+        result = []
+        for conId, data in self.simulatedPositions.items():
+            if data['position'] == 0:
+                continue
+            contract = self.simulatedContracts[conId]
+            multiplier = float(contract.multiplier) if contract.multiplier else 1.0
+            price = self.simulatedPrices.get(conId, data['averageCost'])
+            marketValue = data['position'] * price * multiplier
+            result.append(PortfolioItem(
+                contract, data['position'], price, marketValue, data['averageCost'] * multiplier,
+                marketValue - data['position'] * data['averageCost'] * multiplier, data['realized'], ACCOUNT
+            ))
+        return result
+
+
+
+    def set_price(self, contract, price):
+        '''Sets the price of the contract and fills the orders that it crosses.'''
+        conId = contract if isinstance(contract, int) else contract.conId
+        self.simulatedPrices[conId] = price
+        self._match(conId)
+
+
+
+    def _simulated_now(self):
+        '''Returns the UTC time of the clock of Core if there is one, so that the fills follow a virtual clock.'''
+        clock = getattr(self, 'clock', None)
+        return datetime.fromtimestamp(clock.time() if clock is not None else time.time(), timezone.utc)
+
+
+
+    def _match(self, conId):
+        '''Fills every live order of the contract crossed by its price, including the ones placed while filling.'''
+        self.simulatedPending.add(conId)
+        if self.simulatedMatching:
+            return      # Es una orden puesta dentro de un evento de ejecucion, la casa el bucle en curso.
+        self.simulatedMatching = True
+        try:
+            while self.simulatedPending:
+                conId = self.simulatedPending.pop()
+                price = self.simulatedPrices.get(conId)
+                book = self.simulatedBooks.get(conId)
+                if price is None or book is None:
+                    continue
+                while True:
+                    orderId = self._pop_crossed(book['BUY'], lambda key: -key >= price) or self._pop_crossed(book['SELL'], lambda key: key <= price)
+                    if orderId is None:
+                        break
+                    self._fill(self.simulatedOpen[orderId])
+        finally:
+            self.simulatedMatching = False
+
+
+
+    def _pop_crossed(self, heap, crossed):
+        '''Removes the stale entries from the top of the heap and pops the best order if the price crosses it.'''
+        while heap:
+            key, version, orderId = heap[0]
+            if self.simulatedVersions.get(orderId) != version:
+                heapq.heappop(heap)
+                continue
+            if not crossed(key):
+                return None
+            heapq.heappop(heap)
+            self.simulatedVersions.pop(orderId, None)
+            return orderId
+        return None
+
+
+
+    def _fill(self, trade):
+        '''Fills the whole remaining quantity of the trade at its limit price and emits the events.'''
+        order = trade.order
+        now = self._simulated_now()
+        quantity = order.totalQuantity - trade.orderStatus.filled
+        price = order.lmtPrice
+        execution = Execution(
+            execId=f'{order.orderId}.{len(trade.fills) + 1}', time=now, acctNumber=ACCOUNT, exchange=trade.contract.exchange,
+            side='BOT' if order.action == 'BUY' else 'SLD', shares=quantity, price=price, permId=order.permId,
+            clientId=order.clientId, orderId=order.orderId, cumQty=order.totalQuantity, avgPrice=price, orderRef=order.orderRef
+        )
+        fill = Fill(trade.contract, execution, CommissionReport(execId=execution.execId), now)
+        trade.fills.append(fill)
+        self.simulatedFills[execution.execId] = fill
+        trade.log.append(TradeLogEntry(now, trade.orderStatus.status, f'Fill {quantity}@{price}'))
+        self._update_position(trade.contract.conId, quantity if order.action == 'BUY' else -quantity, price)
+        # Como en TWS e ib_insync, la ejecucion llega mientras la orden sigue abierta con su estado anterior
+        # y el estado Filled llega despues.
+        self.execDetailsEvent.emit(trade, fill)
+        trade.fillEvent.emit(trade, fill)
+        trade.orderStatus.status = 'Filled'
+        trade.orderStatus.filled = order.totalQuantity
+        trade.orderStatus.remaining = 0
+        trade.orderStatus.avgFillPrice = price
+        trade.orderStatus.lastFillPrice = price
+        trade.log.append(TradeLogEntry(now, 'Filled', ''))
+        self.simulatedOpen.pop(order.orderId, None)
+        self.simulatedVersions.pop(order.orderId, None)     # Por si se volvio a poner durante el evento.
+        self.orderStatusEvent.emit(trade)
+        trade.filledEvent.emit(trade)
+
+
+
+    def _update_position(self, conId, quantity, price):
+        data = self.simulatedPositions.setdefault(conId, {"position": 0, "averageCost": 0.0, "realized": 0.0})
+        position = data['position']
+        if position == 0 or (position > 0) == (quantity > 0):
+            data['averageCost'] = (data['averageCost'] * abs(position) + price * abs(quantity)) / abs(position + quantity)
+        else:
+            closed = min(abs(quantity), abs(position))
+            data['realized'] += closed * (price - data['averageCost']) * (1 if position > 0 else -1)
+            if abs(quantity) > abs(position):
+                data['averageCost'] = price
+        data['position'] = position + quantity
+        if data['position'] == 0:
+            data['averageCost'] = 0.0
+
+
+
+class SimulatedIB(SimulatedBroker, IB):
+    '''ib_insync.IB connected to the simulated broker.'''
+
+    def __init__(self, prices=None):
+        IB.__init__(self)
+        self.init_simulation(prices)
+
+
+
+class NullDashboard:
+    '''Dashboard that does nothing, so that the load tests do not write in Google Sheets.'''
+
+    def update_dashboard(self, *args, **kwargs):
+        pass
+
+    def update_risk(self, *args, **kwargs):
+        pass
+
+    def load_fill(self, *args, **kwargs):
+        pass
+
+
+
+def create_simulated_core(configuration, prices=None, clock=None):
+    '''
+    Returns a Core whose broker is the simulated broker. The dashboard does nothing.
+    clock: Clock of Core, for example a clock.VirtualClock to simulate days in seconds. By default the system clock.
+    '''
+    from core import Core
+
+    class SimulatedCore(SimulatedBroker, Core):
+
+        def __init__(self, configuration, prices=None, clock=None):
+            Core.__init__(self, configuration, clock)
+            self.init_simulation(prices)
+            self.dashBoard = NullDashboard()
+            self.execDetailsEvent += self.onExecDetailsEvent
+
+    return SimulatedCore(configuration, prices, clock)
+
+
+
+def make_strategies(core, count, contractsCount, levels, step=0.1, price=100.0, orderQty=1):
+    '''Creates count strategies in the format of MultiParameters over contractsCount simulated stocks.'''
+    strategies = []
+    for number in range(count):
+        contract = Stock(f'SIM{number % contractsCount}', 'SMART', 'USD')
+        core.qualifyContracts(contract)
+        core.simulatedPrices.setdefault(contract.conId, price)
+        strategies.append({
+            "strategyId": number + 1, "strategyType": 'grid', "active": True, "action": 'NEW', "mode": 'STOCK',
+            "symbol": contract.symbol, "exchange": 'SMART', "currency": 'USD', "contract": contract, "contractId": contract.conId,
+            "initialPrice": price, "step": step, "buyOrders": levels, "sellOrders": levels, "orderQty": orderQty,
+            "maxLongRisk": 0, "maxShortRisk": 0, "outsideRth": True, "confirmed": None,
+            "market": BarData(close=price)
+        })
+    return strategies
+
+
+
+def run_load_test(core, strategies, ticks, volatility=0.05, seed=1):
+    '''
+    Posts the grid of every strategy and moves the prices of the contracts with a random walk.
+    return: Dictionary with the throughput of the posting and the fills and reactions measured.
+    '''
+    log = logging.getLogger('grid')
+    core.parameters.strategies = strategies
+    timeBegin = time.perf_counter()
+    for strategy in strategies:
+        core.post_grid_orders(strategy, verbose=False)
+    postSeconds = time.perf_counter() - timeBegin
+    posted = len(core.openTrades())
+    random.seed(seed)
+    conIds = sorted(set(strategy['contractId'] for strategy in strategies))
+    fillsBefore = len(core.simulatedFills)
+    latencies = []
+    timeBegin = time.perf_counter()
+    for tick in range(ticks):
+        for conId in conIds:
+            price = core.simulatedPrices[conId] + random.gauss(0, volatility)
+            tickBegin = time.perf_counter()
+            core.set_price(conId, price)
+            latencies.append(time.perf_counter() - tickBegin)
+        core.sleep(0)       # Deja correr las tareas del bucle de eventos, como el regulador de mensajes.
+    tickSeconds = time.perf_counter() - timeBegin
+    latencies.sort()
+    fills = len(core.simulatedFills) - fillsBefore
+    result = {
+        "strategies": len(strategies),
+        "contracts": len(conIds),
+        "ordersPosted": posted,
+        "postSeconds": postSeconds,
+        "ordersPerSecond": posted / postSeconds if postSeconds > 0 else 0,
+        "priceUpdates": len(latencies),
+        "fills": fills,
+        "fillsPerSecond": fills / tickSeconds if tickSeconds > 0 else 0,
+        "updateLatencyP50": latencies[len(latencies) // 2] if latencies else 0,
+        "updateLatencyP99": latencies[int(len(latencies) * 0.99)] if latencies else 0,
+        "openOrders": len(core.openTrades())
+    }
+    log.info(f'Load test: {result}')
+    return result
+
+
+
+LOAD_TEST_CONFIGURATION = {
+    'client_tws': 1,
+    'api_messages_per_second': 1000000,     # Sin limite de mensajes: no hay TWS al otro lado.
+    'api_messages_burst': 1000000,
+    'actualize_status_seconds': 5,
+    'debug_mode': False,
+    'google_sheets_document_id': '',
+    'google_sheets_credentials': '',
+    'dashboard_realtime_level': 0,
+    'telegram_level': 0,
+    'botTimeZone': 'Europe/Berlin',
+    'strategy_confirmation_max_age_seconds': 60,
+    'relaunch_if_market_closed': False,
+    'marquet_data_delayed_but_free': True,
+    'snapshot_file': './state/load_test_snapshot.pickle',
+    'status_file': '',
+    'profile_targets': [],
+}
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of Core against the simulated broker.')
+    parser.add_argument('--strategies', type=int, default=200)
+    parser.add_argument('--contracts', type=int, default=20)
+    parser.add_argument('--levels', type=int, default=10, help='Buy and sell orders of each grid.')
+    parser.add_argument('--ticks', type=int, default=2000, help='Price updates of each contract.')
+    parser.add_argument('--volatility', type=float, default=0.05)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    core = create_simulated_core(LOAD_TEST_CONFIGURATION)
+    core.connect(clientId=LOAD_TEST_CONFIGURATION['client_tws'])
+    strategies = make_strategies(core, args.strategies, args.contracts, args.levels)
+    result = run_load_test(core, strategies, args.ticks, args.volatility)
+    for name, value in result.items():
+        print(f'{name:>18}: {value}')
@@ -0,0 +1,106 @@
+
+'''
+Instantánea del Estado
+
+Guarda en un fichero local el estado del bot (estrategias con sus acciones, contratos ya
+calificados, últimos precios y registro de órdenes abiertas) para poder arrancar en caliente.
+Al cargarla, Core contrasta las órdenes guardadas con las abiertas en el broker.
+La escritura es atómica: se escribe un fichero temporal y luego se reemplaza el anterior,
+de manera que nunca queda una instantánea a medio escribir.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from clock import RealClock
+import logging
+import os
+import pickle
+import time
+
+SNAPSHOT_VERSION = 1
+
+
+class StateSnapshot:
+
+    def __init__(self, fileName, maxAgeSeconds=86400, clock=None):
+        '''
+        fileName: Path of the snapshot file.
+        maxAgeSeconds: Snapshots older than this are ignored when loading.
+        clock: Clock that dates the snapshots and measures their age. By default, the clock of the system.
+        '''
+        self.fileName = fileName
+        self.maxAgeSeconds = maxAgeSeconds
+        self.clock = clock if clock is not None else RealClock()
+        self.log = logging.getLogger('grid')
+
+
+
+    def save(self, core):
+        '''
+        Writes the current state of the core atomically.
+        return: True if the snapshot was written. False if an error occurs.
+        '''
+        try:
+            timeBegin = time.time()
+            state = {
+                "version": SNAPSHOT_VERSION,
+                "savedAt": self.clock.time(),
+                "clientId": core.configuration['client_tws'],
+                "strategies": core.parameters.strategies,
+                "noFilteredStrategies": core.parameters.noFilteredStrategies,
+                "orders": [
+                    {
+                        "orderRef": trade.order.orderRef,
+                        "orderId": trade.order.orderId,
+                        "conId": trade.contract.conId,
+                        "action": trade.order.action,
+                        "lmtPrice": trade.order.lmtPrice,
+                        "totalQuantity": trade.order.totalQuantity
+                    }
+                    for trade in core.openTrades() if core.orderIdManager.is_order_child_of_client(trade.order.orderRef)
+                ]
+            }
+            folder = os.path.dirname(self.fileName)
+            if folder != '' and not os.path.exists(folder):
+                os.makedirs(folder)
+            temporalFileName = self.fileName + '.tmp'
+            with open(temporalFileName, 'wb') as file:
+                pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporalFileName, self.fileName)
+            self.log.debug(f'Snapshot saved in {round(time.time() - timeBegin, 3)} seconds')
+            return True
+        except Exception as e:
+            self.log.exception(f'Error saving the snapshot {self.fileName}: {str(e)}')
+            return False
+
+
+
+    def load(self, clientId):
+        '''
+        Reads the snapshot file.
+        clientId: The snapshot is only accepted if it was written by the same client.
+        return: The state dictionary, or None if it does not exist, is too old or is not valid.
+        '''
+        if not os.path.exists(self.fileName):
+            self.log.info(f'There is no snapshot {self.fileName}')
+            return None
+        try:
+            with open(self.fileName, 'rb') as file:
+                state = pickle.load(file)
+            if state.get("version") != SNAPSHOT_VERSION:
+                self.log.warning(f'Snapshot {self.fileName} ignored because its version is not supported.')
+                return None
+            if state.get("clientId") != clientId:
+                self.log.warning(f'Snapshot {self.fileName} ignored because it belongs to client {state.get("clientId")}.')
+                return None
+            age = self.clock.time() - state["savedAt"]
+            if age > self.maxAgeSeconds:
+                self.log.warning(f'Snapshot {self.fileName} ignored because it is {round(age)} seconds old.')
+                return None
+            return state
+        except Exception as e:
+            self.log.exception(f'Error loading the snapshot {self.fileName}: {str(e)}')
+            return None
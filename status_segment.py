@@ -0,0 +1,203 @@
+
+'''
+Segmento de Estado Compartido
+
+Bloque de estado con formato fijo publicado en un fichero mapeado en memoria, para que los
+supervisores externos puedan consultarlo con mucha frecuencia sin costo para el bot.
+Contiene el latido, el estado de la conexión, contadores, totales de órdenes abiertas,
+uso de cada límite de riesgo y el último código de error. El bot lo actualiza en el sitio
+con struct.pack_into, sin crear objetos nuevos ni reescribir el fichero.
+
+Para que el lector nunca vea un bloque a medio escribir se usa un contador de secuencia:
+es impar mientras se escribe y par cuando el bloque está completo.
+
+Uso desde la línea de comandos:
+    python status_segment.py [--file ./state/status.bin] [--interval 1] [--json]
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b'GRID'
+LAYOUT_VERSION = 1
+
+# Nombre y formato de cada campo, en el orden en que están en el bloque.
+FIELDS = [
+    ('pid', 'I'),
+    ('clientId', 'I'),
+    ('startedAt', 'd'),             # Hora de arranque (epoch).
+    ('heartbeat', 'd'),             # Hora de la última publicación (epoch).
+    ('lastStatusCycle', 'd'),       # Hora del último ciclo de estado completo (epoch).
+    ('connected', 'I'),
+    ('strategies', 'I'),
+    ('openOrders', 'I'),
+    ('openBuyOrders', 'I'),
+    ('openSellOrders', 'I'),
+    ('queuedMessages', 'I'),
+    ('ordersPosted', 'Q'),
+    ('ordersRejected', 'Q'),
+    ('fills', 'Q'),
+    ('loopLagSeconds', 'd'),
+    ('riskOrder', 'd'),             # Uso del límite por orden (0 a 1).
+    ('riskContract', 'd'),          # Uso del límite por contrato del contrato más cargado (0 a 1).
+    ('riskGlobal', 'd'),            # Uso del límite global (0 a 1).
+    ('lastErrorCode', 'i'),
+    ('lastErrorTime', 'd'),
+]
+FIELD_NAMES = [name for name, code in FIELDS]
+FIELD_INDEX = {name: index for index, name in enumerate(FIELD_NAMES)}
+HEADER = struct.Struct('<4sHHQ')    # magic, version, reserved, sequence
+BODY = struct.Struct('<' + ''.join(code for name, code in FIELDS))
+SEQUENCE_OFFSET = 8
+SIZE = HEADER.size + BODY.size
+SEQUENCE = struct.Struct('<Q')
+ERROR = struct.Struct('<id')
+ERROR_OFFSET = HEADER.size + struct.calcsize('<' + ''.join(code for name, code in FIELDS[:FIELD_INDEX['lastErrorCode']]))
+
+
+class StatusSegment:
+    '''Writer of the status block. It is used only by the bot.'''
+
+    def __init__(self, fileName, clientId):
+        '''
+        fileName: Path of the memory mapped file.
+        clientId: Client number of the bot that publishes the status.
+        '''
+        self.fileName = fileName
+        folder = os.path.dirname(fileName)
+        if folder != '' and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(fileName, 'wb') as file:
+            file.write(b'\x00' * SIZE)
+        self.file = open(fileName, 'r+b')
+        self.buffer = mmap.mmap(self.file.fileno(), SIZE)
+        self.sequence = 0
+        self.values = [0] * len(FIELDS)
+        self.values[FIELD_INDEX['pid']] = os.getpid()
+        self.values[FIELD_INDEX['clientId']] = clientId
+        self.values[FIELD_INDEX['startedAt']] = time.time()
+        HEADER.pack_into(self.buffer, 0, MAGIC, LAYOUT_VERSION, 0, self.sequence)
+        self._write()
+
+
+
+    def publish(self, **values):
+        '''Updates the given fields and writes the whole block. The heartbeat is set to the current time.'''
+        for name, value in values.items():
+            self.values[FIELD_INDEX[name]] = value
+        self.values[FIELD_INDEX['heartbeat']] = time.time()
+        self._write()
+
+
+
+    def set_error(self, code):
+        '''Writes only the last error code and its time.'''
+        self.values[FIELD_INDEX['lastErrorCode']] = code
+        self.values[FIELD_INDEX['lastErrorTime']] = time.time()
+        self._begin()
+        ERROR.pack_into(self.buffer, ERROR_OFFSET, code, self.values[FIELD_INDEX['lastErrorTime']])
+        self._end()
+
+
+
+    def close(self):
+        try:
+            self.buffer.close()
+            self.file.close()
+        except Exception:
+            pass
+
+
+
+    def _write(self):
+        self._begin()
+        BODY.pack_into(self.buffer, HEADER.size, *self.values)
+        self._end()
+
+
+
+    def _begin(self):
+        self.sequence += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+
+
+
+    def _end(self):
+        self.sequence += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+
+
+
+class StatusReader:
+    '''Reader of the status block for external monitors.'''
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.file = open(fileName, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), SIZE, access=mmap.ACCESS_READ)
+
+
+
+    def read(self, retries=100):
+        '''
+        Returns a dictionary with a consistent copy of the status block.
+        If the bot is writing, it retries until the block is complete. Returns None if it is not a status block.
+        '''
+        for _ in range(retries):
+            magic, version, reserved, sequence = HEADER.unpack_from(self.buffer, 0)
+            if magic != MAGIC or version != LAYOUT_VERSION:
+                return None
+            if sequence % 2 == 1:
+                continue
+            values = BODY.unpack_from(self.buffer, HEADER.size)
+            if SEQUENCE.unpack_from(self.buffer, SEQUENCE_OFFSET)[0] == sequence:
+                data = dict(zip(FIELD_NAMES, values))
+                data['heartbeatAgeSeconds'] = time.time() - data['heartbeat']
+                return data
+        return None
+
+
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shows the status block published by the Grid Bot.')
+    parser.add_argument('--file', default='./state/status.bin', help='Path of the status file.')
+    parser.add_argument('--interval', type=float, default=0, help='Seconds between readings. 0 to read only once.')
+    parser.add_argument('--json', action='store_true', help='Writes each reading as one JSON line.')
+    args = parser.parse_args()
+    reader = StatusReader(args.file)
+    try:
+        while True:
+            data = reader.read()
+            if data is None:
+                print('The status block cannot be read.')
+            elif args.json:
+                print(json.dumps(data), flush=True)
+            else:
+                for name, value in data.items():
+                    print(f'{name:>20}: {value}')
+                print(flush=True)
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+
+'''
+Grabador de Ticks
+
+Guarda los precios que recibe el bot de los contratos que operan las estrategias activas, para
+ajustar los grids con la microestructura real del mercado y medir el deslizamiento (slippage).
+
+ - Se suscribe con reqMktData a cada conId de las estrategias activas que no están dormidas y
+   cancela las suscripciones de los contratos que ya no se operan o cuyo mercado está cerrado.
+ - Cada actualización de un ticker se guarda como un registro de tamaño fijo (TICK_DTYPE): hora,
+   bid, ask, last y sus tamaños.
+ - Hay un fichero por contrato y por día (UTC): <carpeta>/<AAAAMMDD>/<conId>.ticks. Los ficheros solo
+   crecen por el final.
+ - Los registros se acumulan en memoria y se escriben en bloque cuando se llena el buffer o
+   cada flushSeconds segundos.
+ - read_ticks() abre un fichero como arreglo de NumPy con np.memmap, sin copiarlo, para el
+   backtester y el análisis de deslizamiento.
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from datetime import datetime, timezone
+import numpy as np
+import glob
+import logging
+import math
+import os
+import time
+
+TICK_DTYPE = np.dtype([
+    ('time', '<f8'),        # Hora del tick (epoch UTC).
+    ('bid', '<f8'),
+    ('ask', '<f8'),
+    ('last', '<f8'),
+    ('bidSize', '<f8'),
+    ('askSize', '<f8'),
+    ('lastSize', '<f8'),
+])
+MARKET_DATA_LIVE = 1
+MARKET_DATA_DELAYED = 3
+
+
+class TickRecorder:
+
+    def __init__(self, folder='./ticks', bufferTicks=4096, flushSeconds=1.0, free=False):
+        '''
+        folder: Folder of the tick files.
+        bufferTicks: Ticks of a contract kept in memory before they are written.
+        flushSeconds: Maximum seconds that a tick waits in memory.
+        free: True to subscribe to the delayed and free market data.
+        '''
+        self.folder = folder
+        self.bufferTicks = bufferTicks
+        self.flushSeconds = flushSeconds
+        self.free = free
+        self.ib = None
+        self.subscriptions = {}     # conId -> contract suscrito.
+        self.buffers = {}           # conId -> arreglo de TICK_DTYPE de tamaño bufferTicks.
+        self.counts = {}            # conId -> cantidad de ticks en el buffer.
+        self.lastFlush = time.monotonic()
+        self.recorded = 0
+        self.log = logging.getLogger('grid')
+
+
+
+    def attach(self, ib):
+        '''Starts receiving the ticker updates of ib.'''
+        self.ib = ib
+        ib.pendingTickersEvent += self.onPendingTickers
+        ib.disconnectedEvent += self.onDisconnected
+
+
+
+    def subscribe(self, contracts):
+        '''
+        Keeps subscribed exactly the given contracts.
+        contracts: Qualified contracts of the active strategies. Repeated conIds are subscribed once.
+        '''
+        wanted = {contract.conId: contract for contract in contracts if contract is not None and contract.conId}
+        for conId in [conId for conId in self.subscriptions if conId not in wanted]:
+            self.ib.cancelMktData(self.subscriptions.pop(conId))
+            self._flush_contract(conId)
+            self.log.info(f'Tick recorder: unsubscribed {conId}')
+        added = [contract for conId, contract in wanted.items() if conId not in self.subscriptions]
+        if len(added) > 0:
+            self.ib.reqMarketDataType(MARKET_DATA_DELAYED if self.free else MARKET_DATA_LIVE)
+        for contract in added:
+            if hasattr(self.ib, 'wait_data_slot'):
+                self.ib.wait_data_slot()
+            self.ib.reqMktData(contract, '', False, False)
+            self.subscriptions[contract.conId] = contract
+            self.log.info(f'Tick recorder: subscribed {contract.symbol}({contract.conId})')
+
+
+
+    def onDisconnected(self):
+        '''The subscriptions are lost with the connection. They are requested again by the next subscribe().'''
+        self.flush()
+        self.subscriptions = {}
+
+
+
+    def onPendingTickers(self, tickers):
+        for ticker in tickers:
+            conId = ticker.contract.conId if ticker.contract is not None else None
+            if conId not in self.subscriptions:
+                continue
+            buffer = self.buffers.get(conId)
+            if buffer is None:
+                buffer = self.buffers[conId] = np.zeros(self.bufferTicks, dtype=TICK_DTYPE)
+                self.counts[conId] = 0
+            buffer[self.counts[conId]] = (
+                ticker.time.timestamp() if ticker.time is not None else time.time(),
+                ticker.bid, ticker.ask, ticker.last, ticker.bidSize, ticker.askSize, ticker.lastSize
+            )
+            self.counts[conId] += 1
+            if self.counts[conId] == self.bufferTicks:
+                self._flush_contract(conId)
+        if time.monotonic() - self.lastFlush >= self.flushSeconds:
+            self.flush()
+
+
+
+    def flush(self):
+        '''Writes the ticks of all the contracts that are in memory.'''
+        for conId in list(self.counts.keys()):
+            self._flush_contract(conId)
+        self.lastFlush = time.monotonic()
+
+
+
+    def close(self):
+        '''Writes the pending ticks and cancels the subscriptions.'''
+        if self.ib is None:
+            return
+        self.flush()
+        self.ib.pendingTickersEvent -= self.onPendingTickers
+        self.ib.disconnectedEvent -= self.onDisconnected
+        for contract in self.subscriptions.values():
+            try:
+                self.ib.cancelMktData(contract)
+            except Exception:
+                pass
+        self.subscriptions = {}
+        self.ib = None
+
+
+
+    def file_name(self, conId, day):
+        '''Returns the path of the file of the contract for the day (YYYYMMDD).'''
+        return os.path.join(self.folder, day, f'{conId}.ticks')
+
+
+
+    def _flush_contract(self, conId):
+        count = self.counts.get(conId, 0)
+        if count == 0:
+            return
+        records = self.buffers[conId][:count]
+        try:
+            # Los ticks de un buffer pueden pertenecer a dos dias si se cruza la medianoche UTC.
+            days = [datetime.fromtimestamp(value, timezone.utc).strftime('%Y%m%d') for value in (records['time'][0], records['time'][-1])]
+            for day in sorted(set(days)):
+                dayBegin = datetime.strptime(day, '%Y%m%d').replace(tzinfo=timezone.utc).timestamp()
+                selected = records[(records['time'] >= dayBegin) & (records['time'] < dayBegin + 86400)] if days[0] != days[1] else records
+                fileName = self.file_name(conId, day)
+                os.makedirs(os.path.dirname(fileName), exist_ok=True)
+                with open(fileName, 'ab') as file:
+                    file.write(selected.tobytes())
+            self.recorded += count
+        except Exception as e:
+            self.log.exception(f'Tick recorder: unable to write the ticks of {conId}: {str(e)}')
+        self.counts[conId] = 0
+
+
+
+def read_ticks(fileName):
+    '''Returns the ticks of a file as a read only array mapped on the file, without copying it.'''
+    size = os.path.getsize(fileName) if os.path.exists(fileName) else 0
+    count = size // TICK_DTYPE.itemsize      # Un registro a medio escribir se ignora.
+    if count == 0:
+        return np.zeros(0, dtype=TICK_DTYPE)
+    return np.memmap(fileName, dtype=TICK_DTYPE, mode='r', shape=(count,))
+
+
+
+def load_ticks(folder, conId, begin=None, end=None):
+    '''
+    Returns the ticks of a contract between the days begin and end (YYYYMMDD, both included).
+    A single day is returned mapped on its file. Several days are concatenated in memory.
+    '''
+    days = sorted(os.path.basename(os.path.dirname(name)) for name in glob.glob(os.path.join(folder, '*', f'{conId}.ticks')))
+    days = [day for day in days if (begin is None or day >= begin) and (end is None or day <= end)]
+    parts = [read_ticks(os.path.join(folder, day, f'{conId}.ticks')) for day in days]
+    if len(parts) == 1:
+        return parts[0]
+    return np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype=TICK_DTYPE)
+
+
+
+def trade_prices(ticks):
+    '''Returns the prices of the ticks for GridBacktester: last price, or the midpoint when there is no last.'''
+    midpoint = (ticks['bid'] + ticks['ask']) / 2
+    prices = np.where(np.isnan(ticks['last']), midpoint, ticks['last'])
+    return prices[~np.isnan(prices)]
+
+
+
+def slippage(ticks, side, price, times):
+    '''
+    Returns, for each execution, the difference between the execution price and the quote of the
+    opposite side at that moment. It is positive when the execution was worse than the quote.
+    side: "BUY" or "SELL".
+    price: Array of execution prices.
+    times: Array of execution times (epoch UTC).
+    '''
+    indexes = np.searchsorted(ticks['time'], np.asarray(times, dtype=np.float64), side='right') - 1
+    quotes = np.where(indexes >= 0, ticks['ask' if side == 'BUY' else 'bid'][np.maximum(indexes, 0)], math.nan)
+    difference = np.asarray(price, dtype=np.float64) - quotes
+    return difference if side == 'BUY' else -difference
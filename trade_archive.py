@@ -0,0 +1,155 @@
+
+'''
+Archivo de Operaciones
+
+ib_insync guarda en memoria todas las órdenes (Trade) y ejecuciones (Fill) de la sesión, así que
+un bot que corre semanas con órdenes de reacción constantes crece sin límite y openTrades() y
+fills() son cada vez más lentos, porque recorren todo lo guardado.
+
+ - Las órdenes terminadas (Filled, Cancelled, ApiCancelled, Inactive) que terminaron hace más de
+   maxAgeSeconds, o que exceden las maxCompleted más recientes, se graban en un fichero de archivo
+   y se quitan de la memoria, junto con sus ejecuciones. Las órdenes vivas nunca se tocan.
+ - Las ejecuciones sin orden en memoria (de otros clientes o de órdenes ya archivadas) se
+   archivan por su antigüedad.
+ - El archivo usa el formato del diario de eventos (event_journal): solo de añadido y con los
+   objetos de ib_insync compactos. Se lee con read_archive().
+
+Uso:
+    python trade_archive.py ./state/trades_archive.bin
+
+Creado: 19-10-2026
+'''
+__version__ = '1.0'
+
+from ib_insync import OrderStatus
+from event_journal import EventJournal, read_journal, ARCHIVED_TRADE, ARCHIVED_FILL
+import argparse
+import logging
+import time
+import metrics
+
+
+class TradeArchive:
+
+    def __init__(self, fileName, maxAgeSeconds=86400, maxCompleted=5000, maxMegabytes=512):
+        '''
+        fileName: Archive file. The records are appended to it.
+        maxAgeSeconds: Finished orders and fills older than this are archived.
+        maxCompleted: Maximum finished orders kept in memory. The oldest are archived first.
+        maxMegabytes: When the file is bigger, it is renamed with the suffix ".1" and a new one is started.
+        '''
+        self.fileName = fileName
+        self.maxAgeSeconds = maxAgeSeconds
+        self.maxCompleted = maxCompleted
+        self.journal = EventJournal(fileName, maxMegabytes)
+        self.archivedTrades = 0
+        self.archivedFills = 0
+        self.log = logging.getLogger('grid')
+
+
+
+    def prune(self, ib, now=None):
+        '''
+        Archives and removes from memory the finished orders and the fills out of the retention.
+        ib: Core, with the state of the wrapper of ib_insync or of the simulated broker.
+        now: Epoch time used to measure the age. By default the current time.
+        return: Tuple (archived trades, archived fills).
+        '''
+        now = time.time() if now is None else now
+        trades, permIds, fills = self.stores(ib)
+        finished = sorted(
+            ((self._finished_at(trade, now), key, trade) for key, trade in trades.items()
+             if trade.orderStatus.status in OrderStatus.DoneStates),
+            key=lambda item: item[0]
+        )
+        surplus = len(finished) - self.maxCompleted
+        tradeCount = fillCount = 0
+        for index, (finishedAt, key, trade) in enumerate(finished):
+            if index >= surplus and now - finishedAt <= self.maxAgeSeconds:
+                break       # Las siguientes terminaron despues y estan dentro de la retencion.
+            self.journal.record(ARCHIVED_TRADE, trade.contract, trade.order, trade.orderStatus, trade.fills, trade.log)
+            del trades[key]
+            if permIds.get(trade.order.permId) is trade:
+                del permIds[trade.order.permId]
+            for fill in trade.fills:
+                if fills.pop(fill.execution.execId, None) is not None:
+                    fillCount += 1
+            tradeCount += 1
+        # Las ejecuciones que quedan sin orden en memoria se archivan por su antiguedad.
+        kept = {fill.execution.execId for trade in trades.values() for fill in trade.fills}
+        for execId, fill in list(fills.items()):
+            if execId not in kept and now - _epoch(fill.time, now) > self.maxAgeSeconds:
+                self.journal.record(ARCHIVED_FILL, fill)
+                del fills[execId]
+                fillCount += 1
+        self.archivedTrades += tradeCount
+        self.archivedFills += fillCount
+        if tradeCount > 0 or fillCount > 0:
+            metrics.ARCHIVED.increment(tradeCount, kind='trade')
+            metrics.ARCHIVED.increment(fillCount, kind='fill')
+            self.log.info(f'Archived {tradeCount} finished orders and {fillCount} fills. In memory: {len(trades)} orders and {len(fills)} fills.')
+        return tradeCount, fillCount
+
+
+
+    @staticmethod
+    def stores(ib):
+        '''
+        Returns the dictionaries where the orders and fills are kept in memory: (trades, permId2Trade, fills).
+        The simulated broker keeps them in its own dictionaries instead of the wrapper.
+        '''
+        if hasattr(ib, 'simulatedTrades'):
+            return ib.simulatedTrades, {}, ib.simulatedFills
+        return ib.wrapper.trades, ib.wrapper.permId2Trade, ib.wrapper.fills
+
+
+
+    def close(self):
+        self.journal.close()
+
+
+
+    def _finished_at(self, trade, now):
+        '''Returns the time of the last entry of the log of the trade, or now if it has none.'''
+        return _epoch(trade.log[-1].time, now) if len(trade.log) > 0 else now
+
+
+
+def _epoch(value, default):
+    '''Converts a datetime (naive is local time) to epoch seconds.'''
+    try:
+        return value.timestamp()
+    except (AttributeError, OverflowError, OSError, ValueError):
+        return default
+
+
+
+def read_archive(fileName):
+    '''
+    Reads the records of an archive.
+    return: Generator of tuples (timestamp, kind, args). The args of ARCHIVED_TRADE are
+    (contract, order, orderStatus, fills, log) and the ones of ARCHIVED_FILL are (fill,).
+    '''
+    for timestamp, kind, args in read_journal(fileName):
+        if kind in (ARCHIVED_TRADE, ARCHIVED_FILL):
+            yield timestamp, kind, args
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summary of an archive of finished orders and fills.')
+    parser.add_argument('archive', help='Archive file')
+    arguments = parser.parse_args()
+    trades = fills = 0
+    first = last = None
+    for timestamp, kind, args in read_archive(arguments.archive):
+        if kind == ARCHIVED_TRADE:
+            trades += 1
+            fills += len(args[3])
+        else:
+            fills += 1
+        first = timestamp if first is None else first
+        last = timestamp
+    print(f'Orders: {trades}, fills: {fills}')
+    if first is not None:
+        print(f'Archived from {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(first))} to {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last))}')
@@ -5,11 +5,23 @@ de interés, sus zonas horarias y excepciones como son navidad, y otros días fe
 Los datos de los mercados deben declararse dentro de la constante "TRADING_SESSIONS" siguiendo
 como ejemplo los mercados que ya estan contenidos en la estructura.
 Para conocer si el mercado está abierto se emplea el método "market_open()".
+Al crearse, el calendario se compila en intervalos de apertura y cierre en UTC, ordenados, para cada
+mercado y para un horizonte móvil de días, con las excepciones ya aplicadas. Así las consultas
+"is_open()", "next_open()" y "next_close()" se resuelven con una sola búsqueda binaria.
+Para muchas marcas de tiempo a la vez (backtests, planificación) están "is_open_array()" y
+"session_bounds()", que trabajan sobre arrays de NumPy con searchsorted y sin escribir en el log.
 '''
 
+import bisect
 import datetime
+import math
+import numpy as np
 import pytz
 import logging
+from clock import RealClock
+
+HORIZON_PAST_DAYS = 7        # Dias anteriores a hoy que se compilan.
+HORIZON_FUTURE_DAYS = 90     # Dias posteriores a hoy que se compilan.
 
 TRADING_SESSIONS = {
     "regular": {
@@ -63,20 +75,137 @@ TRADING_SESSIONS = {
 
 class TradingCalendar():
 
-    def __init__(self, localTimeZone, debugMode=False):
+    def __init__(self, localTimeZone, debugMode=False, horizonPastDays=HORIZON_PAST_DAYS, horizonFutureDays=HORIZON_FUTURE_DAYS, clock=None):
+        self.clock = clock if clock is not None else RealClock()   # Da la fecha de hoy para el horizonte compilado.
         self.tradingSessions = TRADING_SESSIONS
         self.localTimeZone = localTimeZone
+        self.localTimeZoneInfo = pytz.timezone(localTimeZone)
         self.debugMode = debugMode
+        self.horizonPastDays = horizonPastDays
+        self.horizonFutureDays = horizonFutureDays
+        self.sessions = {}          # market: {"opens": [...], "closes": [...]} en segundos UTC (epoch), ordenados, y sus copias en NumPy.
+        self.horizon = (0.0, 0.0)   # Intervalo de tiempo (epoch) en el que las sesiones compiladas son validas.
+        self.unknownMarkets = set()
         self.log = logging.getLogger('grid')
+        self.compile()
+
+
+    def compile(self, beginDate=None, endDate=None):
+        '''
+        Compiles the sessions of every market into sorted UTC open/close intervals, with the exceptions merged in.
+        beginDate: First date of the horizon. By default, today minus horizonPastDays.
+        endDate: Last date of the horizon. By default, today plus horizonFutureDays.
+        '''
+        today = self.clock.now().date()
+        beginDate = beginDate if beginDate is not None else today - datetime.timedelta(days=self.horizonPastDays)
+        endDate = endDate if endDate is not None else today + datetime.timedelta(days=self.horizonFutureDays)
+        self.sessions = {
+            market: self._compile_market(marketSession, beginDate, endDate)
+            for market, marketSession in self.tradingSessions['regular'].items()
+        }
+        # Se deja un dia de margen en cada extremo para cubrir la diferencia entre zonas horarias.
+        self.horizon = (
+            datetime.datetime(beginDate.year, beginDate.month, beginDate.day, tzinfo=pytz.utc).timestamp() + 86400,
+            datetime.datetime(endDate.year, endDate.month, endDate.day, tzinfo=pytz.utc).timestamp()
+        )
+        if self.debugMode: self.log.debug(f'Trading calendar compiled from {beginDate} to {endDate}')
+
+
+    def has_market(self, market):
+        '''Returns True if there is session data for the market, so it does not use the default schedule.'''
+        return market in self.tradingSessions['regular'] and market != 'DEFAULT_SCHEDULE'
+
+
+    def is_open(self, market, dateTime):
+        '''
+        Returns True if the market is open at the given moment.
+        dateTime: Epoch seconds, an aware datetime or a naive datetime in the local time zone of the bot.
+        '''
+        timestamp = self._timestamp(dateTime)
+        session = self._session(market, timestamp)
+        index = bisect.bisect_right(session['opens'], timestamp) - 1
+        return index >= 0 and timestamp < session['closes'][index]
+
+
+    def next_open(self, market, dateTime):
+        '''Returns the UTC datetime of the first opening after the given moment, or None if it is beyond the horizon.'''
+        timestamp = self._timestamp(dateTime)
+        session = self._session(market, timestamp)
+        index = bisect.bisect_right(session['opens'], timestamp)
+        if index >= len(session['opens']):
+            return None
+        return datetime.datetime.fromtimestamp(session['opens'][index], pytz.utc)
+
+
+    def next_close(self, market, dateTime):
+        '''
+        Returns the UTC datetime of the first closing after the given moment, or None if it is beyond the horizon.
+        If the market is open it is the end of the current session, otherwise the end of the next one.
+        '''
+        timestamp = self._timestamp(dateTime)
+        session = self._session(market, timestamp)
+        index = bisect.bisect_right(session['closes'], timestamp)
+        if index >= len(session['closes']):
+            return None
+        return datetime.datetime.fromtimestamp(session['closes'][index], pytz.utc)
+
+
+    def is_open_array(self, market, timestamps):
+        '''
+        Vectorized version of is_open().
+        timestamps: NumPy datetime64 array (UTC) or array of epoch seconds.
+        return: Boolean array, True where the market is open.
+        '''
+        return self.session_bounds(market, timestamps)[0]
+
+
+    def session_bounds(self, market, timestamps):
+        '''
+        Returns for each timestamp whether the market is open and the boundaries it falls between.
+        timestamps: NumPy datetime64 array (UTC) or array of epoch seconds.
+        return: Tuple (isOpen, begin, end) of arrays. If it is open, begin and end are the opening and closing
+                of the session. If it is closed, they are the previous closing and the next opening.
+                The boundaries are epoch seconds, NaN when they are beyond the compiled horizon.
+        '''
+        values = self._epoch_array(timestamps)
+        if values.size > 0:
+            self._ensure_horizon(float(values.min()), float(values.max()))
+        session = self._session(market, None)
+        opens = session['opensArray']
+        closes = session['closesArray']
+        if opens.size == 0:
+            nothing = np.full(values.shape, np.nan)
+            return np.zeros(values.shape, dtype=bool), nothing, nothing.copy()
+        index = np.searchsorted(opens, values, side='right') - 1
+        started = index >= 0
+        current = np.maximum(index, 0)
+        nextIndex = np.minimum(index + 1, opens.size - 1)
+        isOpen = started & (values < closes[current])
+        previousClose = np.where(started, closes[current], np.nan)
+        nextOpen = np.where(index + 1 < opens.size, opens[nextIndex], np.nan)
+        begin = np.where(isOpen, opens[current], previousClose)
+        end = np.where(isOpen, closes[current], nextOpen)
+        return isOpen, begin, end
 
 
     def market_open(self, market, dateTime, verbose=True):
         '''Devuelve True si el mercado especificado está abierto en el momento especificado.'''
+        marketOpen = self.is_open(market, dateTime)
+        if verbose and not marketOpen:
+            msg = f'The market {market} is closed at {dateTime}.'
+            self.log.info(msg)
+        return marketOpen
+
+
+    def market_open_by_rules(self, market, dateTime, verbose=True):
+        '''
+        Evaluates the session rules of the market without the compiled intervals.
+        It is the original implementation of market_open(), kept to verify and benchmark the compiled calendar.
+        '''
         if market not in self.tradingSessions['regular']:
             market = 'DEFAULT_SCHEDULE'
             msg = f"There is no session data for the {market} market. A default schedule will be used."
-            if verbose: print(msg)
-            self.log.info(msg)
+            if verbose: self.log.info(msg)
         marketSession = self.tradingSessions['regular'][market]                             # They obtain the session data of the specified market.
         dateTimeUTC = self._to_utc(dateTime, self.localTimeZone)                            # Converts the datetime to UTC.
         dateTimeOnMarketTimeZone = self._to_local(dateTimeUTC, marketSession['timeZone'])   # Converts it to the local date and time of the specified market.
@@ -89,37 +218,121 @@ class TradingCalendar():
             if dateTimeOnMarketTimeZone >= begin and dateTimeOnMarketTimeZone <= end:
                 if exceptionRange['closed']:
                     msg = f"The market {market} is exceptionally closed: {exceptionRange['note']}"
-                    if verbose: print(msg)
-                    self.log.info(msg)
+                    if verbose: self.log.info(msg)
                     return False
                 else:
                     msg = f"The market {market} is exceptionally open: {exceptionRange['note']}"
-                    if verbose: print(msg)
-                    self.log.info(msg)
+                    if verbose: self.log.info(msg)
                     return True
         weekDay = dateTimeOnMarketTimeZone.weekday()     # Gets the current day of the week in the specified market.
         hour = dateTimeOnMarketTimeZone.hour             # Gets the current time in the specified market.
         # Check the day of the week
         if weekDay < int(marketSession['weekDayOpen']) or weekDay > int(marketSession['weekDayClose']):
             msg = f'The market {market} is not open on {weekDay}.'
-            if verbose: print(msg)
-            self.log.info(msg)
+            if verbose: self.log.info(msg)
             return False
         # Check the time
         if hour < marketSession['hourOpen'] or hour >= marketSession['hourClose']:
             msg = f'The market {market} is not open at local hour {hour}.'
-            if verbose: print(msg)
-            self.log.info(msg)
-            return False        
+            if verbose: self.log.info(msg)
+            return False
         return True
-    
-    
+
+
+    def _session(self, market, timestamp):
+        '''
+        Returns the compiled session of the market, recompiling the horizon around the timestamp if it is outside.
+        If timestamp is None, the horizon is not checked.
+        '''
+        if timestamp is not None:
+            self._ensure_horizon(timestamp, timestamp)
+        if market not in self.sessions:
+            if market not in self.unknownMarkets:
+                self.unknownMarkets.add(market)
+                msg = f"There is no session data for the {market} market. A default schedule will be used."
+                self.log.info(msg)
+            market = 'DEFAULT_SCHEDULE'
+        return self.sessions[market]
+
+
+    def _ensure_horizon(self, first, last):
+        '''Recompiles the sessions if the period between the epoch seconds first and last is not inside the horizon.'''
+        if first < self.horizon[0] or last >= self.horizon[1]:
+            beginDate = datetime.datetime.fromtimestamp(first, pytz.utc).date()
+            endDate = datetime.datetime.fromtimestamp(last, pytz.utc).date()
+            self.compile(beginDate - datetime.timedelta(days=self.horizonPastDays), endDate + datetime.timedelta(days=self.horizonFutureDays))
+
+
+    def _compile_market(self, marketSession, beginDate, endDate):
+        '''Builds the sorted UTC intervals of a market between two dates.'''
+        timeZone = pytz.timezone(marketSession['timeZone'])
+        weekDayOpen = int(marketSession['weekDayOpen'])
+        weekDayClose = int(marketSession['weekDayClose'])
+        # Las horas pueden tener decimales, por ejemplo 9.5 son las 09:30.
+        hourOpen = datetime.timedelta(hours=marketSession['hourOpen'])
+        hourClose = datetime.timedelta(hours=marketSession['hourClose'])
+        intervals = []
+        if hourOpen < hourClose:
+            day = beginDate - datetime.timedelta(days=1)
+            while day <= endDate + datetime.timedelta(days=1):
+                if weekDayOpen <= day.weekday() <= weekDayClose:
+                    midnight = datetime.datetime(day.year, day.month, day.day)
+                    intervals.append([
+                        self._epoch(midnight + hourOpen, timeZone),
+                        self._epoch(midnight + hourClose, timeZone)
+                    ])
+                day += datetime.timedelta(days=1)
+        # Las excepciones se aplican en orden inverso para que, como en las reglas, gane la primera que coincida.
+        for exceptionRange in reversed(list(marketSession['exceptions'].values())):
+            begin = self._epoch(datetime.datetime.strptime(exceptionRange['dateTimeBegin'], "%Y-%m-%d %H:%M"), timeZone)
+            end = self._epoch(datetime.datetime.strptime(exceptionRange['dateTimeEnd'], "%Y-%m-%d %H:%M"), timeZone)
+            if end < begin:
+                continue    # Excepcion mal definida, nunca coincide.
+            end = math.nextafter(end, math.inf)     # El final de la excepcion esta incluido.
+            if exceptionRange['closed']:
+                intervals = [part for interval in intervals for part in _subtract(interval, begin, end)]
+            else:
+                intervals.append([begin, end])
+        intervals.sort()
+        merged = []
+        for interval in intervals:
+            if merged and interval[0] <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], interval[1])
+            else:
+                merged.append(list(interval))
+        opens = [interval[0] for interval in merged]
+        closes = [interval[1] for interval in merged]
+        return {"opens": opens, "closes": closes, "opensArray": np.array(opens, dtype=np.float64), "closesArray": np.array(closes, dtype=np.float64)}
+
+
+    def _timestamp(self, dateTime):
+        '''Converts epoch seconds, an aware datetime or a naive datetime in the local time zone to epoch seconds.'''
+        if isinstance(dateTime, (int, float)):
+            return float(dateTime)
+        if dateTime.tzinfo is None:
+            return self._epoch(dateTime, self.localTimeZoneInfo)
+        return dateTime.timestamp()
+
+
+    def _epoch_array(self, timestamps):
+        '''Converts a NumPy datetime64 array (UTC) or a sequence of epoch seconds to a float array of epoch seconds.'''
+        values = np.asarray(timestamps)
+        if np.issubdtype(values.dtype, np.datetime64):
+            return values.astype('datetime64[ns]').astype(np.int64) / 1e9
+        return values.astype(np.float64)
+
+
+    def _epoch(self, naiveDateTime, timeZone):
+        '''Returns the epoch seconds of a naive datetime in the given pytz time zone.'''
+        return timeZone.localize(naiveDateTime, is_dst=False).timestamp()
+
+
     def _to_local(self, dateTime, localTimeZone):
-        if self.debugMode: print('dateTime:', dateTime.strftime('%Y-%m-%d %H:%M:%S %Z%z'))
+        if self.debugMode: self.log.debug('dateTime: ' + dateTime.strftime('%Y-%m-%d %H:%M:%S %Z%z'))
         onLocalTimeZone = dateTime.astimezone(pytz.timezone(localTimeZone))
-        if self.debugMode: print('dateTimeOnLocalTimeZone:', onLocalTimeZone.strftime('%Y-%m-%d %H:%M:%S %Z%z'))
+        if self.debugMode: self.log.debug('dateTimeOnLocalTimeZone: ' + onLocalTimeZone.strftime('%Y-%m-%d %H:%M:%S %Z%z'))
         return onLocalTimeZone
-        
+
 
     def _localized(self, dateTime, localTimeZone):   #"America/New_York"
         '''Convert to datetime object with local timezone.'''
@@ -127,14 +340,27 @@ class TradingCalendar():
         naiveDateTime = dateTime  #datetime.datetime.strptime(dateTime, "%Y-%m-%d %H:%M:%S")   # Convert to naive datetime object
         localDateTime = localTime.localize(naiveDateTime, is_dst=None)              # Update naive datetime object with local timezone
         return localDateTime
-    
 
-    def _to_utc(self, dateTime, localTimeZone): 
+
+    def _to_utc(self, dateTime, localTimeZone):
         '''Convert datetime object with local timezone to UTC.'''
         localDateTime = self._localized(dateTime, localTimeZone)    # Convert to datetime object with local timezone
         return localDateTime.astimezone(pytz.utc)                   # Convert to UTC
 
 
+
+def _subtract(interval, begin, end):
+    '''Returns the parts of the interval [open, close) that are outside [begin, end).'''
+    if interval[1] <= begin or interval[0] >= end:
+        return [interval]
+    parts = []
+    if interval[0] < begin:
+        parts.append([interval[0], begin])
+    if interval[1] > end:
+        parts.append([end, interval[1]])
+    return parts
+
+
 if __name__ == "__main__":
     
     SERVER_LOCATION = "Europe/Berlin"